@@ -0,0 +1,46 @@
+# No shebang line, this module is meant to be run with python
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the cost of constructing :class:`pyfarm.core.config.Configuration`
+eagerly against ``lazy=True``.  Run from the root of the repository
+with ``PYTHONPATH=. python benchmarks/configuration_init.py``.  Logging is
+disabled so the results only include the cost of the instance itself.
+"""
+
+from __future__ import print_function
+
+from timeit import repeat
+
+SETUP = """
+import logging
+from pyfarm.core.config import Configuration
+logging.disable(logging.CRITICAL)
+"""
+NUMBER = 1000
+
+
+def run(statement):
+    best = min(repeat(statement, setup=SETUP, repeat=5, number=NUMBER))
+    return best / NUMBER * 1e6
+
+
+if __name__ == "__main__":
+    for label, statement in (
+            ("eager", "Configuration('pyfarm.core')"),
+            ("lazy", "Configuration('pyfarm.core', lazy=True)"),
+            ("lazy + get", "Configuration('pyfarm.core', lazy=True).get('a')")):
+        print("%-12s %8.2f usec per instance" % (label, run(statement)))
@@ -0,0 +1,80 @@
+# No shebang line, this module is meant to be run with python
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the cost of parsing a generated configuration file with the pure
+Python YAML loader, the libyaml loader (when available) and the compiled
+file produced by :func:`pyfarm.core.config.compile_file`.  Run from the
+root of the repository with
+``PYTHONPATH=. python benchmarks/configuration_parse.py``.
+"""
+
+from __future__ import print_function
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import repeat
+
+import yaml
+
+SETUP = """
+import logging
+import yaml
+from pyfarm.core.config import compile_file, load_compiled
+logging.disable(logging.CRITICAL)
+path = %r
+compiled = compile_file(path)
+"""
+NUMBER = 200
+KEYS = 200
+
+
+def write_configuration(path):
+    data = {}
+    for i in range(KEYS):
+        data["key%d" % i] = {
+            "enabled": bool(i % 2), "value": i, "name": "value_$key%d" % i,
+            "items": list(range(5))}
+
+    with open(path, "w") as stream:
+        yaml.dump(data, stream, default_flow_style=False)
+
+
+def run(statement, path):
+    best = min(repeat(statement, setup=SETUP % path, repeat=5, number=NUMBER))
+    return best / NUMBER * 1e6
+
+
+if __name__ == "__main__":
+    tempdir = mkdtemp()
+    path = os.path.join(tempdir, "benchmark.yml")
+    write_configuration(path)
+    statements = [
+        ("yaml.Loader", "yaml.load(open(path, 'rb'), Loader=yaml.Loader)")]
+
+    if getattr(yaml, "__with_libyaml__", False):
+        statements.append(
+            ("yaml.CLoader",
+             "yaml.load(open(path, 'rb'), Loader=yaml.CLoader)"))
+
+    statements.append(("compiled", "load_compiled(path, compiled)"))
+
+    try:
+        for label, statement in statements:
+            print("%-14s %10.2f usec per file" % (label, run(statement, path)))
+    finally:
+        rmtree(tempdir)
@@ -0,0 +1,84 @@
+# No shebang line, this module is meant to be run with python
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares parsing the files found by a
+:class:`pyfarm.core.config.ConfigurationSet` one after the other, which is
+what :meth:`ConfigurationSet.load` does, against parsing them on a thread
+pool.  YAML parsing holds the GIL so the pool only adds overhead.  Run
+from the root of the repository with
+``PYTHONPATH=. python benchmarks/configuration_set_parse.py``.
+"""
+
+from __future__ import print_function
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import repeat
+
+import yaml
+
+SETUP = """
+import logging
+from multiprocessing.pool import ThreadPool
+from pyfarm.core.config import Configuration
+logging.disable(logging.CRITICAL)
+paths = %r
+
+def parse(path):
+    config = Configuration("benchmark", "1.0.0")
+    return config._parse_files([path])
+
+pool = ThreadPool(8)
+"""
+NUMBER = 5
+FILES = 16
+KEYS = 400
+STATEMENTS = (
+    ("sequential", "list(map(parse, paths))"),
+    ("thread pool", "pool.map(parse, paths)"))
+
+
+def write_configuration(path):
+    data = {}
+    for i in range(KEYS):
+        data["key%d" % i] = {
+            "enabled": bool(i % 2), "value": i, "name": "value_$key%d" % i}
+
+    with open(path, "w") as stream:
+        yaml.dump(data, stream, default_flow_style=False)
+
+
+def run(statement, paths):
+    best = min(repeat(
+        statement, setup=SETUP % paths, repeat=5, number=NUMBER))
+    return best / NUMBER * 1e3
+
+
+if __name__ == "__main__":
+    tempdir = mkdtemp()
+    paths = []
+    for i in range(FILES):
+        paths.append(os.path.join(tempdir, "benchmark%d.yml" % i))
+        write_configuration(paths[-1])
+
+    try:
+        for label, statement in STATEMENTS:
+            print("%-12s %10.2f msec for %d files" % (
+                label, run(statement, paths), FILES))
+    finally:
+        rmtree(tempdir)
@@ -0,0 +1,79 @@
+# No shebang line, this module is meant to be run with python
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares :class:`pyfarm.core.enums.Values` against the previous
+implementation, which compared every value through ``__contains__``.  Run
+from the root of the repository with
+``PYTHONPATH=. python benchmarks/enum_compare.py``.
+"""
+
+from __future__ import print_function
+
+from timeit import repeat
+
+SETUP = """
+from collections import namedtuple
+from pyfarm.core.enums import Values, STRING_TYPES
+
+class Legacy(namedtuple("Legacy", ("int", "str"))):
+    NUMERIC_TYPES = Values.NUMERIC_TYPES
+
+    def __hash__(self):
+        return self.str.__hash__()
+
+    def __contains__(self, item):
+        if isinstance(item, STRING_TYPES):
+            return item == self.str
+        elif isinstance(item, self.NUMERIC_TYPES):
+            return item == self.int
+        elif isinstance(item, Legacy):
+            return item.str == self.str and item.int == self.int
+        else:
+            return False
+
+    def __eq__(self, other):
+        return self.__contains__(other)
+
+Values.check_uniqueness = False
+{cls}.check_uniqueness = False
+running = {cls}(105, "running")
+same = {cls}(105, "running")
+done = {cls}(106, "done")
+keys = dict.fromkeys([running, done])
+"""
+NUMBER = 1000000
+STATEMENTS = (
+    ("member == member", "running == same"),
+    ("member != member", "running == done"),
+    ("member == str", "running == 'running'"),
+    ("member == int", "running == 105"),
+    ("str == member", "'running' == running"),
+    ("member as key", "keys[running]"),
+    ("str as key", "keys['running']"))
+
+
+def run(cls, statement):
+    best = min(repeat(
+        statement, setup=SETUP.format(cls=cls), repeat=5, number=NUMBER))
+    return best / NUMBER * 1e9
+
+
+if __name__ == "__main__":
+    print("%-18s %10s %10s" % ("", "legacy", "Values"))
+    for label, statement in STATEMENTS:
+        print("%-18s %8.1fns %8.1fns" % (
+            label, run("Legacy", statement), run("Values", statement)))
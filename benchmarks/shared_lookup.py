@@ -0,0 +1,53 @@
+# No shebang line, this module is meant to be run with python
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures lookups in a :class:`pyfarm.core.config.SharedConfiguration`
+containing a few thousand keys.  Run from the root of the repository with
+``PYTHONPATH=. python benchmarks/shared_lookup.py``.
+"""
+
+from __future__ import print_function
+
+from timeit import repeat
+
+SETUP = """
+import logging
+from pyfarm.core.config import Configuration
+logging.disable(logging.CRITICAL)
+config = Configuration("agent", "1.2.3")
+config.update(
+    ("key%%d" %% i, {"value": i, "path": "/tmp/%%d" %% i})
+    for i in range(%d))
+shared = config.share()
+"""
+NUMBER = 100000
+KEYS = 5000
+STATEMENTS = (
+    ("existing key", "shared['key2500']"),
+    ("contains", "'key2500' in shared"),
+    ("missing key", "shared.get('missing')"))
+
+
+def run(statement):
+    best = min(repeat(
+        statement, setup=SETUP % KEYS, repeat=5, number=NUMBER))
+    return best / NUMBER * 1e9
+
+
+if __name__ == "__main__":
+    for label, statement in STATEMENTS:
+        print("%-14s %10.1f nsec" % (label, run(statement)))
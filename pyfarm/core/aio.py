@@ -0,0 +1,156 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Asynchronous Configuration
+==========================
+
+:mod:`asyncio` versions of :meth:`.Configuration.load` and
+:meth:`.Configuration.reload`.  Directory listings, stat calls and parsing
+run in an executor, directories are listed concurrently and the results
+are only merged into the instance once everything has been read.  The
+files themselves are parsed by a single call in the executor, parsing
+holds the GIL so doing it concurrently would only make it slower.
+Neither the merge nor the notification of subscribers awaits so other
+tasks on the event loop will either see the old data or the new data,
+never a partial load.
+
+.. note::
+
+    This module requires Python 3.7 or higher.  Under older versions use
+    :meth:`.Configuration.load` instead.
+"""
+
+import asyncio
+from functools import partial
+from os.path import basename, dirname
+from timeit import default_timer
+
+from pyfarm.core.logger import getLogger
+
+logger = getLogger("core.aio")
+
+
+async def _gather(executor, function, arguments):
+    """
+    Calls ``function`` once for each entry in ``arguments`` in ``executor``
+    and returns the results in the same order as ``arguments``.
+    """
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*[
+        loop.run_in_executor(executor, function, argument)
+        for argument in arguments])
+
+
+async def read_documents(config, snapshot=False, executor=None):
+    """
+    Returns the ``(filepath, data)`` tuples for ``config`` without
+    modifying the data in ``config``.  Only :attr:`.Configuration.listing`
+    and the parse cache are updated.
+
+    :param bool snapshot:
+        See the documentation for ``snapshot`` in
+        :meth:`.Configuration.load`
+
+    :param executor:
+        The :class:`concurrent.futures.Executor` to run blocking calls
+        in.  Defaults to the event loop's default executor.
+    """
+    loop = asyncio.get_running_loop()
+    run = partial(loop.run_in_executor, executor)
+    trace = config._start_trace()
+    start = default_timer()
+
+    # Resolving these may search the environment, the installed
+    # distributions and the disk so it's done off the event loop.  The
+    # version is needed by directories() below.
+    roots = await run(config.roots)
+    package_configuration = await run(
+        getattr, config, "package_configuration")
+    await run(config.split_version)
+
+    # List the roots, then the directories found inside of them and then
+    # the fragment directories found inside of those.  Each result is
+    # cached in config.listing so files() below won't block.
+    candidates = list(roots)
+    if package_configuration is not None:
+        candidates.append(dirname(package_configuration))
+
+    await _gather(executor, config.listdir, candidates)
+    directories = config.directories()
+    await _gather(executor, config.listdir, directories)
+    fragment_directories = []
+    for directory in directories:
+        fragment_directory = config.fragment_directory(directory)
+        entries = config.listdir(directory)
+        if entries is not None and basename(fragment_directory) in entries[0]:
+            fragment_directories.append(fragment_directory)
+
+    await _gather(executor, config.listdir, fragment_directories)
+    files = config.files()
+    start = trace.record("discovery", start)
+
+    # Remote documents are requested while the files are being read
+    remotes = asyncio.gather(*[
+        run(source.fetch, config) for source in config.remotes])
+    documents = None
+
+    if snapshot:
+        documents = await run(config._read_snapshot, files)
+        trace.record("snapshot", start)
+
+    if documents is None:
+        # A single call so the parse stage of the trace is
+        # recorded once, see ConfigurationSet._parse()
+        documents = await run(config._parse_files, files)
+
+        if snapshot:
+            start = default_timer()
+            await run(config._write_snapshot, files, documents)
+            trace.record("snapshot", start)
+
+    await remotes
+    return documents + config._remote_documents(fetch=False)
+
+
+async def load(config, environment=None, snapshot=False, executor=None):
+    """
+    Asynchronous version of :meth:`.Configuration.load`, returns
+    ``config`` once loaded.
+
+    :param executor:
+        See the documentation for ``executor`` in :func:`read_documents`
+    """
+    documents = await read_documents(
+        config, snapshot=snapshot, executor=executor)
+    config._publish(documents, environment=environment)
+    return config
+
+
+async def reload(config, environment=None, snapshot=False, executor=None):
+    """
+    Asynchronous version of :meth:`.Configuration.reload`, returns
+    ``config`` once reloaded.
+
+    :param executor:
+        See the documentation for ``executor`` in :func:`read_documents`
+    """
+    config.listing.clear()
+    documents = await read_documents(
+        config, snapshot=snapshot, executor=executor)
+    config._publish(documents, environment=environment, clear=True)
+    logger.debug("Reloaded %r", config.name)
+    return config
@@ -28,31 +28,62 @@ in various forms.
 :const BOOLEAN_FALSE:
     set of values which will return a False boolean value from
     :func:`.read_env_bool`
+
+:const MERGE_REPLACE:
+    merge policy which replaces the existing value
+
+:const MERGE_DEEP:
+    merge policy which recursively merges dictionaries
+
+:const MERGE_APPEND:
+    merge policy which concatenates lists
+
+:envvar PYFARM_RECORD_ENV_READS:
+    if set to a true value, :func:`record_env_reads` will be called when
+    this module is imported and a report will be logged when the
+    process exits
 """
 
 import os
+import sys
+import mmap
+import atexit
+import marshal
+import select
+import struct
 from ast import literal_eval
+from collections import namedtuple
 from errno import EEXIST
 from functools import partial
-from pprint import pformat
 from string import Template
-from itertools import product
-from tempfile import gettempdir
-from os.path import isfile, join, isdir, expanduser, expandvars, abspath
+from threading import Thread, Event, Lock, RLock
+from timeit import default_timer
+from os.path import (
+    isfile, join, isdir, expanduser, expandvars, abspath, dirname, basename,
+    normpath)
 
 try:
     from StringIO import StringIO
 except ImportError:  # pragma: no cover
     from io import StringIO
 
-from pkg_resources import (
-    DistributionNotFound, get_distribution, resource_filename)
+try:
+    import cPickle as pickle
+except ImportError:  # pragma: no cover
+    import pickle
+
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:  # pragma: no cover
+    from collections import Mapping, Sequence
 
-import yaml
 try:
-    from yaml.loader import CLoader as Loader
+    from os import scandir
 except ImportError:  # pragma: no cover
-    from yaml.loader import Loader
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 from pyfarm.core.logger import getLogger
 from pyfarm.core.enums import (
@@ -65,6 +96,442 @@ logger = getLogger("core.config")
 BOOLEAN_TRUE = set(["1", "t", "y", "true", "yes"])
 BOOLEAN_FALSE = set(["0", "f", "n", "false", "no"])
 
+MERGE_REPLACE = "replace"
+MERGE_DEEP = "merge"
+MERGE_APPEND = "append"
+MERGE_POLICIES = frozenset([MERGE_REPLACE, MERGE_DEEP, MERGE_APPEND])
+
+
+def _pformat(value):
+    """
+    Calls :func:`pprint.pformat`.  :mod:`pprint` is only needed for
+    log messages so it's imported on first use.
+    """
+    from pprint import pformat
+    return pformat(value)
+
+
+def _yaml():
+    """
+    Imports and returns :mod:`yaml`.  This is deferred until a configuration
+    file is parsed, or a parse error is handled, because importing
+    :mod:`yaml` is relatively slow.
+    """
+    import yaml
+    return yaml
+
+
+_yaml_loader = None
+
+
+def _load_yaml(stream):
+    """
+    Parses ``stream`` using the fastest :mod:`yaml` loader available,
+    :class:`yaml.CLoader` if libyaml is installed.
+    """
+    global _yaml_loader
+    yaml = _yaml()
+
+    if _yaml_loader is None:
+        try:
+            from yaml import CLoader as _yaml_loader
+        except ImportError:  # pragma: no cover
+            from yaml import Loader as _yaml_loader
+
+    return yaml.load(stream, Loader=_yaml_loader)
+
+
+def _environ_data():
+    """
+    Returns the dictionary which backs :class:`os.environ`.  Reading
+    from this directly, using keys from :func:`_environ_key`, avoids
+    decoding each value which :class:`os.environ` would otherwise do.
+    """
+    for attribute in ("_data", "data"):
+        data = getattr(os.environ, attribute, None)
+        if isinstance(data, dict):
+            return data
+    return dict(os.environ)  # pragma: no cover
+
+
+# Converts a variable name to the key used by _environ_data()
+_environ_key = getattr(os.environ, "encodekey", None) or (lambda key: key)
+
+
+def merge(base, update, policies=None, default=MERGE_REPLACE, path=None):
+    """
+    Returns a new dictionary containing the data from ``update`` merged
+    on top of ``base``.  Neither input is modified, any value which is not
+    changed by the merge is shared with ``base`` rather than copied.
+
+    >>> base = {"a": {"b": 1, "c": [1]}, "d": {"e": 1}}
+    >>> merged = merge(base, {"a": {"c": [2]}}, policies={"a.c": "append"},
+    ...                default="merge")
+    >>> assert merged == {"a": {"b": 1, "c": [1, 2]}, "d": {"e": 1}}
+    >>> assert merged["d"] is base["d"]
+
+    :param dict policies:
+        Maps keys, with nested keys joined by ``.``, to one of
+        :const:`MERGE_REPLACE`, :const:`MERGE_DEEP` or
+        :const:`MERGE_APPEND`.
+
+    :param string default:
+        The policy to use for keys which are not in ``policies``
+
+    :param string path:
+        The key ``base`` and ``update`` are nested under, used to
+        lookup nested keys in ``policies``.
+
+    :raises ValueError:
+        Raised if an unknown merge policy is used
+    """
+    policies = policies or {}
+    merged = dict(base)
+
+    for key, value in update.items():
+        keypath = key if path is None else "%s.%s" % (path, key)
+
+        if key in merged:
+            value = _merge_value(
+                merged[key], value, policies.get(keypath, default),
+                policies, keypath)
+
+        merged[key] = value
+
+    return merged
+
+
+def _copy_containers(value):
+    """
+    Returns a copy of ``value`` in which every nested dictionary and list
+    is copied too, anything else is immutable once parsed and is shared.
+    This is much faster than :func:`copy.deepcopy` for parsed documents.
+    """
+    if isinstance(value, dict):
+        return dict(
+            (key, _copy_containers(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_copy_containers(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_copy_containers(item) for item in value)
+    return value
+
+
+def _merge_value(base, value, policy, policies, path):
+    """
+    Returns the result of merging ``value`` on top of
+    ``base`` using ``policy``.
+    """
+    if policy not in MERGE_POLICIES:
+        raise ValueError("Unknown merge policy %r for %r" % (policy, path))
+
+    if policy == MERGE_DEEP \
+            and isinstance(base, dict) and isinstance(value, dict):
+        return merge(base, value, policies, MERGE_DEEP, path)
+
+    if policy == MERGE_APPEND \
+            and isinstance(base, list) and isinstance(value, list):
+        return base + value
+
+    return value
+
+
+class ChangeSet(namedtuple("ChangeSet", ("added", "removed", "changed"))):
+    """
+    The keys which were added, removed or changed between two versions of
+    a :class:`Configuration`, each stored as a :class:`frozenset`.
+    Variables in the ``env`` section of the configuration files are
+    included as ``env.<name>``.  A change set is only ``True`` if it
+    contains at least one key.
+    """
+    __slots__ = ()
+
+    @property
+    def keys(self):
+        """Every key in the change set"""
+        return self.added | self.removed | self.changed
+
+    def affects(self, keys):
+        """
+        Returns True if any key in ``keys``, or any key nested below it such
+        as ``env`` for ``env.HOME``, is part of the change set.
+        """
+        changed_keys = self.keys
+
+        for key in keys:
+            if key in changed_keys:
+                return True
+
+            prefix = key + "."
+            for changed_key in changed_keys:
+                if changed_key.startswith(prefix):
+                    return True
+
+        return False
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    __nonzero__ = __bool__
+
+
+def diff(old, new):
+    """
+    Compares the top level keys in ``old`` and ``new`` and returns
+    a :class:`ChangeSet`.
+    """
+    old_keys = frozenset(old)
+    new_keys = frozenset(new)
+    changed = set()
+
+    for key in old_keys & new_keys:
+        old_value = old[key]
+        new_value = new[key]
+        if old_value is not new_value and old_value != new_value:
+            changed.add(key)
+
+    return ChangeSet(
+        new_keys - old_keys, old_keys - new_keys, frozenset(changed))
+
+
+class FileTrace(object):
+    """
+    The counters and timings for one file in a :class:`LoadTrace`.  Times
+    are in seconds.
+
+    :var int stats:
+        The number of times the file, or its compiled version,
+        was passed to :func:`os.stat`.
+
+    :var int bytes:
+        The number of bytes read, zero if the previously parsed data
+        was reused.
+
+    :var bool cached:
+        True if the data parsed by a previous load was reused.
+    """
+    __slots__ = (
+        "path", "stats", "bytes", "parse_time", "merge_time", "cached")
+
+    def __init__(self, path):
+        self.path = path
+        self.stats = 0
+        self.bytes = 0
+        self.parse_time = 0.0
+        self.merge_time = 0.0
+        self.cached = False
+
+    def as_dict(self):
+        """Returns the trace as a dictionary"""
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class LoadTrace(object):
+    """
+    The time spent in each stage of a load along with a :class:`FileTrace`
+    for each file.  A new instance is stored as ``trace`` on a
+    :class:`Configuration` each time it's loaded.  Times are in seconds.
+
+    :var dict stages:
+        The time spent in each of the stages in :attr:`STAGES`.  Stages
+        which did not run are not included.  ``expansion`` is only
+        present if ``frozen`` is set because otherwise values are not
+        expanded until they're retrieved.
+
+    :var int listings:
+        The number of directories read while searching for files.
+
+    :var float duration:
+        The total time spent loading or ``None`` if the load
+        has not finished.
+    """
+    STAGES = (
+        "discovery", "snapshot", "parse", "remote", "merge", "schema",
+        "expansion", "notify")
+
+    def __init__(self):
+        self.start = default_timer()
+        self.duration = None
+        self.listings = 0
+        self.stages = {}
+        self.files = {}
+        self.paths = []
+
+    def file(self, path):
+        """Returns the :class:`FileTrace` for ``path``"""
+        try:
+            return self.files[path]
+        except KeyError:
+            self.paths.append(path)
+            return self.files.setdefault(path, FileTrace(path))
+
+    def record(self, stage, start):
+        """
+        Adds the time since ``start`` to ``stage`` and returns the current
+        time so it can be used as the start of the next stage.
+        """
+        now = default_timer()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - start
+        return now
+
+    def finish(self):
+        """Sets ``duration``"""
+        self.duration = default_timer() - self.start
+
+    def as_dict(self):
+        """Returns the trace as a dictionary"""
+        return {
+            "duration": self.duration,
+            "listings": self.listings,
+            "stages": dict(self.stages),
+            "files": [self.files[path].as_dict() for path in self.paths]}
+
+    def __str__(self):
+        stages = ", ".join(
+            "%s=%.2fms" % (stage, self.stages[stage] * 1e3)
+            for stage in self.STAGES if stage in self.stages)
+        lines = ["%.2fms (%s), %d directories listed" % (
+            (self.duration or 0.0) * 1e3, stages, self.listings)]
+
+        for path in self.paths:
+            trace = self.files[path]
+            lines.append(
+                "    %s: %d stat(s), %d bytes, parse=%.2fms, "
+                "merge=%.2fms%s" % (
+                    path, trace.stats, trace.bytes, trace.parse_time * 1e3,
+                    trace.merge_time * 1e3,
+                    " (cached)" if trace.cached else ""))
+
+        return "\n".join(lines)
+
+
+COMPILED_MAGIC = b"PFCC\x02"
+
+# The modification time, in nanoseconds, and size of the source file
+# the compiled data was produced from.
+COMPILED_SOURCE = struct.Struct("<qq")
+
+
+def _source_signature(stat):
+    """
+    Returns the ``(mtime_ns, size)`` of ``stat`` which is stored in, and
+    compared against, the header of compiled files.
+    """
+    mtime_ns = getattr(stat, "st_mtime_ns", None)
+    if mtime_ns is None:  # pragma: no cover
+        mtime_ns = int(stat.st_mtime * 1e9)
+    return mtime_ns, stat.st_size
+
+
+def compile_file(path, output=None):
+    """
+    Parses the YAML file at ``path`` and writes the data to ``output``
+    using :mod:`marshal` which is much faster to load than YAML, especially
+    when libyaml is not available.  The modification time and size of
+    ``path`` are stored along with the data and :class:`Configuration` will
+    only use the compiled file in place of ``path`` while both still match
+    exactly.  Comparing the times for equality, rather than checking the
+    compiled file is newer, means edits on file systems with a coarse
+    timestamp resolution and deployments which preserve timestamps, such
+    as ``rsync -t``, are still noticed.  Returns the path to the compiled
+    file.
+
+    :param string output:
+        The path to write the compiled data to.  Defaults to ``path`` plus
+        :attr:`Configuration.COMPILED_EXTENSION`.
+
+    :raises ValueError:
+        Raised if the data in ``path`` contains types which can't be
+        stored by :mod:`marshal`, such as dates.
+    """
+    if output is None:
+        output = path + Configuration.COMPILED_EXTENSION
+
+    # The file is checked before it's read so a change made while
+    # reading it results in a mismatch rather than stale data.
+    with open(path, "rb") as stream:
+        signature = _source_signature(os.fstat(stream.fileno()))
+        data = marshal.dumps(_load_yaml(stream))
+
+    from tempfile import mkstemp
+    fd, temporary_path = mkstemp(dir=dirname(abspath(output)))
+    with os.fdopen(fd, "wb") as stream:
+        stream.write(
+            COMPILED_MAGIC + COMPILED_SOURCE.pack(*signature) + data)
+
+    # mkstemp() creates files only the current user can read
+    os.chmod(temporary_path, 0o644)
+
+    try:
+        os.rename(temporary_path, output)
+    except OSError:  # pragma: no cover
+        # Windows won't rename over an existing file
+        os.remove(output)
+        os.rename(temporary_path, output)
+
+    return output
+
+
+def load_compiled(path, compiled):
+    """
+    Returns the data from the ``compiled`` version of ``path`` or
+    :const:`NOTSET` if ``compiled`` does not exist, was produced from a
+    different version of ``path`` or can't be read.
+    """
+    return _read_compiled(path, compiled)[0]
+
+
+def _read_compiled(path, compiled):
+    """
+    Implementation of :func:`load_compiled` which returns a tuple of
+    the data and the number of bytes read.
+    """
+    try:
+        signature = _source_signature(os.stat(path))
+
+        with open(compiled, "rb") as stream:
+            data = stream.read()
+
+        if not data.startswith(COMPILED_MAGIC):
+            logger.warning("%r is not a compiled configuration", compiled)
+            return NOTSET, len(data)
+
+        offset = len(COMPILED_MAGIC) + COMPILED_SOURCE.size
+        if COMPILED_SOURCE.unpack(data[len(COMPILED_MAGIC):offset]) \
+                != signature:
+            logger.debug("%r was not compiled from %r", compiled, path)
+            return NOTSET, len(data)
+
+        return marshal.loads(data[offset:]), len(data)
+
+    except (OSError, IOError):
+        return NOTSET, 0
+
+    except (EOFError, ValueError, TypeError, struct.error) as e:
+        logger.warning("Failed to load %r: %s", compiled, e)
+        return NOTSET, len(data)
+
+
+def compile_main(argv=None):
+    """
+    Entry point for ``pyfarm-compile-config`` which runs
+    :func:`compile_file` on each path provided on the command line.
+    """
+    paths = sys.argv[1:] if argv is None else argv
+
+    if not paths:
+        sys.stderr.write("usage: pyfarm-compile-config FILE [FILE ...]\n")
+        return 1
+
+    for path in paths:
+        try:
+            logger.info("Compiled %r to %r", path, compile_file(path))
+        except (OSError, IOError, ValueError, _yaml().YAMLError) as e:
+            logger.error("Failed to compile %r: %s", path, e)
+            return 1
+
+    return 0
+
 
 def read_env(envvar, default=NOTSET, warn_if_unset=False, eval_literal=False,
              raise_eval_exception=True, log_result=True, desc=None):
@@ -236,397 +703,643 @@ read_env_int = partial(read_env_strict_number, number_type=int)
 read_env_float = partial(read_env_strict_number, number_type=float)
 
 
-class Configuration(dict):
+class EnvReadRecorder(object):
     """
-    Main object responsible for finding, loading, and
-    merging configuration data.  By default this class does nothing
-    until :meth:`load` is called.  Once this method is called
-    :class:`Configuration` class will populate itself with data loaded
-    from the configuration files.  The configuration files themselves can
-    be loaded from multiple location depending on the system's setup.  For
-    example on Linux you might end up attempting to load these files for
-    pyfarm.agent v1.2.3:
+    Records each call to :func:`read_env`, including the calls made by
+    :func:`read_env_bool`, :func:`read_env_number` and the other wrappers.
+    For each environment variable this keeps the number of reads, how
+    many of those reads returned the default value, the total time spent
+    in :func:`read_env` and the modules the reads came from.  Instances
+    are created by :func:`record_env_reads`.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.variables = {}
+
+    def wrap(self, function):
+        """Returns a wrapper around ``function`` which records each call"""
+        def read_env(envvar, *args, **kwargs):
+            default_used = envvar not in os.environ
+            start = default_timer()
+            try:
+                return function(envvar, *args, **kwargs)
+            finally:
+                self.record(
+                    envvar, default_used, default_timer() - start,
+                    self.caller())
+
+        read_env.__doc__ = function.__doc__
+        read_env.recorder = self
+        return read_env
+
+    @staticmethod
+    def caller():
+        """
+        Returns the name of the first module outside of this
+        one in the current call stack.
+        """
+        frame = sys._getframe(1)
+        while frame is not None \
+                and frame.f_globals.get("__name__") == __name__:
+            frame = frame.f_back
 
-        Override paths set by ``DEFAULT_ENVIRONMENT_PATH_VARIABLE``.  By default
-        this path will not be set, this is only an example.
-        * ``/tmp/pyfarm/agent/1.2.3/agent.yml``
-        * ``/tmp/pyfarm/agent/1.2/agent.yml``
-        * ``/tmp/pyfarm/agent/1/agent.yml``
-        * ``/tmp/pyfarm/agent/agent.yml``
+        if frame is None:  # pragma: no cover
+            return None
 
-        Paths relative to the current working directory or the directory
-        provided to ``cwd`` when :class:`Configuration` was instanced.
-        * ``etc/pyfarm/agent/1.2.3/agent.yml``
-        * ``etc/pyfarm/agent/1.2/agent.yml``
-        * ``etc/pyfarm/agent/1/agent.yml``
-        * ``etc/pyfarm/agent/agent.yml``
+        return frame.f_globals.get("__name__")
 
-        User's home directory
-        * ``~/.pyfarm/agent/1.2.3/agent.yml``
-        * ``~/.pyfarm/agent/1.2/agent.yml``
-        * ``~/.pyfarm/agent/1/agent.yml``
-        * ``~/.pyfarm/agent/agent.yml``
+    def record(self, envvar, default_used, duration, module):
+        """Records a single read of ``envvar``"""
+        with self.lock:
+            try:
+                stats = self.variables[envvar]
+            except KeyError:
+                stats = self.variables[envvar] = {
+                    "reads": 0, "defaults": 0, "time": 0.0, "modules": {}}
 
-        System level paths
-        * ``/etc/pyfarm/agent/1.2.3/agent.yml``
-        * ``/etc/pyfarm/agent/1.2/agent.yml``
-        * ``/etc/pyfarm/agent/1/agent.yml``
-        * ``/etc/pyfarm/agent/agent.yml``
+            stats["reads"] += 1
+            stats["defaults"] += default_used
+            stats["time"] += duration
+            stats["modules"][module] = stats["modules"].get(module, 0) + 1
 
-        Finally, if we don't locate a configuration file in any of
-        the above paths we'll use the file which was installed along
-        side the source code.
+    def report(self):
+        """
+        Returns the recorded data as a string with one line per
+        variable, the most frequently read variables first.
+        """
+        with self.lock:
+            variables = sorted(
+                self.variables.items(),
+                key=lambda item: (-item[1]["reads"], item[0]))
+            lines = []
+
+            for envvar, stats in variables:
+                modules = ", ".join(
+                    "%s (%d)" % (module, count) for module, count in
+                    sorted(stats["modules"].items(),
+                           key=lambda item: -item[1]))
+                lines.append(
+                    "$%s: %d read(s), %d default(s), %.3fms from %s" % (
+                        envvar, stats["reads"], stats["defaults"],
+                        stats["time"] * 1000, modules))
+
+        return "\n".join(lines)
+
+    def dump(self):
+        """Logs the output of :meth:`report`"""
+        logger.info(
+            "Environment variable reads:\n%s",
+            self.report() or "(none recorded)")
+
+
+def record_env_reads(report_at_exit=True):
+    """
+    Replaces :func:`read_env` with a version that records each call in
+    an :class:`EnvReadRecorder` and returns the recorder.  Nothing is
+    recorded, and there's no overhead, until this function is called.
 
-    :class:`Configuration` will only attempt to load data from files which
-    exist on the file system when :meth:`load` is called.  If multiple files
-    exist the data will be loaded from each file with the successive data
-    overwriting the value from the previously loaded configuration file. So
-    if you have two files containing the same data:
+    .. note::
 
-        * ``/etc/pyfarm/agent/agent.yml``
+        Modules which imported :func:`read_env` by name before this
+        function was called will keep using the original function.
+        Set :envvar:`PYFARM_RECORD_ENV_READS` to start recording when
+        this module is imported.
 
-            .. code-block:: yaml
+    :param bool report_at_exit:
+        If True, log the report with :meth:`EnvReadRecorder.dump` when
+        the process exits
+    """
+    global read_env
 
-                env:
-                    a: 0
-                foo: 1
-                bar: true
+    recorder = getattr(read_env, "recorder", None)
+    if recorder is not None:
+        return recorder
 
+    recorder = EnvReadRecorder()
+    read_env = recorder.wrap(read_env)
 
-        * ``etc/pyfarm/agent/1.2.3/agent.yml``
+    if report_at_exit:
+        atexit.register(recorder.dump)
 
-            .. code-block:: yaml
+    return recorder
 
-                env:
-                    a: 1
-                    b: 1
-                foo: 0
 
-    You'll end up with a single merged configuration.  Please note that the
-    only keys which will be merged in the configuration are the ``env`` key.
-    Configuration files are meant to store simple data and while it can be
-    used to store more complicate data it won't merge any other data
-    structures.
+def stop_recording_env_reads():
+    """
+    Restores the original :func:`read_env` and returns the
+    :class:`EnvReadRecorder` which was in use, if any.
+    """
+    global read_env
 
-        .. code-block:: yaml
+    recorder = getattr(read_env, "recorder", None)
+    if recorder is not None:
+        read_env = _read_env
 
-            env:
-                a: 1
-                b: 1
-            foo: 0
-            bar: true
+    return recorder
 
-    :var string DEFAULT_SYSTEM_ROOT:
-        The system level directory that we should look for configuration
-        files in.  This path is platform dependent:
 
-            * **Linux** - /etc/
-            * **Mac** - /Library/
-            * **Windows** - %ProgramData%.  An environment variable that
-              varies depending on the Windows version.  See Microsoft's docs:
-              https://www.microsoft.com/security/portal/mmpc/shared/variables.aspx
+_read_env = read_env
 
-        The value built here will be copied onto the instance as ``system_root``
+if os.environ.get("PYFARM_RECORD_ENV_READS", "").lower() \
+        in BOOLEAN_TRUE:  # pragma: no cover
+    record_env_reads()
 
-    :var string DEFAULT_USER_ROOT:
-        The user level directory that we should look for configuration
-        files in.  This path is platform dependent:
 
-            * **Linux/Mac** - ~ (home directory)
-            * **Windows** - %APPDATA%.  An environment variable that
-              varies depending on the Windows version.  See Microsoft's docs:
-              https://www.microsoft.com/security/portal/mmpc/shared/variables.aspx
+class EnvVariable(namedtuple(
+        "EnvVariable", ("name", "type", "default", "log_result", "desc"))):
+    """
+    Stores the declaration for a single variable read by
+    :class:`EnvSnapshot`.
+    """
+    def parse(self, value):
+        """
+        Converts the string ``value`` from the environment
+        into ``type``.
 
-        The value built here will be copied onto the instance as ``user_root``
+        :exception TypeError:
+            raised if ``value`` could not be converted to ``type``
+        """
+        if self.type is str:
+            return value
 
-    :var string DEFAULT_FILE_EXTENSION:
-        The default file extension of the configuration files.  This will
-        default to ``.yml`` and will be copied to ``file_extension`` when
-        the class is instanced.
+        if self.type is bool:
+            lowered = value.lower()
+            if lowered in BOOLEAN_TRUE:
+                return True
+            elif lowered in BOOLEAN_FALSE:
+                return False
+            raise TypeError(
+                "could not convert %r to a boolean from $%s" % (
+                    value, self.name))
 
-    :var string DEFAULT_LOCAL_DIRECTORY_NAME:
-        A directory local to the current process which we should search
-        for configuration files in.  This will default to ``etc`` and
-        will be copied to ``local_dir`` when the class is instanced.
+        try:
+            parsed = literal_eval(value)
+        except (ValueError, SyntaxError):
+            raise TypeError(
+                "failed to evaluate the data in $%s" % self.name)
 
-    :var string DEFAULT_PARENT_APPLICATION_NAME:
-        The base name of the parent application.  This used used to build
-        child directories and will default to ``pyfarm``.
+        if not isinstance(parsed, self.type):
+            raise TypeError("$%s is not %r" % (self.name, self.type))
 
-    :var string DEFAULT_ENVIRONMENT_PATH_VARIABLE:
-        A environment variable to search for a configuration path in.  The value
-        defined here, which defaults to ``PYFARM_CONFIG_ROOT``, will be
-        read from the environment when :class:`Configuration` is instanced.
-        This allows for an non-standard configuration location to be loaded
-        first for testing forced-override of the configuration.
+        return parsed
 
-    :var DEFAULT_TEMP_DIRECTORY_ROOT:
-        The directory which will store any temporary files.
 
-    :param string name:
-        The name of the configuration itself, typically 'master' or
-        'agent'.  This may also be the name of a package such
-        as 'pyfarm.agent'.  When the package name is provided
-        we can usually automatically determine the version
-        number.
+class EnvSnapshot(object):
+    """
+    Reads a set of declared environment variables in a single pass over
+    :class:`os.environ` and then serves the parsed values from memory.
+    This is meant to replace many individual calls to :func:`read_env`,
+    :func:`read_env_bool`, :func:`read_env_int`, etc. each of which looks
+    up, parses and logs its variable separately.
+
+    >>> env = EnvSnapshot()
+    >>> env.declare("PYFARM_PRETTY_JSON", bool, default=False)
+    >>> env.declare("PYFARM_AGENT_PORT", int, default=50000)
+    >>> env.refresh()
+    >>> port = env["PYFARM_AGENT_PORT"]
+
+    Values are only read from the environment when :meth:`refresh`
+    is called.
+
+    :param string prefix:
+        Variables which start with this prefix but which were not
+        declared will be logged by :meth:`refresh` to help catch typos.
+    """
+    def __init__(self, prefix="PYFARM_"):
+        self.prefix = prefix
+        self.variables = {}
+        self.values = {}
 
-    :param string version:
-        The version the version of the program running.
+    def declare(self, name, type=str, default=NOTSET, log_result=True,
+                desc=None):
+        """
+        Declares an environment variable to be read by :meth:`refresh`.
 
-    :param string cwd:
-        The current working directory to construct the local
-        path from.  If not provided then we'll use :func:`os.getcwd`
-        to determine the current working directory.
+        :param string name:
+            The name of the environment variable
 
-    .. automethod:: _expandvars
-    """
-    MAX_EXPANSION_RECURSION = 10
+        :param type:
+            The type of the value.  ``str`` returns the value as is,
+            ``bool`` uses :const:`BOOLEAN_TRUE` and :const:`BOOLEAN_FALSE`
+            and anything else runs :func:`.literal_eval` on the value and
+            checks the result is an instance of ``type``, similar to
+            :func:`read_env_strict_number`.
 
-    if LINUX:  # pragma: no cover
-        DEFAULT_SYSTEM_ROOT = join(os.sep, "etc")
-        DEFAULT_USER_ROOT = expanduser("~")
-    elif MAC:  # pragma: no cover
-        DEFAULT_SYSTEM_ROOT = join(os.sep, "Library")
-        DEFAULT_USER_ROOT = expanduser("~")
-    elif WINDOWS:  # pragma: no cover
-        DEFAULT_SYSTEM_ROOT = expandvars("$ProgramData")
-        DEFAULT_USER_ROOT = expandvars("$APPDATA")
-    else:  # pragma: no cover
-        logger.warning("Failed to determine default configuration roots")
-        DEFAULT_SYSTEM_ROOT = None
-        DEFAULT_USER_ROOT = None
+        :param default:
+            The value to use if ``name`` is not in the environment.  If
+            not provided then :meth:`refresh` will raise an exception
+            when the variable is missing.
 
-    DEFAULT_FILE_EXTENSION = ".yml"
-    DEFAULT_LOCAL_DIRECTORY_NAME = "etc"
-    DEFAULT_PARENT_APPLICATION_NAME = "pyfarm"
-    DEFAULT_ENVIRONMENT_PATH_VARIABLE = "PYFARM_CONFIG_ROOT"
-    DEFAULT_TEMP_DIRECTORY_ROOT = join(
-        gettempdir(), DEFAULT_PARENT_APPLICATION_NAME)
+        :param bool log_result:
+            If False the value will be hidden in the log output, see
+            :func:`read_env`
 
-    def __init__(self, name, version=None, cwd=None):
-        super(Configuration, self).__init__()
+        :param string desc:
+            Describes the purpose of the variable
+        """
+        self.variables[name] = EnvVariable(
+            name, type, default, log_result, desc)
 
-        self._name = name
-        self.loaded = ()
-        self.cwd = os.getcwd() if cwd is None else cwd
-        self.file_extension = self.DEFAULT_FILE_EXTENSION
-        self.system_root = self.DEFAULT_SYSTEM_ROOT
-        self.user_root = self.DEFAULT_USER_ROOT
-        self.local_dir = join(self.cwd, self.DEFAULT_LOCAL_DIRECTORY_NAME)
-        self.environment_root = read_env(
-            self.DEFAULT_ENVIRONMENT_PATH_VARIABLE, None)
+    def refresh(self):
+        """
+        Reads and parses every declared variable from the environment
+        and logs a single summary line.  The new values replace the
+        old values all at once.
 
-        # If `name` is an import name and an
-        # explict version was not provided then try
-        # to find one automatically.
-        if version is None:
-            try:
-                self.distribution = get_distribution(name)
+        :exception EnvironmentError:
+            raised if a variable without a default is not in the
+            environment
 
-            except DistributionNotFound:
-                raise ValueError(
-                    "%r is not a Python package so you must provide "
-                    "a version." % self._name)
-            else:
-                self.version = self.distribution.version
-                self.name = self._name.split(".")[-1]
+        :exception TypeError:
+            raised if a value could not be parsed
+        """
+        values = {}
+        undeclared = []
+
+        for name, value in os.environ.items():
+            variable = self.variables.get(name)
+            if variable is not None:
+                values[name] = variable.parse(value)
+            elif self.prefix and name.startswith(self.prefix):
+                undeclared.append(name)
+
+        defaults = []
+        for name, variable in self.variables.items():
+            if name in values:
+                continue
 
-        else:
-            self.distribution = None
-            self.version = version
-            self.name = self._name
+            if variable.default is NOTSET:
+                raise EnvironmentError("$%s is not in the environment" % name)
 
-        self.child_dir = join(self.DEFAULT_PARENT_APPLICATION_NAME, self.name)
-        self.tempdir = join(self.DEFAULT_TEMP_DIRECTORY_ROOT, self.name)
+            values[name] = variable.default
+            defaults.append(name)
 
-        # Create the base tempdir if it does not already
-        # exist.  We're handling the exception instead of
-        # using isdir() because it's possible multiple
-        # processes could try to create the directory and
-        # it's safer to let the file system handle it.
-        try:
-            os.makedirs(self.tempdir)
-        except OSError as e:
-            if e.errno != EEXIST:
-                raise
-        else:
-            logger.debug("Created %r", self.tempdir)
+        self.values = values
+        logger.info(
+            "Read %s environment variable(s) (%s using defaults): %s",
+            len(values), len(defaults), _EnvSummary(self.variables, values))
 
-        # Try to locate the package's built-in configuration
-        # file.  This will be loaded before anything else
-        # to provide the default values.
-        try:
-            self.package_configuration = resource_filename(
-                name,
-                join("etc", self._name.split(".")[-1] + self.file_extension))
-        except ImportError:
-            logger.warning(
-                "Could not determine the default configuration file "
-                "path for %s", self.name)
-            self.package_configuration = None
+        if undeclared:
+            logger.debug(
+                "Undeclared environment variable(s): %s",
+                ", ".join(sorted(undeclared)))
 
-    def split_version(self, sep="."):
+    def get(self, name, default=None):
+        """Returns the value for ``name`` or ``default``"""
+        return self.values.get(name, default)
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def __contains__(self, name):
+        return name in self.values
+
+
+class _EnvSummary(object):
+    """
+    Formats the summary line logged by :meth:`EnvSnapshot.refresh`, the
+    string is only built if the log record is actually emitted.
+    """
+    def __init__(self, variables, values):
+        self.variables = variables
+        self.values = values
+
+    def __str__(self):
+        return ", ".join(
+            "%s=%r" % (
+                name, self.values[name]
+                if self.variables[name].log_result else "<hidden>")
+            for name in sorted(self.values))
+
+
+class SchemaField(namedtuple("SchemaField", ("type", "default", "converter"))):
+    """
+    Stores the type, default value and converter for a single key
+    registered with :meth:`Configuration.register`.
+    """
+    def convert(self, value):
         """
-        Splits ``self.version`` into a tuple of individual versions.  For
-        example ``1.2.3`` would be split into ``['1', '1.2', '1.2.3']``
+        Converts ``value`` and ensures the result is an instance
+        of ``type``.  Values which are already the correct type are
+        returned as is.
         """
-        if not self.version:
-            return []
+        if self.type is not None and isinstance(value, self.type):
+            return value
 
-        split = self.version.split(sep)
-        return list(reversed([
-            sep.join(split[:index]) for index, _ in enumerate(split, start=1)]))
+        if self.converter is not None:
+            value = self.converter(value)
 
-    def directories(self, validate=True, unversioned_only=False):
-        """
-        Returns a list of platform dependent directories which may contain
-        configuration files.
+        if self.type is not None and not isinstance(value, self.type):
+            raise TypeError(
+                "expected %s, got %r" % (self.type.__name__, value))
 
-        :param bool validate:
-            When ``True`` this method will only return directories
-            which exist on disk.
+        return value
 
-        :param bool unversioned_only:
-            When ``True`` this method will only return versionless directories
-            instead of both versionless and versioned directories.
-        """
-        roots = []
-        versions = []
 
-        if not unversioned_only:
-            versions.extend(self.split_version())
+class lazy_attribute(object):
+    """
+    Decorator which turns a method into an attribute that is computed
+    the first time it's accessed.  The result is stored on the instance
+    so later lookups are as fast as any other attribute and the
+    attribute can still be assigned to directly.
+    """
+    def __init__(self, method):
+        self.method = method
+        self.__name__ = method.__name__
+        self.__doc__ = method.__doc__
 
-        versions.append("")  # the 'version free' directory
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
 
-        # If provided, insert the default root
-        if self.system_root:  # could be empty in the environment
-            roots.append(join(self.system_root, self.child_dir))
+        value = instance.__dict__[self.__name__] = self.method(instance)
+        return value
 
-        # If provided, append the user directory
-        if self.user_root:  # could be empty in the environment
-            if not WINDOWS:
-                roots.append(join(self.user_root, "." + self.child_dir))
-            else:
-                roots.append(join(self.user_root, self.child_dir))
 
-        # If provided append a local directory
-        if self.local_dir is not None:
-            roots.append(join(self.local_dir, self.child_dir))
+class lazy_class_attribute(lazy_attribute):
+    """
+    Like :class:`lazy_attribute` except the method is passed the class
+    and the result is stored on the class so it's only computed once.
+    """
+    def __get__(self, instance, owner):
+        value = self.method(owner)
+        setattr(owner, self.__name__, value)
+        return value
 
-        # If provided, append the root discovered in the environment
-        if self.environment_root is not None:
-            roots.append(join(self.environment_root, self.child_dir))
 
-        all_directories = []
-        existing_directories = []
+def _expand(owner, value):
+    """
+    Returns ``value`` expanded by ``owner._expandvars`` if it's a string.
+    If ``owner.EXPAND_CONTAINERS`` is True containers are wrapped in an
+    :class:`ExpandingMapping` or :class:`ExpandingSequence`, otherwise
+    they're returned unchanged like any other value.  The views are
+    stored alongside ``owner``'s expansion cache so each container is
+    only wrapped once.
+    """
+    if isinstance(value, STRING_TYPES):
+        return owner._expandvars(value)
 
-        for root, tail in product(roots, versions):
-            directory = join(root, tail)
-            all_directories.append(directory)
+    if not owner.EXPAND_CONTAINERS:
+        return value
 
-            if not validate or isdir(directory):
-                existing_directories.append(directory)
+    if isinstance(value, dict):
+        view_class = ExpandingMapping
+    elif isinstance(value, (list, tuple)):
+        view_class = ExpandingSequence
+    else:
+        return value
 
-        return existing_directories
+    owner._expansion_cache()
+    views = owner._expanded_views
 
-    def files(self, validate=True, unversioned_only=False):
-        """
-        Returns a list of configuration files.
+    # The view keeps a reference to `value` so its id can't be
+    # reused while the entry exists.
+    try:
+        return views[id(value)]
+    except KeyError:
+        view = views[id(value)] = view_class(owner, value)
+        return view
 
-        :param bool validate:
-            When ``True`` this method will only return files
-            which exist on disk.
 
-            .. note::
+def _expand_all(owner, value):
+    """
+    Returns a fully expanded copy of ``value``, as returned by
+    ``owner[key]``, if it's a container or a view of one.  Any other
+    value is returned unchanged.
+    """
+    if isinstance(value, (ExpandingMapping, ExpandingSequence)):
+        return value.expanded()
+    if isinstance(value, dict):
+        return ExpandingMapping(owner, value).expanded()
+    if isinstance(value, (list, tuple)):
+        return ExpandingSequence(owner, value).expanded()
+    return value
 
-                This method calls :meth:`directories` and will
-                be passed the value that is provided to ``validate``
-                here.
 
-        :param bool unversioned_only:
-            See the keyword documentation for ``unversioned_only`` in
-            :meth:`directories``
+def _expand_copy(owner, value):
+    """
+    Returns a fully expanded copy of ``value``, a raw value which has
+    not been through :func:`_expand`, whatever ``owner.EXPAND_CONTAINERS``
+    is set to.
+    """
+    if isinstance(value, STRING_TYPES):
+        return owner._expandvars(value)
+    return _expand_all(owner, value)
+
+
+class ExpandingMapping(Mapping):
+    """
+    Read only view, returned when :attr:`Configuration.EXPAND_CONTAINERS`
+    is True, of a dictionary nested inside of a
+    :class:`Configuration` which expands string values using
+    :meth:`Configuration._expandvars` as they're retrieved.  Nothing is
+    expanded or copied when the view is created, expanded strings are
+    stored in the configuration's expansion cache and nested containers
+    are returned as views too.  The view always reflects the current
+    state of the configuration.
+
+    Unlike the dictionary itself a view is not a :class:`dict` and can't
+    be modified.  Call :meth:`expanded` for a copy which can be, the
+    copy can also be serialized by :func:`pyfarm.core.utility.dumps`.
+
+    :var dict data:
+        The dictionary being viewed, values retrieved
+        from here are not expanded.
+    """
+    __slots__ = ("owner", "data")
+
+    def __init__(self, owner, data):
+        self.owner = owner
+        self.data = data
+
+    def expanded(self):
         """
-        directories = self.directories(
-            validate=validate, unversioned_only=unversioned_only)
-        filename = self.name + self.file_extension
-        existing_files = []
+        Returns a new :class:`dict` containing every value in this
+        view, and any nested views, fully expanded.
+        """
+        owner = self.owner
+        return dict(
+            (key, _expand_copy(owner, value))
+            for key, value in self.data.items())
 
-        if self.package_configuration is not None:
-            if not validate or isfile(self.package_configuration):
-                existing_files.append(self.package_configuration)
+    def __getitem__(self, key):
+        return _expand(self.owner, self.data[key])
 
-            else:
-                logger.warning(
-                    "%r does not have a default configuration file. Expected "
-                    "to find %r but this path does not exist.",
-                    self._name, self.package_configuration)
+    def __contains__(self, key):
+        return key in self.data
 
-        for directory in directories:
-            filepath = join(directory, filename)
+    def __iter__(self):
+        return iter(self.data)
 
-            if not validate or isfile(filepath):
-                existing_files.append(filepath)
+    def __len__(self):
+        return len(self.data)
 
-        if not existing_files:  # pragma: no cover
-            logger.error(
-                "No configuration file(s) %s were found in %s",
-                filename, pformat(directories))
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.data)
 
-        return existing_files
 
-    def load(self, environment=None):
+class ExpandingSequence(Sequence):
+    """
+    Read only view of a list or tuple nested inside of a
+    :class:`Configuration`, see :class:`ExpandingMapping`.  Views compare
+    equal to lists and tuples containing the same expanded values but,
+    unlike a list, they can't be modified or concatenated.
+
+    :var data:
+        The list or tuple being viewed, values retrieved
+        from here are not expanded.
+    """
+    __slots__ = ("owner", "data")
+    __hash__ = None
+
+    def __init__(self, owner, data):
+        self.owner = owner
+        self.data = data
+
+    def expanded(self):
         """
-        Loads data from the configuration files.  Any data present
-        in the ``env`` key in the configuration files will update
-        ``environment``
+        Returns a new list, or tuple if this view contains a tuple, with
+        every value in this view, and any nested views, fully expanded.
+        """
+        owner = self.owner
+        values = [_expand_copy(owner, value) for value in self.data]
+        return tuple(values) if isinstance(self.data, tuple) else values
 
-        :param dict environment:
-            A dictionary to load data in the ``env`` key from
-            the configuration files into.  This would typically be
-            set to ``os.environ`` so the environment itself could
-            be updated.
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [_expand(self.owner, value) for value in self.data[index]]
+        return _expand(self.owner, self.data[index])
+
+    def __len__(self):
+        return len(self.data)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, ExpandingSequence)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.data)
+
+
+class VariableExpansion(object):
+    """
+    Implements the variable expansion shared by :class:`Configuration`,
+    :class:`ConfigurationOverlay` and the data staged by a load before
+    it's published.  By default the template values are built from the
+    data in the instance, which must be a :class:`dict`, and ``tempdir``.
+    Subclasses which store their data some other way override
+    :meth:`_expansion_cache`, :meth:`invalidate`, :meth:`_template_value`
+    and :meth:`_current_sources`.
+    """
+    # Incremented each time the data in the instance is modified, used
+    # to determine when the results of _expandvars() can't be reused.
+    _generation = 0
+    _expansion_state = None
+
+    def _expansion_cache(self):
         """
-        loaded = []
+        Returns the dictionary which maps raw values to the results of
+        :meth:`_expandvars`.  The cache, and the template values used to
+        produce it, are rebuilt if this instance or the temp directory have
+        changed since the last call.  Changes to the ``env`` key or to
+        :class:`os.environ` are detected by :meth:`_expandvars` which
+        only checks the variables each cached value refers to.
+        """
+        state = self._expansion_state
 
-        for filepath in self.files():
-            with open(filepath, "rb") as stream:
-                try:
-                    data = yaml.load(stream, Loader=Loader)
+        if state is not None \
+                and state[0] == self._generation \
+                and state[1] == self.tempdir:
+            return self._expansion_results
 
-                except yaml.YAMLError as e:  # pragma: no cover
-                    logger.error("Failed to load %r: %s", filepath, e)
-                    continue
+        environment = dict.get(self, "env")
+        environment = dict(environment) if isinstance(
+            environment, dict) else {}
+        template_values = {"temp": self.tempdir}
+        template_values.update(os.environ)
+        template_values.update(environment)
+        template_values.update(**self)
 
-                else:
-                    loaded.append(filepath)
+        self._template_values = template_values
+        self._template_sources = (environment, dict(_environ_data()))
+        self._expanded_names = {}
+        self._expansion_results = {}
+        self._expansion_depends = {}
+        self._expanded_views = {}
+        self._expansion_state = (self._generation, self.tempdir)
+        return self._expansion_results
 
-            # Empty file
-            if not data:
-                continue
+    def invalidate(self):
+        """
+        Discards the results cached by :meth:`_expandvars` so every value
+        will be expanded again the next time it's retrieved.  This is
+        never required, changes are detected automatically, but it can
+        be used to release the memory held by the cache.
+        """
+        self._expansion_state = None
 
-            if environment is not None and "env" in data:
-                config_environment = data.pop("env")
-                assert isinstance(config_environment, dict)
-                environment.update(config_environment)
+    def _template_value(self, name, sources=None):
+        """
+        Returns the value of the variable ``name`` from the sources used
+        to build the template values or :const:`.NOTSET` if the variable
+        does not exist.  Values from :class:`os.environ` are returned
+        without being decoded.
+
+        :param tuple sources:
+            The ``env`` key and the data from :func:`_environ_data`.  By
+            default the current sources are used, pass
+            ``_template_sources`` instead to retrieve the value which
+            is in the template values.
+        """
+        if dict.__contains__(self, name):
+            return dict.__getitem__(self, name)
 
-            elif environment is None:
-                logger.warning(
-                    "No environment was provided to be populated by the "
-                    "configuration file(s)")
+        environment, environ = sources or self._current_sources()
+        if name in environment:
+            return environment[name]
 
-            # Update this instance with the loaded data
-            self.update(data)
+        value = environ.get(_environ_key(name), NOTSET)
+        if value is NOTSET and name == "temp":
+            return self.tempdir
+        return value
 
-        if loaded:
-            self.loaded = tuple(loaded)
-            logger.info(
-                "Loaded configuration file(s): %s", pformat(loaded))
-        else:
-            self.loaded = ()
-            logger.warning(
-                "No configuration files were loaded after searching %s",
-                pformat(self.files(validate=False)))
+    def _current_sources(self):
+        """
+        Returns the current ``env`` key and the data from
+        :func:`_environ_data`, see :meth:`_template_value`
+        """
+        environment = dict.get(self, "env")
+        if not isinstance(environment, dict):
+            environment = {}
+        return environment, _environ_data()
+
+    def _depend(self, depends, name):
+        """
+        Adds ``name``, and the value the template values have for it,
+        to ``depends``.  See :meth:`_depends_changed`.
+        """
+        depends[name] = self._template_value(name, self._template_sources)
+
+    def _depends_changed(self, depends):
+        """
+        Returns True if any of the ``(name, value)`` tuples in ``depends``,
+        recorded by :meth:`_depend` when a value was expanded, no longer
+        matches the current value of the variable.
+        """
+        if not depends:
+            return False
+
+        sources = self._current_sources()
+        for name, value in depends:
+            current = self._template_value(name, sources)
+            if current is not value and current != value:
+                return True
+        return False
 
     def _expandvars(self, value):
         """
@@ -661,43 +1374,2314 @@ class Configuration(dict):
                 "foobar": "foo/bar",
                 "path": "/home/user/foo/bar/somevalue"
             }
+
+        The results of this method are cached by the raw value along with
+        the names, and values, of the variables the result depends on.
+        Only those variables are checked when the cached result is reused,
+        see :meth:`_expansion_cache` for the other conditions which will
+        cause values to be expanded again.
+
+        :raises ValueError:
+            Raised if ``value`` references a variable which, directly or
+            indirectly, references itself.
         """
-        template_values = {"temp": self.tempdir}
-        template_values.update(os.environ)
-        template_values.update(self.get("env", {}))
-        template_values.update(**self)
+        cache = self._expansion_cache()
 
-        # Do recursive variable expansion until we've either
-        # reached MAX_EXPANSION_RECURSION or the resulting
-        # value is unchanged
-        for _ in range_(self.MAX_EXPANSION_RECURSION):
-            template = Template(value)
-            expanded = expanduser(template.safe_substitute(**template_values))
+        try:
+            expanded = cache[value]
+        except KeyError:
+            pass
+        else:
+            if not self._depends_changed(self._expansion_depends[value]):
+                return expanded
+
+            # One of the variables in the environment changed, start
+            # over with new template values.
+            self.invalidate()
+            cache = self._expansion_cache()
+
+        depends = {}
+        expanded = self._substitute(value, [], depends)
+        depends = tuple(depends.items())
+
+        # Variables resolved for earlier values are reused so make sure
+        # none of them have changed since.
+        if self._depends_changed(depends):
+            self.invalidate()
+            cache = self._expansion_cache()
+            depends = {}
+            expanded = self._substitute(value, [], depends)
+            depends = tuple(depends.items())
+
+        cache[value] = expanded
+        self._expansion_depends[value] = depends
+        return expanded
+
+    def _substitute(self, value, stack, depends):
+        """
+        Performs a single substitution pass over ``value`` using
+        :attr:`string.Template.pattern`.  Each variable referenced
+        by ``value`` is resolved by :meth:`_resolve` so the result
+        never needs to be scanned again.
+
+        :param list stack:
+            The names currently being resolved, used to detect
+            circular references.
+
+        :param dict depends:
+            Updated with the name and value of each variable ``value``
+            refers to, directly or indirectly.  Variables which don't
+            exist are included with a value of :const:`.NOTSET`.
+        """
+        def replace(match):
+            name = match.group("named") or match.group("braced")
 
-            # Nothing left to expand
-            if value == expanded:
-                break
-            else:
-                value = expanded
+            if name is not None:
+                if name in self._template_values:
+                    return self._resolve(name, stack, depends)
+                self._depend(depends, name)
+                return match.group()
 
-        return value
+            if match.group("escaped") is not None:
+                return Template.delimiter
 
-    def get(self, key, default=None):
+            return match.group()
+
+        return expanduser(Template.pattern.sub(replace, value))
+
+    def _resolve(self, name, stack, depends):
         """
-        Overrides :meth:`dict.get` to provide internal variable
-        expansion through :meth:`_expandvars`.
+        Returns the fully expanded value for the variable ``name``.  The
+        references between variables are walked depth first so each
+        variable is expanded exactly once, after everything it depends on,
+        and the result is stored until the expansion cache is rebuilt.
+
+        :param dict depends:
+            See the documentation for ``depends`` in :meth:`_substitute`
+
+        :raises ValueError:
+            Raised if ``name`` refers back to itself, either directly
+            or through other variables.
         """
-        value = super(Configuration, self).get(key, default)
+        try:
+            value, name_depends = self._expanded_names[name]
+        except KeyError:
+            pass
+        else:
+            depends.update(name_depends)
+            return value
+
+        if name in stack:
+            cycle = stack[stack.index(name):] + [name]
+            raise ValueError(
+                "Circular reference while expanding variables: %s" %
+                " -> ".join("$" + entry for entry in cycle))
+
+        value = self._template_values[name]
+        name_depends = {}
+        self._depend(name_depends, name)
+
         if isinstance(value, STRING_TYPES):
-            value = self._expandvars(value)
+            stack.append(name)
+            try:
+                value = self._substitute(value, stack, name_depends)
+            finally:
+                stack.pop()
+        else:
+            value = "%s" % (value, )
+
+        self._expanded_names[name] = (value, name_depends)
+        depends.update(name_depends)
         return value
 
-    def __getitem__(self, item):
-        """
+
+class Configuration(VariableExpansion, dict):
+    """
+    Main object responsible for finding, loading, and
+    merging configuration data.  By default this class does nothing
+    until :meth:`load` is called.  Once this method is called
+    :class:`Configuration` class will populate itself with data loaded
+    from the configuration files.  The configuration files themselves can
+    be loaded from multiple location depending on the system's setup.  For
+    example on Linux you might end up attempting to load these files for
+    pyfarm.agent v1.2.3:
+
+        Override paths set by ``DEFAULT_ENVIRONMENT_PATH_VARIABLE``.  By default
+        this path will not be set, this is only an example.
+        * ``/tmp/pyfarm/agent/1.2.3/agent.yml``
+        * ``/tmp/pyfarm/agent/1.2/agent.yml``
+        * ``/tmp/pyfarm/agent/1/agent.yml``
+        * ``/tmp/pyfarm/agent/agent.yml``
+
+        Paths relative to the current working directory or the directory
+        provided to ``cwd`` when :class:`Configuration` was instanced.
+        * ``etc/pyfarm/agent/1.2.3/agent.yml``
+        * ``etc/pyfarm/agent/1.2/agent.yml``
+        * ``etc/pyfarm/agent/1/agent.yml``
+        * ``etc/pyfarm/agent/agent.yml``
+
+        User's home directory
+        * ``~/.pyfarm/agent/1.2.3/agent.yml``
+        * ``~/.pyfarm/agent/1.2/agent.yml``
+        * ``~/.pyfarm/agent/1/agent.yml``
+        * ``~/.pyfarm/agent/agent.yml``
+
+        System level paths
+        * ``/etc/pyfarm/agent/1.2.3/agent.yml``
+        * ``/etc/pyfarm/agent/1.2/agent.yml``
+        * ``/etc/pyfarm/agent/1/agent.yml``
+        * ``/etc/pyfarm/agent/agent.yml``
+
+        Finally, if we don't locate a configuration file in any of
+        the above paths we'll use the file which was installed along
+        side the source code.
+
+    :class:`Configuration` will only attempt to load data from files which
+    exist on the file system when :meth:`load` is called.  If multiple files
+    exist the data will be loaded from each file with the successive data
+    overwriting the value from the previously loaded configuration file. So
+    if you have two files containing the same data:
+
+        * ``/etc/pyfarm/agent/agent.yml``
+
+            .. code-block:: yaml
+
+                env:
+                    a: 0
+                foo: 1
+                bar: true
+
+
+        * ``etc/pyfarm/agent/1.2.3/agent.yml``
+
+            .. code-block:: yaml
+
+                env:
+                    a: 1
+                    b: 1
+                foo: 0
+
+    You'll end up with a single merged configuration.  Please note that by
+    default the only keys which will be merged in the configuration are the
+    ``env`` key.  Any other value, including nested data structures, will
+    be replaced by the value from the successive file.
+
+        .. code-block:: yaml
+
+            env:
+                a: 1
+                b: 1
+            foo: 0
+            bar: true
+
+    This can be changed for individual keys using ``merge_policies``, which
+    maps a key to one of the policies below.  Nested keys are referred to
+    by joining the keys with ``.``, for example ``jobtypes.paths``.  Keys
+    nested under a key using :const:`MERGE_DEEP` will also be merged
+    unless they have their own policy.
+
+        * :const:`MERGE_REPLACE` - the value is replaced (the default)
+        * :const:`MERGE_DEEP` - dictionaries are merged recursively
+        * :const:`MERGE_APPEND` - lists are concatenated
+
+    Merging never modifies the data loaded from the files.  Only the
+    dictionaries along the path to a changed value are copied, everything
+    else is shared with the data which was already loaded.
+
+    :var string DEFAULT_SYSTEM_ROOT:
+        The system level directory that we should look for configuration
+        files in.  This path is platform dependent:
+
+            * **Linux** - /etc/
+            * **Mac** - /Library/
+            * **Windows** - %ProgramData%.  An environment variable that
+              varies depending on the Windows version.  See Microsoft's docs:
+              https://www.microsoft.com/security/portal/mmpc/shared/variables.aspx
+
+        The value built here will be copied onto the instance as ``system_root``
+
+    :var string DEFAULT_USER_ROOT:
+        The user level directory that we should look for configuration
+        files in.  This path is platform dependent:
+
+            * **Linux/Mac** - ~ (home directory)
+            * **Windows** - %APPDATA%.  An environment variable that
+              varies depending on the Windows version.  See Microsoft's docs:
+              https://www.microsoft.com/security/portal/mmpc/shared/variables.aspx
+
+        The value built here will be copied onto the instance as ``user_root``
+
+    :var string DEFAULT_FILE_EXTENSION:
+        The default file extension of the configuration files.  This will
+        default to ``.yml`` and will be copied to ``file_extension`` when
+        the class is instanced.
+
+    :var string DEFAULT_LOCAL_DIRECTORY_NAME:
+        A directory local to the current process which we should search
+        for configuration files in.  This will default to ``etc`` and
+        will be copied to ``local_dir`` when the class is instanced.
+
+    :var string DEFAULT_PARENT_APPLICATION_NAME:
+        The base name of the parent application.  This used used to build
+        child directories and will default to ``pyfarm``.
+
+    :var string DEFAULT_ENVIRONMENT_PATH_VARIABLE:
+        A environment variable to search for a configuration path in.  The value
+        defined here, which defaults to ``PYFARM_CONFIG_ROOT``, will be
+        read from the environment when :class:`Configuration` is instanced.
+        This allows for an non-standard configuration location to be loaded
+        first for testing forced-override of the configuration.
+
+    :var DEFAULT_TEMP_DIRECTORY_ROOT:
+        The directory which will store any temporary files.
+
+    :var string SNAPSHOT_EXTENSION:
+        The file extension used for the snapshots written to ``tempdir``
+        by :meth:`load` when ``snapshot=True``.
+
+    :var string FRAGMENT_DIRECTORY_EXTENSION:
+        Appended to ``name`` to produce the name of the directory, next
+        to each configuration file, which fragments are loaded from.  See
+        :meth:`fragments`.
+
+    :var int SNAPSHOT_FORMAT:
+        The version of the data stored in a snapshot.  Snapshots written
+        with a different format version are ignored and rebuilt.
+
+    :var string COMPILED_EXTENSION:
+        Appended to the path of a configuration file to produce the path
+        of the compiled version written by :func:`compile_file`.
+
+    :var string DEFAULT_MERGE_POLICY:
+        The policy used for keys which are not present in
+        ``merge_policies``.  Defaults to :const:`MERGE_REPLACE`.
+
+    :var bool EXPAND_CONTAINERS:
+        If True, dictionaries, lists and tuples are returned by
+        :meth:`get` and :meth:`__getitem__` as :class:`ExpandingMapping`
+        and :class:`ExpandingSequence` views which expand the strings
+        nested inside of them.  The views are read only and are not
+        instances of :class:`dict` or :class:`list` so this defaults to
+        False, in which case containers are returned as is and only
+        :meth:`freeze`, and the other snapshots, expand nested strings.
+
+    :var tuple LAZY_ATTRIBUTES:
+        The names of the attributes which are computed on first use
+        when ``lazy=True`` is passed to :class:`Configuration`.  Unless
+        ``lazy`` is set these are computed, in order, when the instance
+        is created.
+
+    :param string name:
+        The name of the configuration itself, typically 'master' or
+        'agent'.  This may also be the name of a package such
+        as 'pyfarm.agent'.  When the package name is provided
+        we can usually automatically determine the version
+        number.
+
+    :param string version:
+        The version the version of the program running.
+
+    :param string cwd:
+        The current working directory to construct the local
+        path from.  If not provided then we'll use :func:`os.getcwd`
+        to determine the current working directory.
+
+    :param bool lazy:
+        By default the distribution, temp directory, package configuration
+        and environment root are looked up when the instance is created.
+        Setting this to ``True`` will defer each of these until the
+        first time they're used which makes creating an instance which
+        is never loaded, or is loaded much later, nearly free.  Note
+        that this also defers the :class:`ValueError` raised when a
+        version can't be determined.
+
+    :param dict listing:
+        A dictionary used by :meth:`listdir` to store the contents of
+        the directories which have been searched.  Passing the same
+        dictionary to several instances means each directory will
+        only be read once no matter how many instances are built.
+
+    .. automethod:: _expandvars
+    """
+    if LINUX:  # pragma: no cover
+        DEFAULT_SYSTEM_ROOT = join(os.sep, "etc")
+        DEFAULT_USER_ROOT = expanduser("~")
+    elif MAC:  # pragma: no cover
+        DEFAULT_SYSTEM_ROOT = join(os.sep, "Library")
+        DEFAULT_USER_ROOT = expanduser("~")
+    elif WINDOWS:  # pragma: no cover
+        DEFAULT_SYSTEM_ROOT = expandvars("$ProgramData")
+        DEFAULT_USER_ROOT = expandvars("$APPDATA")
+    else:  # pragma: no cover
+        logger.warning("Failed to determine default configuration roots")
+        DEFAULT_SYSTEM_ROOT = None
+        DEFAULT_USER_ROOT = None
+
+    DEFAULT_FILE_EXTENSION = ".yml"
+    DEFAULT_LOCAL_DIRECTORY_NAME = "etc"
+    DEFAULT_PARENT_APPLICATION_NAME = "pyfarm"
+    DEFAULT_ENVIRONMENT_PATH_VARIABLE = "PYFARM_CONFIG_ROOT"
+
+    @lazy_class_attribute
+    def DEFAULT_TEMP_DIRECTORY_ROOT(cls):
+        # gettempdir() searches for a writable directory, defer
+        # that until a temporary directory is actually needed.
+        from tempfile import gettempdir
+        return join(gettempdir(), cls.DEFAULT_PARENT_APPLICATION_NAME)
+
+    FRAGMENT_DIRECTORY_EXTENSION = ".d"
+    SNAPSHOT_EXTENSION = ".snapshot"
+    SNAPSHOT_FORMAT = 1
+    COMPILED_EXTENSION = ".bin"
+    DEFAULT_MERGE_POLICY = MERGE_REPLACE
+    EXPAND_CONTAINERS = False
+    LAZY_ATTRIBUTES = (
+        "environment_root", "distribution", "version", "tempdir",
+        "package_configuration")
+
+    # Decorator which marks the expansion cache as stale
+    # before calling the original method.
+    def invalidates_expansion(method):
+        def wrapper(self, *args, **kwargs):
+            self._generation += 1
+            return method(self, *args, **kwargs)
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+
+    __setitem__ = invalidates_expansion(dict.__setitem__)
+    __delitem__ = invalidates_expansion(dict.__delitem__)
+    clear = invalidates_expansion(dict.clear)
+    pop = invalidates_expansion(dict.pop)
+    popitem = invalidates_expansion(dict.popitem)
+    setdefault = invalidates_expansion(dict.setdefault)
+    update = invalidates_expansion(dict.update)
+
+    if hasattr(dict, "__ior__"):  # pragma: no cover
+        __ior__ = invalidates_expansion(dict.__ior__)
+
+    # Once we've applied the decorator, we don't
+    # need it anymore.
+    del invalidates_expansion
+
+    def __init__(self, name, version=None, cwd=None, listing=None,
+                 lazy=False):
+        super(Configuration, self).__init__()
+
+        self._name = name
+        self._version = version
+        self._parsed = {}
+        self.listing = {} if listing is None else listing
+        self.loaded = ()
+        self.merge_policies = {}
+        self.schema = {}
+        self.frozen = None
+        self.env = {}
+        self.subscribers = []
+        self.remotes = []
+        self.trace = None
+        self._publish_lock = RLock()
+        self.cwd = os.getcwd() if cwd is None else cwd
+        self.file_extension = self.DEFAULT_FILE_EXTENSION
+        self.system_root = self.DEFAULT_SYSTEM_ROOT
+        self.user_root = self.DEFAULT_USER_ROOT
+        self.local_dir = join(self.cwd, self.DEFAULT_LOCAL_DIRECTORY_NAME)
+
+        # If `name` is an import name and an explict version was
+        # not provided then the version will be looked up from
+        # the distribution.
+        if version is None:
+            self.name = self._name.split(".")[-1]
+        else:
+            self.name = self._name
+
+        self.child_dir = join(self.DEFAULT_PARENT_APPLICATION_NAME, self.name)
+
+        if not lazy:
+            for attribute in self.LAZY_ATTRIBUTES:
+                getattr(self, attribute)
+
+    @lazy_attribute
+    def environment_root(self):
+        """
+        The configuration root read from ``DEFAULT_ENVIRONMENT_PATH_VARIABLE``
+        """
+        return read_env(self.DEFAULT_ENVIRONMENT_PATH_VARIABLE, None)
+
+    @lazy_attribute
+    def distribution(self):
+        """
+        The distribution for ``name`` or ``None`` if an explicit version
+        was provided.
+
+        :raises ValueError:
+            Raised if no version was provided and ``name`` is not the
+            name of an installed Python package.
+        """
+        if self._version is not None:
+            return None
+
+        try:
+            from importlib.metadata import (
+                PackageNotFoundError, distribution)
+        except ImportError:  # pragma: no cover
+            from pkg_resources import (
+                DistributionNotFound as PackageNotFoundError,
+                get_distribution as distribution)
+
+        try:
+            return distribution(self._name)
+
+        except PackageNotFoundError:
+            raise ValueError(
+                "%r is not a Python package so you must provide "
+                "a version." % self._name)
+
+    @lazy_attribute
+    def version(self):
+        """
+        The version provided to :class:`Configuration` or the version
+        of the ``distribution``.
+        """
+        if self._version is not None:
+            return self._version
+        return self.distribution.version
+
+    @lazy_attribute
+    def tempdir(self):
+        """
+        The directory which temporary files, such as snapshots, are written
+        to.  The directory will be created if it does not already exist.
+        """
+        tempdir = join(self.DEFAULT_TEMP_DIRECTORY_ROOT, self.name)
+
+        # Create the base tempdir if it does not already
+        # exist.  We're handling the exception instead of
+        # using isdir() because it's possible multiple
+        # processes could try to create the directory and
+        # it's safer to let the file system handle it.
+        try:
+            os.makedirs(tempdir)
+        except OSError as e:
+            if e.errno != EEXIST:
+                raise
+        else:
+            logger.debug("Created %r", tempdir)
+
+        return tempdir
+
+    @lazy_attribute
+    def package_configuration(self):
+        """
+        The path to the package's built-in configuration file.  This will
+        be loaded before anything else to provide the default values.
+        """
+        try:
+            __import__(self._name)
+            package_directory = dirname(
+                abspath(sys.modules[self._name].__file__))
+
+        # ImportError - not a module
+        # AttributeError/TypeError - a module without a __file__ attribute
+        except (ImportError, AttributeError, TypeError):
+            logger.warning(
+                "Could not determine the default configuration file "
+                "path for %s", self.name)
+            return None
+
+        return join(
+            package_directory, "etc",
+            self._name.split(".")[-1] + self.file_extension)
+
+    @lazy_attribute
+    def log_trace(self):
+        """
+        If True the :class:`LoadTrace` for each load is logged, along
+        with the trace as a dictionary in the ``configuration_trace``
+        attribute of the log record.  Defaults to the value of
+        :envvar:`PYFARM_CONFIG_TRACE`.
+        """
+        # Read for every instance, so keep it out of the INFO logs
+        return read_env_bool(
+            "PYFARM_CONFIG_TRACE", False, log_result=False)
+
+    def split_version(self, sep="."):
+        """
+        Splits ``self.version`` into a tuple of individual versions.  For
+        example ``1.2.3`` would be split into ``['1', '1.2', '1.2.3']``
+        """
+        if not self.version:
+            return []
+
+        split = self.version.split(sep)
+        return list(reversed([
+            sep.join(split[:index]) for index, _ in enumerate(split, start=1)]))
+
+    def listdir(self, directory):
+        """
+        Returns a tuple of two frozen sets, the names of the directories
+        and the names of the files in ``directory``, or ``None`` if
+        ``directory`` does not exist.  Results, including negative results,
+        are stored in ``listing`` so each directory is only read
+        once.
+        """
+        directory = normpath(directory)
+
+        try:
+            return self.listing[directory]
+        except KeyError:
+            pass
+
+        try:
+            if scandir is not None:
+                directories, files = set(), set()
+                for entry in scandir(directory):
+                    if entry.is_dir():
+                        directories.add(entry.name)
+                    elif entry.is_file():
+                        files.add(entry.name)
+            else:  # pragma: no cover
+                names = os.listdir(directory)
+                directories = [
+                    name for name in names if isdir(join(directory, name))]
+                files = [
+                    name for name in names if isfile(join(directory, name))]
+
+        except OSError:
+            entries = None
+
+        else:
+            entries = (frozenset(directories), frozenset(files))
+
+        if self.trace is not None:
+            self.trace.listings += 1
+
+        self.listing[directory] = entries
+        return entries
+
+    def isfile(self, path):
+        """
+        Returns True if ``path`` is a file using the results
+        from :meth:`listdir`.
+        """
+        entries = self.listdir(dirname(path))
+        return entries is not None and basename(path) in entries[1]
+
+    def roots(self):
+        """
+        Returns a list of the platform dependent root directories which
+        may contain configuration files or versioned subdirectories.
+        """
+        roots = []
+
+        # If provided, insert the default root
+        if self.system_root:  # could be empty in the environment
+            roots.append(join(self.system_root, self.child_dir))
+
+        # If provided, append the user directory
+        if self.user_root:  # could be empty in the environment
+            if not WINDOWS:
+                roots.append(join(self.user_root, "." + self.child_dir))
+            else:
+                roots.append(join(self.user_root, self.child_dir))
+
+        # If provided append a local directory
+        if self.local_dir is not None:
+            roots.append(join(self.local_dir, self.child_dir))
+
+        # If provided, append the root discovered in the environment
+        if self.environment_root is not None:
+            roots.append(join(self.environment_root, self.child_dir))
+
+        return roots
+
+    def directories(self, validate=True, unversioned_only=False):
+        """
+        Returns a list of platform dependent directories which may contain
+        configuration files.
+
+        :param bool validate:
+            When ``True`` this method will only return directories
+            which exist on disk.  Each root directory is read once
+            by :meth:`listdir` rather than checking each versioned
+            directory individually.
+
+        :param bool unversioned_only:
+            When ``True`` this method will only return versionless directories
+            instead of both versionless and versioned directories.
+        """
+        versions = []
+
+        if not unversioned_only:
+            versions.extend(self.split_version())
+
+        versions.append("")  # the 'version free' directory
+        existing_directories = []
+
+        for root in self.roots():
+            entries = self.listdir(root) if validate else None
+
+            for tail in versions:
+                if not validate or (
+                        entries is not None
+                        and (not tail or tail in entries[0])):
+                    existing_directories.append(join(root, tail))
+
+        return existing_directories
+
+    def fragment_directory(self, directory):
+        """
+        Returns the path to the directory of fragments in ``directory``,
+        ``agent.d`` for the ``agent`` configuration for example.
+        """
+        return join(directory, self.name + self.FRAGMENT_DIRECTORY_EXTENSION)
+
+    def fragments(self, directory):
+        """
+        Returns the configuration files in the :meth:`fragment_directory`
+        of ``directory`` sorted by name.  Fragments are loaded after the
+        configuration file in ``directory`` so they can override the values
+        it contains, later fragments overriding earlier ones.  This allows
+        separate files, ``agent.d/10-pool.yml`` and ``agent.d/20-host.yml``
+        for example, to be generated independently of each other.  Hidden
+        files are ignored.
+        """
+        entries = self.listdir(directory)
+        fragment_directory = self.fragment_directory(directory)
+
+        # Check the parent directory's listing first so directories
+        # without fragments don't cost an extra call to listdir()
+        if entries is None or basename(fragment_directory) not in entries[0]:
+            return []
+
+        entries = self.listdir(fragment_directory)
+        if entries is None:  # pragma: no cover
+            return []
+
+        return [
+            join(fragment_directory, name) for name in sorted(entries[1])
+            if name.endswith(self.file_extension)
+            and not name.startswith(".")]
+
+    def files(self, validate=True, unversioned_only=False):
+        """
+        Returns a list of configuration files including the fragments
+        returned by :meth:`fragments`.
+
+        :param bool validate:
+            When ``True`` this method will only return files
+            which exist on disk.  Fragments are only included when
+            ``validate`` is ``True``.
+
+            .. note::
+
+                This method calls :meth:`directories` and will
+                be passed the value that is provided to ``validate``
+                here.
+
+        :param bool unversioned_only:
+            See the keyword documentation for ``unversioned_only`` in
+            :meth:`directories``
+        """
+        directories = self.directories(
+            validate=validate, unversioned_only=unversioned_only)
+        filename = self.name + self.file_extension
+        existing_files = []
+
+        if self.package_configuration is not None:
+            if not validate or self.isfile(self.package_configuration):
+                existing_files.append(self.package_configuration)
+
+            else:
+                logger.warning(
+                    "%r does not have a default configuration file. Expected "
+                    "to find %r but this path does not exist.",
+                    self._name, self.package_configuration)
+
+        for directory in directories:
+            filepath = join(directory, filename)
+
+            if not validate or self.isfile(filepath):
+                existing_files.append(filepath)
+
+            if validate:
+                existing_files.extend(self.fragments(directory))
+
+        if not existing_files:  # pragma: no cover
+            logger.error(
+                "No configuration file(s) %s were found in %s",
+                filename, _pformat(directories))
+
+        return existing_files
+
+    def snapshot_path(self, files):
+        """
+        Returns the path to the snapshot for ``files``.  The name of the
+        snapshot is derived from the list of candidate files so
+        processes started from different working directories won't
+        overwrite each other's snapshots.
+
+        :param list files:
+            The list of configuration files, typically the result
+            of :meth:`files`
+        """
+        from hashlib import sha1
+        digest = sha1("\0".join(files).encode("utf-8")).hexdigest()
+        return join(
+            self.tempdir,
+            "%s-%s%s" % (self.name, digest[:16], self.SNAPSHOT_EXTENSION))
+
+    def _stat_signature(self, filepath):
+        """
+        Returns a tuple of ``(path, mtime, size, inode)`` for ``filepath``
+        which is used to determine if a snapshot is still valid.
+        """
+        stat = os.stat(filepath)
+        mtime = getattr(stat, "st_mtime_ns", stat.st_mtime)
+        return filepath, mtime, stat.st_size, stat.st_ino
+
+    def _read_snapshot(self, files):
+        """
+        Returns the parsed documents stored in the snapshot for ``files``
+        or ``None`` if the snapshot does not exist, can't be read or
+        one of the source files has changed since it was written.
+        """
+        path = self.snapshot_path(files)
+
+        try:
+            # Never unpickle data which was written by another user.
+            if hasattr(os, "getuid") and os.stat(path).st_uid != os.getuid():
+                logger.warning(
+                    "Ignoring snapshot %r, it is not owned by the "
+                    "current user", path)
+                return None
+
+            with open(path, "rb") as stream:
+                snapshot = pickle.load(stream)
+
+            sources = [self._stat_signature(filepath) for filepath in files]
+
+        except (OSError, IOError):
+            return None
+
+        except Exception as e:  # pragma: no cover
+            logger.warning("Failed to read snapshot %r: %s", path, e)
+            return None
+
+        if not isinstance(snapshot, dict) \
+                or snapshot.get("format") != self.SNAPSHOT_FORMAT \
+                or snapshot.get("sources") != sources:
+            logger.debug("Snapshot %r is out of date", path)
+            return None
+
+        logger.debug("Using snapshot %r", path)
+        return snapshot["documents"]
+
+    def _write_snapshot(self, files, documents):
+        """
+        Writes ``documents`` to the snapshot for ``files``.  The data is
+        written to a temporary file first and then renamed so other
+        processes never see a partially written snapshot.
+        """
+        from tempfile import mkstemp
+        path = self.snapshot_path(files)
+
+        try:
+            snapshot = {
+                "format": self.SNAPSHOT_FORMAT,
+                "sources": [
+                    self._stat_signature(filepath) for filepath in files],
+                "documents": documents}
+            fd, temporary_path = mkstemp(
+                dir=self.tempdir, suffix=self.SNAPSHOT_EXTENSION)
+            with os.fdopen(fd, "wb") as stream:
+                pickle.dump(snapshot, stream, pickle.HIGHEST_PROTOCOL)
+
+            try:
+                os.rename(temporary_path, path)
+            except OSError:  # pragma: no cover
+                # Windows won't rename over an existing file
+                os.remove(path)
+                os.rename(temporary_path, path)
+
+        except (OSError, IOError, pickle.PicklingError) as e:
+            logger.warning("Failed to write snapshot %r: %s", path, e)
+
+        else:
+            logger.debug("Wrote snapshot %r", path)
+
+    def _parse_file(self, filepath):
+        """
+        Parses and returns the data contained in ``filepath``.  If a
+        compiled version of ``filepath``, produced by :func:`compile_file`,
+        exists and is newer than ``filepath`` the data will be loaded from
+        the compiled file instead.
+        """
+        compiled = filepath + self.COMPILED_EXTENSION
+        trace = self.trace.file(filepath) if self.trace is not None else None
+
+        if self.isfile(compiled):
+            data, size = _read_compiled(filepath, compiled)
+
+            if trace is not None:
+                trace.stats += 2
+                trace.bytes += size
+
+            if data is not NOTSET:
+                return data
+
+        with open(filepath, "rb") as stream:
+            data = _load_yaml(stream)
+
+            if trace is not None:
+                trace.bytes += stream.tell()
+
+            return data
+
+    def _parse_files(self, files):
+        """
+        Parses each file in ``files`` and returns a list of
+        ``(filepath, data)`` tuples.  Files which could not be
+        parsed are logged and skipped.  The parsed data for each
+        file is kept on the instance, keyed by the file's
+        :meth:`_stat_signature`, so only files which have changed will
+        be parsed again on subsequent calls.
+        """
+        trace = self.trace
+        stage_start = default_timer()
+        documents = []
+
+        for filepath in files:
+            if trace is not None:
+                file_trace = trace.file(filepath)
+                file_trace.stats += 1
+
+            try:
+                signature = self._stat_signature(filepath)
+            except OSError:  # pragma: no cover
+                signature = None
+
+            cached = self._parsed.get(filepath)
+            if signature is not None and cached is not None \
+                    and cached[0] == signature:
+                documents.append((filepath, cached[1]))
+                if trace is not None:
+                    file_trace.cached = True
+                continue
+
+            try:
+                start = default_timer()
+                data = self._parse_file(filepath)
+                if trace is not None:
+                    file_trace.parse_time = default_timer() - start
+
+            except _yaml().YAMLError as e:  # pragma: no cover
+                logger.error("Failed to load %r: %s", filepath, e)
+                self._parsed.pop(filepath, None)
+
+            else:
+                self._parsed[filepath] = (signature, data)
+                documents.append((filepath, data))
+
+        if trace is not None:
+            trace.record("parse", stage_start)
+
+        return documents
+
+    def load(self, environment=None, snapshot=False):
+        """
+        Loads data from the configuration files.  Any data present
+        in the ``env`` key in the configuration files will update
+        ``environment``
+
+        :param dict environment:
+            A dictionary to load data in the ``env`` key from
+            the configuration files into.  This would typically be
+            set to ``os.environ`` so the environment itself could
+            be updated.
+
+        :param bool snapshot:
+            If ``True`` then reuse the parsed data stored in a snapshot
+            under ``tempdir`` so long as the path, modification time,
+            size and inode of every configuration file is unchanged.  If
+            the snapshot is missing or out of date the files will be
+            parsed and a new snapshot will be written.
+
+        Once loaded, the paths of the files are kept in ``loaded`` in the
+        order their data was applied and the merged ``env`` sections are
+        kept in ``env``.  The documents from the sources added with
+        :meth:`add_remote` are requested and applied after the files,
+        their urls are used in place of a file path.
+        """
+        self._publish(self._read_documents(snapshot), environment=environment)
+
+    def _read_documents(self, snapshot=False, fetch=True):
+        """
+        Returns the ``(filepath, data)`` tuples for :meth:`load` from
+        either the snapshot or by parsing the files followed by the
+        documents from :meth:`_remote_documents`.
+        """
+        trace = self._start_trace()
+        start = default_timer()
+        files = self.files()
+        start = trace.record("discovery", start)
+        documents = None
+
+        if snapshot:
+            documents = self._read_snapshot(files)
+            trace.record("snapshot", start)
+
+        if documents is None:
+            documents = self._parse_files(files)
+
+            if snapshot:
+                start = default_timer()
+                self._write_snapshot(files, documents)
+                trace.record("snapshot", start)
+
+        return documents + self._remote_documents(fetch=fetch)
+
+    def _remote_documents(self, fetch=True):
+        """
+        Returns the ``(url, data)`` tuples for the sources in ``remotes``
+        which have a document, calling :meth:`.RemoteSource.fetch` on each
+        source first if ``fetch`` is True.
+        """
+        if not self.remotes:
+            return []
+
+        start = default_timer()
+        if fetch:
+            for source in self.remotes:
+                source.fetch(self)
+
+        if self.trace is not None:
+            self.trace.record("remote", start)
+
+        return [
+            (source.url, source.data) for source in self.remotes
+            if source.data is not NOTSET]
+
+    def _start_trace(self):
+        """
+        Replaces ``trace`` with a new :class:`LoadTrace`, for the load which
+        is about to start, and returns it.
+        """
+        self.trace = LoadTrace()
+        return self.trace
+
+    def _publish(self, documents, environment=None, clear=False):
+        """
+        Calls :meth:`_apply_documents`, replacing the existing data rather
+        than merging into it if ``clear`` is True, then sends the resulting
+        :class:`ChangeSet` to the subscribers added with :meth:`subscribe`.
+
+        Everything happens under ``_publish_lock`` so two threads loading
+        at the same time each report only their own changes, and the
+        subscribers receive the change sets in the order the changes
+        were made.
+        """
+        trace = self.trace
+        if trace is None:
+            trace = self._start_trace()
+
+        with self._publish_lock:
+            if self.subscribers:
+                start = default_timer()
+                old = self._change_state()
+                trace.record("notify", start)
+
+            self._apply_documents(
+                documents, environment=environment, clear=clear)
+
+            if self.subscribers:
+                start = default_timer()
+                changes = diff(old, self._change_state())
+                if changes:
+                    self._notify(changes)
+                trace.record("notify", start)
+
+        trace.finish()
+
+        if self.log_trace:
+            logger.info(
+                "Loaded %s configuration in %s", self.name, trace,
+                extra={"configuration_trace": trace.as_dict()})
+
+    def _apply_documents(self, documents, environment=None, clear=False):
+        """
+        Merges the ``(filepath, data)`` tuples in ``documents`` into this
+        instance and updates ``loaded`` and ``env``.  This is
+        the part of :meth:`load` which does not touch the disk.
+
+        The documents are merged, and the schema is applied, to a separate
+        dictionary which is then published by :meth:`_replace`.  Other
+        threads never see an empty or partially merged instance, see
+        :meth:`_replace` for the guarantees.
+
+        :param bool clear:
+            If True, replace the data in this instance instead of
+            merging the documents into it.
+        """
+        trace = self.trace
+        if trace is None:
+            trace = self._start_trace()
+
+        stage_start = default_timer()
+        merged = {} if clear else dict(self)
+        loaded = []
+        env = {}
+
+        for filepath, data in documents:
+            loaded.append(filepath)
+
+            # Empty file
+            if not data:
+                continue
+
+            # Copy the data, including nested containers, so changes
+            # made to the instance never reach the parsed documents
+            # which are reused by reload() and may have come from
+            # a snapshot.
+            data = _copy_containers(data)
+
+            if environment is not None and "env" in data:
+                config_environment = data.pop("env")
+                assert isinstance(config_environment, dict)
+                environment.update(config_environment)
+                env.update(config_environment)
+
+            elif environment is None:
+                logger.warning(
+                    "No environment was provided to be populated by the "
+                    "configuration file(s)")
+
+            start = default_timer()
+            self._merge(data, target=merged)
+            trace.file(filepath).merge_time = default_timer() - start
+
+        trace.record("merge", stage_start)
+
+        if loaded:
+            logger.info(
+                "Loaded configuration file(s): %s", _pformat(loaded))
+        else:
+            logger.warning(
+                "No configuration files were loaded after searching %s",
+                _pformat(self.files(validate=False)))
+
+        if self.schema:
+            start = default_timer()
+            merged.update(self._schema_updates(
+                _StagedConfiguration(merged, self.tempdir)))
+            trace.record("schema", start)
+
+        # Expanding the new data may fail, a circular reference for
+        # example, so the frozen copy is built before anything is
+        # published.  Nothing changes if this raises.
+        frozen = None
+        if self.frozen is not None:
+            start = default_timer()
+            frozen = self._frozen_copy(
+                _StagedConfiguration(merged, self.tempdir))
+            trace.record("expansion", start)
+
+        with self._publish_lock:
+            self._replace(merged)
+            self.env = env
+            self.loaded = tuple(loaded)
+
+            if frozen is not None:
+                self.frozen = frozen
+
+    def _replace(self, data):
+        """
+        Replaces the data in this instance with ``data``.  Every key which
+        is in both the old and the new data is updated by a single
+        :meth:`dict.update` call, which does not run any Python code for
+        string keys, so other threads will see either the old or the new
+        value for a key but never a :class:`KeyError`.  Keys which are
+        not in ``data`` are removed afterwards.
+
+        Threads which need every value to come from the same load should
+        read from ``frozen`` instead, see :meth:`freeze`.
+        """
+        removed = [key for key in dict.keys(self) if key not in data]
+        dict.update(self, data)
+        for key in removed:
+            dict.pop(self, key, None)
+        self._generation += 1
+
+    def freeze(self):
+        """
+        Returns an :class:`pyfarm.core.utility.ImmutableDict` containing
+        the data in this instance with every string value already expanded
+        by :meth:`_expandvars`.  The result is also published as
+        ``frozen`` and, from then on, a new frozen copy will be published
+        each time :meth:`load` or :meth:`reload` is called.
+
+        Publishing is a single attribute assignment so threads reading
+        from ``frozen`` never need a lock and never see a partially
+        loaded configuration.  Each reader should keep a reference to
+        ``frozen`` for as long as it needs consistent values:
+
+        >>> config = Configuration("agent", "1.2.3")
+        >>> config.update(root="/tmp", path="$root/foo")
+        >>> view = config.freeze()
+        >>> assert view["path"] == "/tmp/foo" and config.frozen is view
+        """
+        # The lock prevents a load on another thread from replacing
+        # the data while it's being copied.
+        with self._publish_lock:
+            frozen = self.frozen = self._frozen_copy(self)
+        return frozen
+
+    def _frozen_copy(self, data):
+        """
+        Returns the :class:`pyfarm.core.utility.ImmutableDict` published
+        by :meth:`freeze` for ``data``, either this instance or a
+        :class:`_StagedConfiguration`.
+        """
+        # Imported here because pyfarm.core.utility imports this module
+        from pyfarm.core.utility import ImmutableDict
+
+        return ImmutableDict(
+            (key, _expand_copy(data, dict.__getitem__(data, key)))
+            for key in list(dict.keys(data)))
+
+    def compile(self):
+        """
+        Runs :func:`compile_file` on each file returned by :meth:`files`
+        and returns a list of the compiled files.
+        """
+        return [compile_file(path) for path in self.files()]
+
+    def register(self, key, type=None, default=NOTSET, converter=None):
+        """
+        Registers the type, default value and converter for ``key`` in
+        ``schema``.  Once registered the value will be converted by
+        :meth:`apply_schema` each time :meth:`load` is called so reading
+        the value will always return the converted result.
+
+        >>> config = Configuration("agent", "1.2.3")
+        >>> config.register("port", int, default=50000)
+        >>> config.register("use_ssl", bool, default=False)
+        >>> config.update(port="8080", use_ssl="yes")
+        >>> config.apply_schema()
+        >>> assert config["port"] == 8080 and config["use_ssl"] is True
+
+        :param type:
+            The type the value must be after conversion.  If ``None``
+            then only ``converter`` will be applied.
+
+        :param default:
+            The value to use if ``key`` is not present.  If not provided
+            then ``key`` is required.
+
+        :param callable converter:
+            The callable which converts the value.  If not provided then
+            :meth:`pyfarm.core.utility.convert.bool` is used for ``bool``,
+            :meth:`pyfarm.core.utility.convert.list` is used for ``list``
+            and ``type`` itself is used for everything else.
+        """
+        if converter is None and type is not None:
+            # Imported here because pyfarm.core.utility imports this module
+            from pyfarm.core.utility import convert
+            converter = {
+                bool: convert.bool, list: convert.list}.get(type, type)
+
+        self.schema[key] = SchemaField(type, default, converter)
+
+    def apply_schema(self):
+        """
+        Converts and validates every key in ``schema``, replacing the
+        values stored on the instance with the results.  All problems are
+        collected before raising so a single call reports every invalid
+        value.  Strings are expanded before they're converted and any
+        ``$`` in a converted string is stored as ``$$`` so reading the
+        value returns exactly what the converter produced.
+
+        :raises TypeError:
+            Raised if a required key is missing or a value could not be
+            converted to the registered type.
+        """
+        self.update(self._schema_updates(self))
+
+    def _schema_updates(self, data):
+        """
+        Returns a dictionary of the values in ``data`` converted by
+        ``schema``, see :meth:`apply_schema`.  ``data`` is either this
+        instance or a :class:`_StagedConfiguration`.
+        """
+        updates = {}
+        errors = []
+
+        for key in sorted(self.schema):
+            field = self.schema[key]
+
+            if not dict.__contains__(data, key):
+                if field.default is NOTSET:
+                    errors.append("%r is required" % key)
+                else:
+                    updates[key] = field.default
+                continue
+
+            # Only strings are expanded so containers are converted,
+            # and stored, without expanding the values inside of them.
+            value = dict.__getitem__(data, key)
+            if isinstance(value, STRING_TYPES):
+                value = data._expandvars(value)
+
+            try:
+                value = field.convert(value)
+            except (TypeError, ValueError) as e:
+                errors.append("%r: %s" % (key, e))
+                continue
+
+            # The value has already been expanded, escape any strings
+            # so get() returns them as they are rather than expanding
+            # them a second time.
+            if isinstance(value, STRING_TYPES):
+                value = value.replace("$", "$$")
+
+            updates[key] = value
+
+        if errors:
+            raise TypeError(
+                "Configuration does not match the schema: %s" %
+                "; ".join(errors))
+
+        return updates
+
+    def _merge(self, data, target=None):
+        """
+        Updates ``target``, this instance by default, with ``data``
+        using the policies in ``merge_policies``.
+        """
+        if target is None:
+            target = self
+
+        updates = {}
+
+        for key, value in data.items():
+            if dict.__contains__(target, key):
+                value = _merge_value(
+                    dict.__getitem__(target, key), value,
+                    self.merge_policies.get(key, self.DEFAULT_MERGE_POLICY),
+                    self.merge_policies, key)
+            updates[key] = value
+
+        target.update(updates)
+
+    def reload(self, environment=None, snapshot=False):
+        """
+        Reads the configuration files then replaces the data in this
+        instance with the result, see :meth:`load`.  Only the files which
+        have changed since they were last loaded will be parsed again, the
+        merged data is rebuilt from the results stored for all other
+        files.  ``listing`` is also cleared, for every instance sharing
+        it, so new files will be discovered.  Any values which were set on
+        the instance directly, rather than loaded from a file, will be
+        removed.  Subscribers added with :meth:`subscribe` are notified of
+        the keys which changed.
+
+        :param dict environment:
+            See the documentation for ``environment`` in :meth:`load`
+
+        :param bool snapshot:
+            See the documentation for ``snapshot`` in :meth:`load`
+        """
+        self.listing.clear()
+        self._publish(
+            self._read_documents(snapshot), environment=environment,
+            clear=True)
+
+    def add_remote(self, url, interval=300, jitter=0.1, timeout=10,
+                   headers=None):
+        """
+        Adds, and returns, a :class:`pyfarm.core.remote.RemoteSource` which
+        will provide a layer retrieved from ``url`` each time this instance
+        is loaded.  See :class:`.RemoteSource` for the keyword arguments.
+        """
+        from pyfarm.core.remote import RemoteSource
+        source = RemoteSource(
+            url, interval=interval, jitter=jitter, timeout=timeout,
+            headers=headers)
+        self.remotes.append(source)
+        return source
+
+    def refresh(self, environment=None, force=False):
+        """
+        Requests the document from each source in ``remotes`` which is
+        due to be refreshed and reloads this instance, without requesting
+        the documents again, if any of them changed.  Returns True if
+        the instance was reloaded.
+
+        :param dict environment:
+            See the documentation for ``environment`` in :meth:`load`
+
+        :param bool force:
+            If True request every document, even those which are
+            not due to be refreshed yet.
+        """
+        changed = False
+        for source in self.remotes:
+            if force or source.due():
+                changed = source.fetch(self) or changed
+
+        if changed:
+            self.listing.clear()
+            self._publish(
+                self._read_documents(fetch=False), environment=environment,
+                clear=True)
+
+        return changed
+
+    def subscribe(self, callback, keys=None):
+        """
+        Calls ``callback(config, changes)`` each time :meth:`load` or
+        :meth:`reload` changes the data in this instance, ``changes``
+        being a :class:`ChangeSet`.  Values are compared after expansion
+        so changing a variable also reports the keys which refer to it.
+        ``callback`` is called after every key has been replaced so it
+        always sees the complete new data.
+
+        :param callable callback:
+            The function to call with the instance and the change set.
+
+        :param keys:
+            A key or list of keys.  If provided ``callback`` will
+            only be called when one of these keys, or a key nested below
+            one of them such as ``env``, changes.
+        """
+        if isinstance(keys, STRING_TYPES):
+            keys = (keys, )
+
+        if keys is not None:
+            keys = frozenset(keys)
+
+        self.subscribers.append((callback, keys))
+        return callback
+
+    def unsubscribe(self, callback):
+        """Removes ``callback`` which was added with :meth:`subscribe`"""
+        self.subscribers[:] = [
+            subscriber for subscriber in self.subscribers
+            if subscriber[0] is not callback]
+
+    def _change_state(self):
+        """
+        Returns a dictionary of the current, expanded, values to
+        compare using :func:`diff`.  The variables in the ``env``
+        section are included as ``env.<name>``.
+        """
+        state = {}
+
+        for key in dict.keys(self):
+            try:
+                value = _expand_all(self, self[key])
+            except ValueError:  # circular reference
+                value = dict.__getitem__(self, key)
+
+            if key == "env" and isinstance(value, dict):
+                for name, env_value in value.items():
+                    state["env." + name] = env_value
+            else:
+                state[key] = value
+
+        for name, value in self.env.items():
+            state["env." + name] = value
+
+        return state
+
+    def _notify(self, changes):
+        """
+        Calls each subscriber interested in ``changes``.  Errors
+        raised by the subscribers are logged so one subscriber can't
+        prevent the others from being called.
+        """
+        for callback, keys in list(self.subscribers):
+            if keys is not None and not changes.affects(keys):
+                continue
+
+            try:
+                callback(self, changes)
+            except Exception as e:
+                logger.error(
+                    "Subscriber %r failed to handle changes to %s: %s",
+                    callback, sorted(changes.keys), e)
+
+    def load_async(self, environment=None, snapshot=False, executor=None):
+        """
+        Returns a coroutine which loads this instance without blocking the
+        event loop, see :func:`pyfarm.core.aio.load`.  Requires Python 3.7
+        or higher.
+        """
+        from pyfarm.core.aio import load
+        return load(
+            self, environment=environment, snapshot=snapshot,
+            executor=executor)
+
+    def reload_async(self, environment=None, snapshot=False, executor=None):
+        """
+        Returns a coroutine which reloads this instance without blocking the
+        event loop, see :func:`pyfarm.core.aio.reload`.  Requires Python 3.7
+        or higher.
+        """
+        from pyfarm.core.aio import reload
+        return reload(
+            self, environment=environment, snapshot=snapshot,
+            executor=executor)
+
+    def watch(self, environment=None, callback=None, interval=5, poll=False):
+        """
+        Starts and returns a thread which calls :meth:`reload` each time
+        one of the configuration files changes.  On Linux the directories
+        from :meth:`directories` are watched using inotify so no polling
+        is involved, elsewhere or if inotify is unavailable the files are
+        checked every ``interval`` seconds instead.
+
+        .. note::
+
+            inotify can only watch directories which exist when this method
+            is called.  Configuration directories created afterwards won't
+            be noticed until :meth:`watch` is called again.
+
+        :param dict environment:
+            Passed along to :meth:`reload`
+
+        :param callable callback:
+            If provided this will be called with the instance after each
+            reload.
+
+        :param int interval:
+            The number of seconds between checks when inotify is not
+            being used.
+
+        :param bool poll:
+            If ``True`` always check the files every ``interval`` seconds
+            instead of using inotify.  This is useful for network file
+            systems, such as NFS, where inotify won't see changes made
+            by other hosts.
+
+        The instance is frozen, see :meth:`freeze`, if it was not already.
+        Each reload then publishes a new ``frozen`` mapping so threads
+        which need every value to come from the same load should read
+        from ``frozen`` rather than from the instance itself.
+        """
+        if self.frozen is None:
+            self.freeze()
+
+        if not poll and InotifyWatcher.available():
+            watcher = InotifyWatcher(
+                self, environment=environment, callback=callback)
+        else:
+            watcher = PollingWatcher(
+                self, environment=environment, callback=callback,
+                interval=interval)
+
+        watcher.start()
+        return watcher
+
+    def watch_remotes(self, environment=None, callback=None):
+        """
+        Starts and returns a thread which calls :meth:`refresh` each time
+        one of the sources in ``remotes`` is due to be refreshed.  The
+        ``interval`` and ``jitter`` of each source control how often
+        the server is contacted.
+
+        :param dict environment:
+            Passed along to :meth:`refresh`
+
+        :param callable callback:
+            If provided this will be called with the instance each
+            time a document has changed
+        """
+        if not self.remotes:
+            raise ValueError("No remote sources have been added")
+
+        from pyfarm.core.remote import RemoteWatcher
+        watcher = RemoteWatcher(
+            self, environment=environment, callback=callback)
+        watcher.start()
+        return watcher
+
+    def share(self, path=None):
+        """
+        Returns a :class:`SharedConfiguration` containing the expanded
+        data in this instance, see :meth:`SharedConfiguration.create`
+        """
+        return SharedConfiguration.create(self, path=path)
+
+    def child(self, overrides=None, **kwargs):
+        """
+        Returns a :class:`ConfigurationOverlay` which layers ``overrides``,
+        and any keyword arguments, on top of this instance.  Nothing
+        in this instance is copied so the cost of creating an overlay
+        only depends on the number of overrides.
+
+        >>> config = Configuration("agent", "1.2.3")
+        >>> config.update(root="/tmp", path="$root/job")
+        >>> job = config.child(root="/jobs/1")
+        >>> assert job["path"] == "/jobs/1/job"
+        >>> assert config["path"] == "/tmp/job"
+        """
+        overrides = dict(overrides or {}, **kwargs)
+        return ConfigurationOverlay(self, overrides)
+
+    def get(self, key, default=None):
+        """
+        Overrides :meth:`dict.get` to provide internal variable
+        expansion through :meth:`_expandvars`.  If ``EXPAND_CONTAINERS``
+        is True dictionaries, lists and tuples are returned as
+        :class:`ExpandingMapping` and :class:`ExpandingSequence` views so
+        the strings nested inside of them are expanded when they're
+        retrieved.
+        """
+        return _expand(self, dict.get(self, key, default))
+
+    def __getitem__(self, item):
+        """
         Overrides :meth:`dict.__getitem__` to provide internal variable
-        expansion through :meth:`_expandvars`.
+        expansion through :meth:`_expandvars`, see :meth:`get`.
         """
-        value = super(Configuration, self).__getitem__(item)
-        if isinstance(value, STRING_TYPES):
-            value = self._expandvars(value)
-        return value
+        return _expand(self, dict.__getitem__(self, item))
+
+
+class _StagedConfiguration(VariableExpansion, dict):
+    """
+    The data produced by a load before it's published.  This expands
+    variables exactly the way :class:`Configuration` does so the schema
+    can be applied before the data is visible to other threads.
+    """
+    def __init__(self, data, tempdir):
+        super(_StagedConfiguration, self).__init__(data)
+        self.tempdir = tempdir
+
+
+class _ChainedLookup(object):
+    """
+    Minimal read only mapping which looks up keys in each of ``mappings``
+    in order.  Used by :class:`ConfigurationOverlay` to combine its
+    overrides with the template values of its parent without copying.
+    """
+    def __init__(self, *mappings):
+        self.mappings = mappings
+
+    def __contains__(self, key):
+        for mapping in self.mappings:
+            if key in mapping:
+                return True
+        return False
+
+    def __getitem__(self, key):
+        for mapping in self.mappings:
+            if key in mapping:
+                return mapping[key]
+        raise KeyError(key)
+
+
+class ConfigurationOverlay(VariableExpansion, Mapping):
+    """
+    Read only view produced by :meth:`Configuration.child` which layers
+    ``overrides`` on top of ``parent``.  The parent is shared rather than
+    copied so creating an overlay only costs as much as copying
+    ``overrides``.  Values are expanded the same way
+    :meth:`Configuration.get` expands them except the overrides take
+    precedence over the values in the parent.  Any changes to the parent,
+    including a reload, are visible through the overlay.
+
+    :param parent:
+        The :class:`Configuration` or :class:`ConfigurationOverlay`
+        to layer ``overrides`` on top of.
+
+    :param dict overrides:
+        The values which should take precedence over the
+        values in ``parent``.
+    """
+    def __init__(self, parent, overrides):
+        self.parent = parent
+        self.overrides = dict(overrides)
+        self._parent_results = None
+
+    def raw(self, key):
+        """
+        Returns the value for ``key`` without performing any
+        variable expansion.
+        """
+        try:
+            return self.overrides[key]
+        except KeyError:
+            if isinstance(self.parent, ConfigurationOverlay):
+                return self.parent.raw(key)
+            return dict.__getitem__(self.parent, key)
+
+    def child(self, overrides=None, **kwargs):
+        """
+        Returns a new overlay on top of this one, see
+        :meth:`Configuration.child`
+        """
+        overrides = dict(overrides or {}, **kwargs)
+        return ConfigurationOverlay(self, overrides)
+
+    def _expansion_cache(self):
+        """
+        Returns the expansion cache for this overlay, which is rebuilt
+        each time the parent's expansion cache is rebuilt.
+        """
+        parent_results = self.parent._expansion_cache()
+
+        if self._parent_results is not parent_results:
+            self._parent_results = parent_results
+            self._template_values = _ChainedLookup(
+                self.overrides, self.parent._template_values)
+            self._expanded_names = {}
+            self._expansion_results = {}
+            self._expansion_depends = {}
+            self._expanded_views = {}
+
+        return self._expansion_results
+
+    def invalidate(self):
+        """
+        Discards the cached results for this overlay and its parent, see
+        :meth:`Configuration.invalidate`
+        """
+        self.parent.invalidate()
+        self._parent_results = None
+
+    def _template_value(self, name, sources=None):
+        try:
+            return self.overrides[name]
+        except KeyError:
+            return self.parent._template_value(name, sources)
+
+    @property
+    def EXPAND_CONTAINERS(self):
+        return self.parent.EXPAND_CONTAINERS
+
+    @property
+    def _template_sources(self):
+        return self.parent._template_sources
+
+    def _current_sources(self):
+        return self.parent._current_sources()
+
+    def __getitem__(self, key):
+        return _expand(self, self.raw(key))
+
+    def __contains__(self, key):
+        return key in self.overrides or key in self.parent
+
+    def __iter__(self):
+        for key in self.overrides:
+            yield key
+
+        for key in self.parent:
+            if key not in self.overrides:
+                yield key
+
+    def __len__(self):
+        return len(self.overrides) + len(
+            [key for key in self.parent if key not in self.overrides])
+
+    def __repr__(self):
+        return "%s(%r, %r)" % (
+            self.__class__.__name__, self.parent, self.overrides)
+
+
+class ConfigurationSet(Mapping):
+    """
+    Builds and loads several :class:`Configuration` instances, keyed by
+    name, which share a single ``listing``.  Each instance searches its own
+    directory below the same parent directories, ``/etc/pyfarm`` for
+    example, so the parents are listed once for the whole set and
+    instances without a directory below a parent never look for one.
+
+    .. code-block:: python
+
+        configurations = ConfigurationSet(["pyfarm.master", "pyfarm.agent"])
+        configurations.load(environment=os.environ)
+        master = configurations["pyfarm.master"]
+
+    :param names:
+        The names to create instances for.  Each entry may either be a
+        name or a ``(name, version)`` tuple.
+
+    :param string cwd:
+        See the documentation for ``cwd`` in :class:`Configuration`
+
+    :param bool lazy:
+        See the documentation for ``lazy`` in :class:`Configuration`
+
+    :param dict listing:
+        The ``listing`` to share between the instances, a new dictionary
+        is used if not provided.
+    """
+    def __init__(self, names=(), cwd=None, lazy=False, listing=None):
+        self.cwd = cwd
+        self.lazy = lazy
+        self.listing = {} if listing is None else listing
+        self.configurations = {}
+        self.names = []
+
+        for name in names:
+            if isinstance(name, STRING_TYPES):
+                self.add(name)
+            else:
+                self.add(*name)
+
+    def add(self, name, version=None):
+        """
+        Creates, stores and returns a :class:`Configuration` for ``name``
+        which shares ``listing`` with the other instances in the set.
+        """
+        if name in self.configurations:
+            raise ValueError("%r is already part of the set" % name)
+
+        config = Configuration(
+            name, version=version, cwd=self.cwd, listing=self.listing,
+            lazy=self.lazy)
+        self.configurations[name] = config
+        self.names.append(name)
+        return config
+
+    def walk(self):
+        """
+        Lists the parent directory of every root once and records
+        the roots which don't exist in ``listing`` so the instances
+        won't try to list them individually.
+        """
+        for config in self.values():
+            for root in config.roots():
+                root = normpath(root)
+                if root in self.listing:
+                    continue
+
+                # Every instance shares the listing so it does not
+                # matter which one lists the parent directory.
+                entries = config.listdir(dirname(root))
+                if entries is None or basename(root) not in entries[0]:
+                    self.listing[root] = None
+
+    def _parse(self):
+        """
+        Returns a dictionary of the documents, as returned by
+        :meth:`Configuration._parse_files`, for each instance.
+
+        The files are parsed one after the other.  Parsing YAML holds
+        the GIL so a thread pool is slower, not faster, see
+        ``benchmarks/configuration_set_parse.py``.
+        """
+        documents = {}
+        for name in self.names:
+            config = self.configurations[name]
+            documents[name] = config._parse_files(config.files())
+
+        return documents
+
+    def load(self, environment=None, snapshot=False):
+        """
+        Loads every instance in the set, see :meth:`Configuration.load`.
+        """
+        self._load(environment=environment, snapshot=snapshot)
+
+    def reload(self, environment=None, snapshot=False):
+        """
+        Reloads every instance in the set, see :meth:`Configuration.reload`.
+        """
+        self.listing.clear()
+        self._load(environment=environment, snapshot=snapshot, clear=True)
+
+    def _load(self, environment=None, snapshot=False, clear=False):
+        """
+        Implementation of :meth:`load` and :meth:`reload`, ``clear`` is
+        passed to :meth:`Configuration._publish`.
+        """
+        for config in self.values():
+            config._start_trace()
+
+        self.walk()
+
+        documents = {}
+        if snapshot:
+            for name in self.names:
+                config = self.configurations[name]
+                cached = config._read_snapshot(config.files())
+                if cached is not None:
+                    documents[name] = cached
+
+        # Only parse the files for instances without a snapshot
+        if len(documents) != len(self.names):
+            parsed = self._parse()
+            for name in self.names:
+                if name not in documents:
+                    documents[name] = parsed[name]
+                    if snapshot:
+                        config = self.configurations[name]
+                        config._write_snapshot(config.files(), parsed[name])
+
+        for name in self.names:
+            self.configurations[name]._publish(
+                documents[name], environment=environment, clear=clear)
+
+    def __getitem__(self, name):
+        return self.configurations[name]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+class SharedConfiguration(Mapping):
+    """
+    Read only, fully expanded copy of a :class:`Configuration` stored in
+    a memory map which can be shared between processes.  Each value is
+    stored separately along with a sorted index of the keys so a lookup
+    only decodes the requested value rather than the whole configuration.
+    The memory map itself is shared between processes, not copied, so the
+    memory used by each worker stays flat as the number of workers grows.
+
+    Keys and values are read through a :class:`memoryview` of the memory
+    map so nothing is copied out of it before it's decoded.  Each value
+    is decoded at most once per instance, later lookups return the same
+    object, so values must be treated as read only too.
+
+    Use :meth:`create` in the parent process before forking, the
+    workers inherit the memory map and can use the instance directly.
+    Processes which are not forked from the parent can :meth:`attach`
+    to the file written by :meth:`create` instead.
+
+    .. note::
+
+        Only string keys are supported and every value must
+        be picklable.
+
+    :param buffer:
+        The memory map, or any other buffer, containing the data
+        produced by :meth:`serialize`
+    """
+    MAGIC = b"PFSC"
+    FORMAT = 1
+    HEADER = struct.Struct("<4sII")
+    ENTRY = struct.Struct("<IIII")
+
+    def __init__(self, buffer):
+        magic, version, self.count = self.HEADER.unpack_from(buffer, 0)
+        if magic != self.MAGIC or version != self.FORMAT:
+            raise ValueError("Buffer does not contain a shared configuration")
+        self.buffer = buffer
+
+        # Python 2's mmap does not support memoryview and Python 2.6 has
+        # no memoryview at all, slicing the buffer copies the data but
+        # still works.
+        try:
+            self.view = memoryview(buffer)
+        except (NameError, TypeError):  # pragma: no cover
+            self.view = buffer
+
+        self._keys = [None] * self.count
+        self._values = {}
+
+    @classmethod
+    def serialize(cls, config):
+        """
+        Returns the expanded data in ``config`` as a string of bytes.
+        ``config`` may also be any other mapping, in which case the
+        values are stored as they are.
+        """
+        expand = isinstance(config, (Configuration, ConfigurationOverlay))
+        entries = []
+        for key in config:
+            if not isinstance(key, STRING_TYPES):
+                raise TypeError("Only string keys can be shared: %r" % key)
+
+            value = config[key]
+            if expand:
+                value = _expand_all(config, value)
+
+            entries.append((
+                key.encode("utf-8"),
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+
+        entries.sort()
+        offset = cls.HEADER.size + cls.ENTRY.size * len(entries)
+        index = [cls.HEADER.pack(cls.MAGIC, cls.FORMAT, len(entries))]
+        data = []
+
+        for key, value in entries:
+            index.append(cls.ENTRY.pack(
+                offset, len(key), offset + len(key), len(value)))
+            data.extend((key, value))
+            offset += len(key) + len(value)
+
+        return b"".join(index + data)
+
+    @classmethod
+    def create(cls, config, path=None):
+        """
+        Serializes ``config`` into a memory map and returns a new
+        instance.  If ``path`` is not provided an anonymous memory map
+        is used which is shared with child processes created by
+        :func:`os.fork`.  Otherwise the data is written to ``path`` so
+        unrelated processes can use :meth:`attach`.
+        """
+        data = cls.serialize(config)
+
+        if path is None:
+            buffer = mmap.mmap(-1, len(data))
+            buffer.write(data)
+            buffer.seek(0)
+            return cls(buffer)
+
+        from tempfile import mkstemp
+        fd, temporary_path = mkstemp(dir=dirname(abspath(path)))
+        with os.fdopen(fd, "wb") as stream:
+            stream.write(data)
+
+        try:
+            os.rename(temporary_path, path)
+        except OSError:  # pragma: no cover
+            # Windows won't rename over an existing file
+            os.remove(path)
+            os.rename(temporary_path, path)
+
+        return cls.attach(path)
+
+    @classmethod
+    def attach(cls, path):
+        """
+        Maps the file at ``path``, written by :meth:`create`, into
+        memory and returns a new instance.
+        """
+        with open(path, "rb") as stream:
+            buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def _key(self, index):
+        """
+        Returns the encoded key at ``index``.  Each key is only copied out
+        of the buffer once so repeated searches don't allocate anything.
+        """
+        key = self._keys[index]
+        if key is None:
+            key_offset, key_length, _, _ = self.ENTRY.unpack_from(
+                self.view, self.HEADER.size + self.ENTRY.size * index)
+            key = self._keys[index] = bytes(
+                self.view[key_offset:key_offset + key_length])
+        return key
+
+    def __getitem__(self, key):
+        if not isinstance(key, STRING_TYPES):
+            raise KeyError(key)
+
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+
+        encoded = key.encode("utf-8")
+        low, high = 0, self.count
+
+        # Binary search the sorted index
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self.count and self._key(low) == encoded:
+            _, _, offset, length = self.ENTRY.unpack_from(
+                self.view, self.HEADER.size + self.ENTRY.size * low)
+            value = self._values[key] = pickle.loads(
+                self.view[offset:offset + length])
+            return value
+
+        raise KeyError(key)
+
+    def __iter__(self):
+        for index in range_(self.count):
+            yield self._key(index).decode("utf-8")
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """Closes the underlying memory map"""
+        # The memory map can't be closed while the view exists.  Python
+        # 2.7's memoryview can't be released, or wrap a memory map.
+        if hasattr(self.view, "release"):
+            self.view.release()
+        self.buffer.close()
+
+
+class ConfigurationWatcher(Thread):
+    """
+    Base class for the threads started by :meth:`Configuration.watch`.
+    :meth:`wait` blocks until one of the watched files has changed or
+    :meth:`stop` is called.  By default the files are polled every
+    ``interval`` seconds, subclasses override :meth:`wait` to watch
+    them some other way.
+
+    :param Configuration config:
+        The configuration instance to reload
+
+    :param dict environment:
+        Passed along to :meth:`Configuration.reload`
+
+    :param callable callback:
+        If provided this will be called with ``config`` after each reload
+
+    :param int interval:
+        The number of seconds between checks made by the default
+        :meth:`wait`.
+    """
+    def __init__(self, config, environment=None, callback=None, interval=5):
+        super(ConfigurationWatcher, self).__init__(
+            name="%s(%s)" % (self.__class__.__name__, config.name))
+        self.daemon = True
+        self.config = config
+        self.environment = environment
+        self.callback = callback
+        self.interval = interval
+        self.signatures = None
+        self.stopped = Event()
+
+    def fragment_directories(self):
+        """
+        Returns the set of directories, existing or not, which
+        may contain fragments.
+        """
+        return set(
+            self.config.fragment_directory(directory)
+            for directory in self.config.directories(validate=False))
+
+    def paths(self):
+        """
+        Returns the set of configuration files, existing or not, which
+        this watcher is interested in along with any fragments which
+        currently exist.
+        """
+        paths = set(self.config.files(validate=False))
+        if self.config.package_configuration is not None:
+            paths.add(self.config.package_configuration)
+
+        # Read the fragment directories directly, rather than with
+        # Configuration.listdir(), so new fragments are found.
+        for directory in self.fragment_directories():
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+
+            paths.update(
+                join(directory, name) for name in names
+                if name.endswith(self.config.file_extension)
+                and not name.startswith("."))
+
+        return paths
+
+    def signature(self):
+        """
+        Returns the :meth:`Configuration._stat_signature` of each
+        existing path from :meth:`paths`.
+        """
+        signatures = {}
+        for path in self.paths():
+            try:
+                signatures[path] = self.config._stat_signature(path)
+            except OSError:
+                pass
+        return signatures
+
+    def wait(self):
+        """
+        Blocks until a change has been observed, returns ``True`` if
+        the configuration should be reloaded.  This waits ``interval``
+        seconds and then compares the :meth:`signature` of the files
+        against the previous call.
+        """
+        if self.signatures is None:
+            self.signatures = self.signature()
+
+        self.stopped.wait(self.interval)
+        signatures = self.signature()
+        changed = signatures != self.signatures
+        self.signatures = signatures
+        return changed
+
+    def reload(self):
+        """
+        Reloads the configuration after :meth:`wait` returns ``True``,
+        returns ``True`` if ``callback`` should be called.
+        """
+        self.config.reload(environment=self.environment)
+        return True
+
+    def stop(self):
+        """Stops the thread and waits for it to exit"""
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        while not self.stopped.is_set():
+            if not self.wait() or self.stopped.is_set():
+                continue
+
+            logger.debug("Reloading %s configuration", self.config.name)
+
+            try:
+                if self.reload() and self.callback is not None:
+                    self.callback(self.config)
+
+            except Exception as e:  # pragma: no cover
+                logger.error(
+                    "Failed to reload %s configuration: %s",
+                    self.config.name, e)
+
+
+class PollingWatcher(ConfigurationWatcher):
+    """
+    Watches the configuration files by comparing their
+    :meth:`Configuration._stat_signature` every ``interval`` seconds.  This
+    is used on platforms, or file systems, which do not support inotify.
+    Unlike :class:`ConfigurationWatcher` the files are checked when the
+    watcher is created so changes made before the thread starts are
+    noticed too.
+    """
+    def __init__(self, config, environment=None, callback=None, interval=5):
+        super(PollingWatcher, self).__init__(
+            config, environment=environment, callback=callback,
+            interval=interval)
+        self.signatures = self.signature()
+
+
+class InotifyWatcher(ConfigurationWatcher):
+    """
+    Watches the configuration directories using the Linux inotify API.  The
+    thread blocks in :func:`select.select` until the kernel reports an event
+    for one of the configuration files or :meth:`stop` is called.
+    """
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_CLOEXEC = 0o2000000
+
+    # IN_MODIFY and IN_CREATE are not included because they're emitted
+    # before the file has been completely written, IN_CLOSE_WRITE
+    # will follow once it has.
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+        IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    EVENT = struct.Struct("iIII")
+    _libc = NOTSET
+
+    def __init__(self, config, environment=None, callback=None):
+        super(InotifyWatcher, self).__init__(
+            config, environment=environment, callback=callback)
+        libc = self.libc()
+        self.watched = {}
+        self.fd = libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:  # pragma: no cover
+            from ctypes import get_errno
+            raise OSError(get_errno(), "inotify_init1() failed")
+
+        self.stop_read, self.stop_write = os.pipe()
+        self.files = self.paths()
+        self.fragment_paths = self.fragment_directories()
+
+        for directory in set(map(dirname, self.files)) | self.fragment_paths:
+            descriptor = libc.inotify_add_watch(
+                self.fd, directory.encode("utf-8"), self.MASK)
+            if descriptor >= 0:
+                self.watched[descriptor] = directory
+
+        logger.debug(
+            "Watching %s for changes",
+            _pformat(sorted(self.watched.values())))
+
+    @classmethod
+    def libc(cls):
+        """
+        Returns the C library with the inotify functions or ``None`` if
+        inotify is not supported.
+        """
+        if cls._libc is NOTSET:
+            cls._libc = None
+
+            if LINUX:
+                try:
+                    from ctypes import CDLL
+                    from ctypes.util import find_library
+                    libc = CDLL(
+                        find_library("c") or "libc.so.6", use_errno=True)
+                    libc.inotify_init1
+                    libc.inotify_add_watch
+                except (ImportError, OSError,
+                        AttributeError):  # pragma: no cover
+                    pass
+                else:
+                    cls._libc = libc
+
+        return cls._libc
+
+    @classmethod
+    def available(cls):
+        """Returns True if inotify can be used on this system"""
+        return cls.libc() is not None
+
+    def events(self, data):
+        """
+        Yields ``(path, mask)`` for each event in the data
+        read from the inotify file descriptor.
+        """
+        offset = 0
+        while offset + self.EVENT.size <= len(data):
+            descriptor, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            directory = self.watched.get(descriptor)
+
+            if directory is not None:
+                yield join(directory, name.decode("utf-8")), mask
+
+    def wait(self):
+        readable, _, _ = select.select([self.fd, self.stop_read], [], [])
+
+        if self.stop_read in readable:
+            return False
+
+        data = os.read(self.fd, 64 * 1024)
+        for path, mask in self.events(data):
+            if path in self.files or mask & (
+                    self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                return True
+
+            directory, name = dirname(path), basename(path)
+            if directory in self.fragment_paths \
+                    and name.endswith(self.config.file_extension) \
+                    and not name.startswith("."):
+                return True
+
+        return False
+
+    def stop(self):
+        if not self.stopped.is_set():
+            self.stopped.set()
+            os.write(self.stop_write, b"\0")
+        super(InotifyWatcher, self).stop()
+
+    def run(self):
+        try:
+            super(InotifyWatcher, self).run()
+        finally:
+            for fd in (self.fd, self.stop_read, self.stop_write):
+                os.close(fd)
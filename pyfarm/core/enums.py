@@ -228,11 +228,32 @@ def Enum(classname, **kwargs):
     return template(**kwargs) if instance else template
 
 
+def _unpickle_values(cls, values):
+    """Returns the interned :class:`Values` member for ``values``"""
+    return cls._make(values)
+
+
 class Values(namedtuple("Values", ("int", "str"))):
     """
     Stores values to be used in an enum.  Each time this
     class is instanced it will ensure that the input values
     are of the correct type and unique.
+
+    Instances are interned.  Copying or unpickling a member, and
+    constructing it again while ``check_uniqueness`` is disabled, returns
+    the existing member.  Constructing it again while ``check_uniqueness``
+    is enabled raises :class:`ValueError` like any other reused ``int``
+    does.  Two members are
+    compared by identity first and other values are compared by looking
+    them up in ``_values``, a :class:`frozenset` of ``int`` and ``str``,
+    which is built once per member.
+
+    A member hashes the same as its ``str`` so a member and its string
+    may be used interchangeably as a dictionary key.  Its integer can't
+    be used in place of a key since a hash can only match one of them.
+
+    Like :func:`collections.namedtuple`, ``_make`` and ``_replace`` do not
+    validate their input.  They still return interned members.
     """
     # Numerical types which are specific to the enums
     # only.
@@ -243,20 +264,36 @@ class Values(namedtuple("Values", ("int", "str"))):
 
     check_uniqueness = True
     _integers = set()
+    _interned = {}
 
-    def __init__(self, *args, **kwargs):
-        if not isinstance(self.int, self.NUMERIC_TYPES):
+    def __new__(cls, int, str):
+        if not isinstance(int, cls.NUMERIC_TYPES):
             raise TypeError("`int` must be an number")
 
-        if not isinstance(self.str, STRING_TYPES):
+        if not isinstance(str, STRING_TYPES):
             raise TypeError("`str` must be a string")
 
-        if self.check_uniqueness and self.int in self._integers:
-            raise ValueError("value %s is being reused" % self.int)
-        else:
-            self._integers.add(self.int)
+        if cls.check_uniqueness and int in cls._integers:
+            raise ValueError("value %s is being reused" % int)
 
-        self._values = set([self.int, self.str])
+        return cls._make((int, str))
+
+    @classmethod
+    def _make(cls, iterable, *args, **kwargs):
+        instance = super(Values, cls)._make(iterable, *args, **kwargs)
+        key = (cls, instance.int, instance.str)
+        try:
+            return cls._interned[key]
+        except KeyError:
+            instance._values = frozenset(instance)
+            cls._integers.add(instance.int)
+            cls._interned[key] = instance
+            return instance
+
+    def __reduce__(self):
+        # Without this protocols 0 and 1 would build a new instance and
+        # the others would fail the uniqueness check.
+        return _unpickle_values, (self.__class__, tuple(self))
 
     def __hash__(self):
         return self.str.__hash__()
@@ -282,7 +319,18 @@ class Values(namedtuple("Values", ("int", "str"))):
             return False
 
     def __eq__(self, other):
-        return self.__contains__(other)
+        if other is self:
+            return True
+        elif isinstance(other, Values):
+            return other.str == self.str and other.int == self.int
+
+        try:
+            return other in self._values
+        except TypeError:  # unhashable
+            return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
     def __gt__(self, other):
         if isinstance(other, self.NUMERIC_TYPES):
@@ -317,23 +365,58 @@ class Values(namedtuple("Values", ("int", "str"))):
             raise NotImplementedError("Cannot compare against %s" % type(other))
 
 
+# Maps id(enum) to a tuple of the base enum and a dictionary of the
+# results of cast_enum() for it, keyed by type.  Keeping a reference to
+# the base enum ensures its id can't be reused.
+_CAST_REGISTRY = {}
+
+
 def cast_enum(enum, enum_type):
     """
     Pulls the requested ``enum_type`` from ``enum`` and produce a new
     named tuple which contains only the requested data
 
     >>> from pyfarm.core.enums import Enum, Values
-    >>> FooBase = Enum("Foo", A=Values(int=1, str="1")
+    >>> FooBase = Enum("Foo", A=Values(int=1, str="1"))
     >>> Foo = cast_enum(FooBase, str)
     >>> assert Foo.A == "1"
     >>> Foo = cast_enum(FooBase, int)
     >>> assert Foo.A == 1
-    >>> assert Foo._map == {"A": 1, 1: "A"}
+    >>> assert Foo._map == {"1": 1, 1: "1"}
 
-    .. warning::
-        This function does not perform any kind of caching.  For the most
-        efficient usage it should only be called once per process or
-        module for a given enum and enum_type combination.
+    The result is cached for each ``enum`` and ``enum_type`` so calling
+    this function again, with the same enum object, returns the same
+    named tuple.  See :func:`registered_enums` for the enums which have
+    been cast so far.
+    """
+    try:
+        return _CAST_REGISTRY[id(enum)][1][enum_type]
+    except KeyError:
+        pass
+
+    if enum_type is not int and enum_type is not str:
+        raise TypeError("Valid values for `enum_type` are int or str")
+
+    # setdefault() so that threads casting the same enum at the
+    # same time all end up with the same result.
+    casts = _CAST_REGISTRY.setdefault(id(enum), (enum, {}))[1]
+    return casts.setdefault(enum_type, _cast_enum(enum, enum_type))
+
+
+def registered_enums():
+    """
+    Returns a list of ``(enum, casts)`` tuples, one for each enum passed
+    to :func:`cast_enum`, where ``casts`` maps ``str`` and/or ``int``
+    to the results of :func:`cast_enum`.
+    """
+    return [
+        (enum, casts.copy()) for enum, casts in _CAST_REGISTRY.values()]
+
+
+def _cast_enum(enum, enum_type):
+    """
+    Produces the named tuple returned by :func:`cast_enum`, this
+    does not cache the result.
     """
     enum_data = {}
     reverse_map = {}
@@ -357,14 +440,15 @@ def cast_enum(enum, enum_type):
         _map = reverse_map
         _enum = enum
 
+        # Every int, str and Values instance accepted by __contains__ so
+        # a miss costs the same single lookup as a hit.
+        _accepted = frozenset(reverse_map) | frozenset(enum)
+
         def __contains__(self, item):
-            if item in self._map:
-                return True
-            else:
-                for key, value in self._enum._asdict().items():
-                    if item in value:
-                        return True
-            return False
+            try:
+                return item in self._accepted
+            except TypeError:  # unhashable
+                return False
 
     return MappedEnum(**enum_data)
 
@@ -24,9 +24,9 @@ message formatting.
 
 import os
 import sys
-import json
 import logging
 import warnings
+from threading import RLock
 from logging import Formatter
 
 from pyfarm.core.enums import INTERACTIVE_INTERPRETER
@@ -37,10 +37,8 @@ PY_MAJOR, PY_MINOR = sys.version_info[0:2]
 PY26 = PY_MAJOR, PY_MINOR == (2, 6)
 if (PY_MAJOR, PY_MINOR) >= (2, 7):
     from logging import NullHandler, captureWarnings
-    from logging.config import dictConfig
 else:  # pragma: no cover
     from logutils import NullHandler
-    from logutils.dictconfig import dictConfig
     _warnings_showwarning = None
 
     def _showwarning(message, category, filename, lineno, file=None, line=None):
@@ -86,13 +84,6 @@ else:  # pragma: no cover
                 warnings.showwarning = _warnings_showwarning
                 _warnings_showwarning = None
 
-if not INTERACTIVE_INTERPRETER:
-    try:
-        colorama
-    except NameError:
-        from colorama import init, Fore, Back, Style
-        init()
-
 
 NO_STYLE = ("", "")
 
@@ -101,38 +92,56 @@ class ColorFormatter(Formatter):
     """
     Adds colorized formatting to log messages using :mod:`colorama` so long
     as we're not running an interactive interpreter or a debugger.
+    :mod:`colorama` is imported and initialized when the first instance
+    is created rather than when this module is imported.
     """
-    if not INTERACTIVE_INTERPRETER:
-        FORMATS = {
+    FORMATS = None
+
+    def __init__(self, *args, **kwargs):
+        if ColorFormatter.FORMATS is None:
+            ColorFormatter.FORMATS = self.formats()
+
+        # Python 2.6 uses old style classes so we can't use super() here
+        Formatter.__init__(self, *args, **kwargs)
+
+    @staticmethod
+    def formats():
+        """
+        Returns a dictionary of ``(head, tail)`` strings to wrap
+        messages with for each log level.
+        """
+        if INTERACTIVE_INTERPRETER:
+            warnings.warn_explicit(
+                "Interactive interpreter or debugger is active, "
+                "disabling colorized logging.", RuntimeWarning, "logger.py",
+                0, module="pyfarm.core.logger")
+            return {
+                logging.DEBUG: NO_STYLE,
+                logging.WARNING: NO_STYLE,
+                logging.ERROR: NO_STYLE,
+                logging.CRITICAL: NO_STYLE}
+
+        from colorama import init, Fore, Style
+        init()
+
+        return {
             logging.DEBUG: (Style.DIM, Style.RESET_ALL),
             logging.WARNING: (Fore.YELLOW, Fore.RESET),
             logging.ERROR: (Fore.RED, Fore.RESET),
             logging.CRITICAL: (
                 Fore.RED + Style.BRIGHT, Fore.RESET + Style.RESET_ALL)}
 
-        # Python 2.6 uses old style classes which means we can't use
-        # super().  So we construct the proper method at the class level
-        # so we can safe an if statement for each function call.
-        if not PY26:  # pragma: no cover
-            def format(self, record):
-                head, tail = self.FORMATS.get(record.levelno, NO_STYLE)
-                return head + super(ColorFormatter, self).format(record) + tail
-        else:  # pragma: no cover
-            def format(self, record):
-                head, tail = self.FORMATS.get(record.levelno, NO_STYLE)
-                return head + Formatter.format(self, record) + tail
-
-    else:
-        warnings.warn_explicit(
-            "Interactive interpreter or debugger is active, "
-            "disabling colorized logging.", RuntimeWarning, "logger.py",
-            0, module="pyfarm.core.logger")
-
-        FORMATS = {
-            logging.DEBUG: NO_STYLE,
-            logging.WARNING: NO_STYLE,
-            logging.ERROR: NO_STYLE,
-            logging.CRITICAL: NO_STYLE}
+    # Python 2.6 uses old style classes which means we can't use
+    # super().  So we construct the proper method at the class level
+    # so we can safe an if statement for each function call.
+    if not PY26:  # pragma: no cover
+        def format(self, record):
+            head, tail = self.FORMATS.get(record.levelno, NO_STYLE)
+            return head + super(ColorFormatter, self).format(record) + tail
+    else:  # pragma: no cover
+        def format(self, record):
+            head, tail = self.FORMATS.get(record.levelno, NO_STYLE)
+            return head + Formatter.format(self, record) + tail
 
 
 class StandardOutputStreamHandler(logging.StreamHandler):
@@ -150,6 +159,27 @@ class StandardOutputStreamHandler(logging.StreamHandler):
             super(StandardOutputStreamHandler, self).__init__(stream=stream)
 
 
+class DeferredSetupFilter(logging.Filter):
+    """
+    Added to the loggers returned by :func:`getLogger` until logging has
+    been configured.  The first record logged by any of them calls
+    :meth:`config.setup` so importing a module which creates a logger
+    doesn't have to pay the cost of configuring logging.  If the
+    application configured logging itself before then, which is the
+    case when the root logger has handlers, its configuration is kept
+    and :meth:`config.setup` is never called.
+    """
+    def filter(self, record):
+        if logging.getLogger().handlers:
+            config.skip_setup()
+        else:
+            config.setup()
+
+        # The record was created before the real log levels were
+        # known so check it against them now.
+        return logging.getLogger(record.name).isEnabledFor(record.levelno)
+
+
 class config(object):
     """
     Namespace class to store and setup the logging configuration.  You
@@ -157,6 +187,10 @@ class config(object):
     do so under other circumstances if you wish.
     """
     CONFIGURED = False
+    DEFERRED_FILTER = DeferredSetupFilter()
+    DEFERRED_LOGGERS = []
+    DEFERRED_LEVEL = None
+    SETUP_LOCK = RLock()
     DEFAULT_CONFIGURATION = {
         "version": 1,
         "root": {
@@ -192,6 +226,8 @@ class config(object):
         if "PYFARM_LOGGING_CONFIG" not in os.environ:
             return cls.DEFAULT_CONFIGURATION.copy()
 
+        import json
+
         environment_config = os.environ["PYFARM_LOGGING_CONFIG"].strip()
         if not environment_config:
             raise ValueError("$PYFARM_LOGGING_CONFIG is empty")
@@ -229,20 +265,101 @@ class config(object):
         if not reconfigure and cls.CONFIGURED:
             return
 
-        dictConfig(cls.get())
-        if capture_warnings:
-            captureWarnings(True)
+        try:
+            from logging.config import dictConfig
+        except ImportError:  # pragma: no cover
+            from logutils.dictconfig import dictConfig
+
+        with cls.SETUP_LOCK:
+            # Another thread may have finished setting up while we
+            # were waiting on the lock.
+            if not reconfigure and cls.CONFIGURED:
+                return
 
-        cls.CONFIGURED = True
+            # Restore the level of the 'pf' logger before configuring
+            # so the configuration can override it.
+            cls._restore_level()
+
+            dictConfig(cls.get())
+            if capture_warnings:
+                captureWarnings(True)
+
+            cls.CONFIGURED = True
+
+            # These loggers would not have existed yet, and so could not
+            # have been disabled by dictConfig(), if logging had been
+            # configured when they were created.
+            for logger in cls.DEFERRED_LOGGERS:
+                logger.disabled = False
+            cls._undefer()
+
+    @classmethod
+    def skip_setup(cls):
+        """
+        Marks logging as configured without calling :meth:`setup`.  This
+        is used when the application configured logging itself before
+        the first record was logged so its handlers and loggers are
+        left exactly as they are.
+        """
+        with cls.SETUP_LOCK:
+            if cls.CONFIGURED:
+                return
+
+            cls._restore_level()
+            cls.CONFIGURED = True
+            cls._undefer()
+
+    @classmethod
+    def _restore_level(cls):
+        """Restores the level of the ``pf`` logger lowered by :meth:`defer`"""
+        if cls.DEFERRED_LEVEL is not None:
+            parent = logging.getLogger("pf")
+
+            # Keep the level if something else has set it since
+            if parent.level == 1:
+                parent.setLevel(cls.DEFERRED_LEVEL)
+            cls.DEFERRED_LEVEL = None
+
+    @classmethod
+    def _undefer(cls):
+        """Removes :class:`DeferredSetupFilter` from the deferred loggers"""
+        for logger in cls.DEFERRED_LOGGERS:
+            logger.removeFilter(cls.DEFERRED_FILTER)
+        del cls.DEFERRED_LOGGERS[:]
+
+    @classmethod
+    def defer(cls, logger):
+        """
+        Defers :meth:`setup` until ``logger`` handles its first record.
+        Until then the level of the ``pf`` logger is lowered so every
+        record reaches :class:`DeferredSetupFilter` which will then
+        check the record against the configured levels.
+        """
+        with cls.SETUP_LOCK:
+            if cls.CONFIGURED:
+                return
+
+            if cls.DEFERRED_LEVEL is None:
+                parent = logging.getLogger("pf")
+                cls.DEFERRED_LEVEL = parent.level
+                parent.setLevel(1)
+
+            logger.addFilter(cls.DEFERRED_FILTER)
+            cls.DEFERRED_LOGGERS.append(logger)
 
 
 def getLogger(name):
     """
     Wrapper around the :func:`logging.getLogger` function which
-    ensures the name is setup properly.
+    ensures the name is setup properly.  Logging will be configured
+    by :meth:`config.setup` the first time the logger is used.
     """
-    config.setup()
     if not name.startswith("pf."):
         name = "pf.%s" % name
 
-    return logging.getLogger(name)
\ No newline at end of file
+    logger = logging.getLogger(name)
+
+    if not config.CONFIGURED:
+        config.defer(logger)
+
+    return logger
\ No newline at end of file
@@ -0,0 +1,289 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Remote Configuration
+====================
+
+Configuration layers which are retrieved over HTTP, typically from the
+master, rather than read from disk.  Each request is conditional so an
+unchanged document costs a single ``304 Not Modified`` response and is
+never parsed again.  The last document retrieved is also cached under
+:attr:`.Configuration.tempdir` so it can be used when the server can't
+be reached, including right after the process starts.
+
+.. code-block:: python
+
+    config = Configuration("agent", "1.2.3")
+    config.add_remote("http://master/api/v1/agents/config", interval=60)
+    config.load(environment=os.environ)
+    config.watch_remotes(environment=os.environ)
+"""
+
+import os
+import socket
+from random import uniform
+from time import time
+from timeit import default_timer
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError, URLError
+except ImportError:  # pragma: no cover
+    from urllib2 import Request, urlopen, HTTPError, URLError
+
+try:
+    import cPickle as pickle
+except ImportError:  # pragma: no cover
+    import pickle
+
+from pyfarm.core.enums import NOTSET
+from pyfarm.core.logger import getLogger
+from pyfarm.core.config import ConfigurationWatcher, _load_yaml, _yaml
+
+logger = getLogger("core.remote")
+
+
+class RemoteSource(object):
+    """
+    A configuration layer retrieved from ``url``.  Instances are normally
+    created by :meth:`.Configuration.add_remote` and the document is
+    applied after the configuration files so the server has the final
+    say.  The response body may be YAML or JSON.
+
+    :var string etag:
+        The ``ETag`` header of the last successful response.  This
+        is sent back in ``If-None-Match`` on the next request.
+
+    :var data:
+        The parsed document or :const:`.NOTSET` if nothing has been
+        retrieved from the server, or the cache, yet.
+
+    :var float next_refresh:
+        The time, from :func:`time.time`, after which :meth:`due` returns
+        True.
+
+    :var int CACHE_FORMAT:
+        The version of the data stored in the cache.  Cache files written
+        with a different format version are ignored.
+
+    :var string CACHE_EXTENSION:
+        The file extension of the cache files written to
+        :attr:`.Configuration.tempdir`.
+
+    :param string url:
+        The url to retrieve the document from
+
+    :param int interval:
+        The number of seconds between refreshes, see :meth:`delay`
+
+    :param float jitter:
+        The fraction of ``interval`` the delay between refreshes may
+        randomly vary by.  This keeps thousands of agents which
+        started together from refreshing at the same moment.
+
+    :param int timeout:
+        The number of seconds to wait for the server to respond
+
+    :param dict headers:
+        Additional headers to send with each request
+    """
+    CACHE_FORMAT = 1
+    CACHE_EXTENSION = ".remote"
+
+    def __init__(self, url, interval=300, jitter=0.1, timeout=10,
+                 headers=None):
+        self.url = url
+        self.interval = interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.headers = {} if headers is None else headers
+        self.etag = None
+        self.data = NOTSET
+        self.next_refresh = 0
+
+    def delay(self):
+        """
+        Returns ``interval`` randomly adjusted by up to ``jitter``
+        in either direction.
+        """
+        return self.interval * uniform(1 - self.jitter, 1 + self.jitter)
+
+    def due(self, now=None):
+        """Returns True if the document should be requested again"""
+        return (time() if now is None else now) >= self.next_refresh
+
+    def cache_path(self, config):
+        """
+        Returns the path under ``config.tempdir`` which the last document
+        retrieved from ``url`` is cached at.
+        """
+        from hashlib import sha1
+        digest = sha1(self.url.encode("utf-8")).hexdigest()
+        return os.path.join(
+            config.tempdir,
+            "%s-%s%s" % (config.name, digest[:16], self.CACHE_EXTENSION))
+
+    def read_cache(self, config):
+        """
+        Sets ``data`` and ``etag`` from the cache, returns True if the
+        cache existed and was for ``url``.
+        """
+        path = self.cache_path(config)
+
+        try:
+            # Never unpickle data which was written by another user.
+            if hasattr(os, "getuid") and os.stat(path).st_uid != os.getuid():
+                logger.warning(
+                    "Ignoring cache %r, it is not owned by the current "
+                    "user", path)
+                return False
+
+            with open(path, "rb") as stream:
+                cache = pickle.load(stream)
+
+        except (OSError, IOError):
+            return False
+
+        except Exception as e:  # pragma: no cover
+            logger.warning("Failed to read cache %r: %s", path, e)
+            return False
+
+        if not isinstance(cache, dict) \
+                or cache.get("format") != self.CACHE_FORMAT \
+                or cache.get("url") != self.url:
+            return False
+
+        self.etag = cache["etag"]
+        self.data = cache["data"]
+        logger.debug("Using cached %s from %r", self.url, path)
+        return True
+
+    def write_cache(self, config):
+        """
+        Writes ``data`` and ``etag`` to the cache.  The data is written to
+        a temporary file first and then renamed so other processes never
+        see a partially written cache.
+        """
+        from tempfile import mkstemp
+        path = self.cache_path(config)
+
+        try:
+            cache = {
+                "format": self.CACHE_FORMAT, "url": self.url,
+                "etag": self.etag, "data": self.data}
+            fd, temporary_path = mkstemp(
+                dir=config.tempdir, suffix=self.CACHE_EXTENSION)
+            with os.fdopen(fd, "wb") as stream:
+                pickle.dump(cache, stream, pickle.HIGHEST_PROTOCOL)
+
+            try:
+                os.rename(temporary_path, path)
+            except OSError:  # pragma: no cover
+                # Windows won't rename over an existing file
+                os.remove(path)
+                os.rename(temporary_path, path)
+
+        except (OSError, IOError, pickle.PicklingError) as e:
+            logger.warning("Failed to write cache %r: %s", path, e)
+
+    def fetch(self, config):
+        """
+        Requests the document from ``url``, returns True if ``data``
+        changed.  The previous ``data`` is kept if the server responds
+        with ``304 Not Modified``, can't be reached or returns something
+        other than a mapping.
+
+        :param Configuration config:
+            The configuration this source belongs to.  Used to locate
+            the cache and to record the request in ``config.trace``.
+        """
+        trace = None
+        if config.trace is not None:
+            trace = config.trace.file(self.url)
+
+        if self.data is NOTSET:
+            self.read_cache(config)
+
+        headers = dict(self.headers)
+        if self.etag is not None and self.data is not NOTSET:
+            headers["If-None-Match"] = self.etag
+
+        self.next_refresh = time() + self.delay()
+
+        try:
+            response = urlopen(
+                Request(self.url, headers=headers), timeout=self.timeout)
+            try:
+                body = response.read()
+                etag = response.info().get("ETag")
+            finally:
+                response.close()
+
+        except HTTPError as e:
+            if e.code == 304:
+                if trace is not None:
+                    trace.cached = True
+                return False
+
+            logger.warning(
+                "Failed to retrieve %s (HTTP %s), keeping the previous "
+                "configuration", self.url, e.code)
+            return False
+
+        except (URLError, socket.error, IOError) as e:
+            logger.warning(
+                "Failed to retrieve %s (%s), keeping the previous "
+                "configuration", self.url, e)
+            return False
+
+        start = default_timer()
+        try:
+            data = _load_yaml(body)
+        except _yaml().YAMLError as e:
+            logger.error("Failed to parse %s: %s", self.url, e)
+            return False
+
+        if trace is not None:
+            trace.bytes += len(body)
+            trace.parse_time = default_timer() - start
+
+        if data is not None and not isinstance(data, dict):
+            logger.error(
+                "Expected a mapping from %s, got %s", self.url,
+                type(data).__name__)
+            return False
+
+        changed = data != self.data
+        self.data = data
+        self.etag = etag
+        self.write_cache(config)
+        return changed
+
+
+class RemoteWatcher(ConfigurationWatcher):
+    """
+    Started by :meth:`.Configuration.watch_remotes`, this thread sleeps
+    until the earliest :attr:`RemoteSource.next_refresh` then calls
+    :meth:`.Configuration.refresh`.
+    """
+    def wait(self):
+        refresh = min(source.next_refresh for source in self.config.remotes)
+        self.stopped.wait(max(refresh - time(), 0))
+        return not self.stopped.is_set()
+
+    def reload(self):
+        return self.config.refresh(environment=self.environment)
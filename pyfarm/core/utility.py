@@ -33,7 +33,8 @@ try:
 except ImportError:  # pragma: no cover
     from collections import UserDict
 
-from pyfarm.core.config import read_env_bool
+from pyfarm.core.config import (
+    read_env_bool, ExpandingMapping, ExpandingSequence)
 from pyfarm.core.enums import (
     NUMERIC_TYPES, STRING_TYPES, PY2, PY3,
     BOOLEAN_TRUE, BOOLEAN_FALSE, NONE, Values)
@@ -89,7 +90,18 @@ class ImmutableDict(dict):
 
 
 class PyFarmJSONEncoder(json.JSONEncoder):
+    def default(self, o):
+        # The views returned by Configuration when EXPAND_CONTAINERS
+        # is set are not dictionaries or lists, encode a copy instead.
+        if isinstance(o, (ExpandingMapping, ExpandingSequence)):
+            return o.expanded()
+
+        return super(PyFarmJSONEncoder, self).default(o)
+
     def encode(self, o):
+        if isinstance(o, (ExpandingMapping, ExpandingSequence)):
+            o = o.expanded()
+
         # Introspect dictionary objects for our
         # enum value type so we can dump out the string
         # value explicitly.  Otherwise, json.dumps will
@@ -102,10 +114,25 @@ class PyFarmJSONEncoder(json.JSONEncoder):
 
         return super(PyFarmJSONEncoder, self).encode(o)
 
-dumps = partial(
-    json.dumps,
-    indent=4 if read_env_bool("PYFARM_PRETTY_JSON", False) else None,
-    cls=PyFarmJSONEncoder)
+_dumps = None
+
+
+def dumps(*args, **kwargs):
+    """
+    Wrapper around :func:`json.dumps` which uses :class:`PyFarmJSONEncoder`
+    and indents the output if :envvar:`PYFARM_PRETTY_JSON` is true.  The
+    environment is read on the first call, rather than on import, because
+    reading it is logged and logging is only configured once it's used.
+    """
+    global _dumps
+
+    if _dumps is None:
+        _dumps = partial(
+            json.dumps,
+            indent=4 if read_env_bool("PYFARM_PRETTY_JSON", False) else None,
+            cls=PyFarmJSONEncoder)
+
+    return _dumps(*args, **kwargs)
 
 
 class convert(object):
@@ -0,0 +1,140 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import tempfile
+import threading
+from os.path import join, dirname, normpath
+
+from pyfarm.core.config import Configuration
+from pyfarm.core.enums import PY26
+from pyfarm.core.testutil import TestCase
+
+if PY26:
+    from unittest2 import skipIf
+else:
+    from unittest import skipIf
+
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # pragma: no cover
+    asyncio = None
+
+
+@skipIf(sys.version_info[0:2] < (3, 7), "requires Python 3.7+")
+class TestAsyncConfiguration(TestCase):
+    def setUp(self):
+        super(TestAsyncConfiguration, self).setUp()
+        local_root = tempfile.mkdtemp()
+        self.add_cleanup_path(local_root)
+        self.config = Configuration("agent", "1.2.3")
+        self.config.system_root = local_root
+        self.config.tempdir = local_root
+        split = self.config.split_version()
+        self.paths = [
+            join(local_root, self.config.child_dir, "agent.yml"),
+            join(local_root, self.config.child_dir, split[2], "agent.yml"),
+            join(local_root, self.config.child_dir, split[0], "agent.yml")]
+
+        for i, path in enumerate(self.paths):
+            os.makedirs(dirname(path))
+            with open(path, "w") as stream:
+                stream.write("env: {a%d: %d}\nvalue%d: %d\nvalue: %d" % (
+                    i, i, i, i, i))
+
+    def test_load_matches_load(self):
+        expected = Configuration("agent", "1.2.3")
+        expected.system_root = self.config.system_root
+        expected_environment = {}
+        expected.load(environment=expected_environment)
+
+        environment = {}
+        with ThreadPoolExecutor(4) as executor:
+            result = asyncio.run(self.config.load_async(
+                environment=environment, executor=executor))
+
+        self.assertIs(result, self.config)
+        self.assertEqual(self.config, expected)
+        self.assertEqual(self.config.loaded, expected.loaded)
+        self.assertEqual(self.config.env, expected.env)
+        self.assertEqual(environment, expected_environment)
+
+    def test_load_off_the_loop(self):
+        fragment = join(dirname(self.paths[0]), "agent.d", "10-host.yml")
+        os.makedirs(dirname(fragment))
+        with open(fragment, "w") as stream:
+            stream.write("value: 10")
+
+        config = Configuration("agent", lazy=True)
+        config.system_root = self.config.system_root
+        config.version = "1.2.3"
+        listdir = config.listdir
+        blocked = []
+
+        # Records each directory which is actually read on the loop
+        def record_listdir(directory):
+            if normpath(directory) not in config.listing \
+                    and threading.current_thread() is main_thread:
+                blocked.append(directory)
+            return listdir(directory)
+
+        main_thread = threading.current_thread()
+        config.listdir = record_listdir
+        asyncio.run(config.load_async(environment={}))
+        self.assertEqual(blocked, [])
+        self.assertEqual(config["value"], 10)
+        self.assertIn(fragment, config.loaded)
+        self.assertIn("parse", config.trace.stages)
+
+    def test_load_snapshot(self):
+        asyncio.run(self.config.load_async(snapshot=True))
+        snapshot = self.config.snapshot_path(self.config.files())
+        self.assertTrue(os.path.isfile(snapshot))
+        config = Configuration("agent", "1.2.3")
+        config.system_root = self.config.system_root
+        config.tempdir = self.config.tempdir
+        asyncio.run(config.load_async(snapshot=True))
+        self.assertEqual(config, self.config)
+
+    def test_reload_publishes_atomically(self):
+        asyncio.run(self.config.load_async())
+        self.config["manual"] = True
+
+        with open(self.paths[0], "w") as stream:
+            stream.write("value: 42")
+
+        observed = []
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        # Runs on the loop while the reload waits on the executor.  This
+        # is a callback, rather than a coroutine, because this module
+        # must also be importable by versions without async syntax.
+        def observe():
+            observed.append(self.config.get("value"))
+            if observed[-1] != 42:
+                loop.call_soon(observe)
+
+        loop.call_soon(observe)
+        loop.run_until_complete(self.config.reload_async())
+
+        # Only the old and new value are ever visible
+        self.assertEqual(observed[0], 0)
+        self.assertTrue(set(observed) <= set([0, 42]))
+        self.assertNotIn("manual", self.config)
+        self.assertEqual(self.config["value1"], 1)
@@ -17,15 +17,24 @@
 from __future__ import with_statement
 
 import os
+import sys
+import json
+import marshal
+import logging
 import tempfile
+import threading
 import uuid
 from textwrap import dedent
 from os.path import join, dirname, expandvars, expanduser
 
-from pkg_resources import get_distribution
+try:
+    from importlib.metadata import distribution as get_distribution
+except ImportError:  # pragma: no cover
+    from pkg_resources import get_distribution
 
 from pyfarm.core.enums import PY26, LINUX, MAC, WINDOWS
 from pyfarm.core.testutil import TestCase as BaseTestCase, requires_ci
+from pyfarm.core.utility import ImmutableDict, dumps
 
 if PY26:
     from unittest2 import TestCase, skipIf
@@ -34,7 +43,12 @@ else:
 
 from pyfarm.core.config import (
     read_env, read_env_number, read_env_bool, read_env_strict_number,
-    BOOLEAN_FALSE, BOOLEAN_TRUE, Configuration)
+    BOOLEAN_FALSE, BOOLEAN_TRUE, Configuration, InotifyWatcher, merge,
+    MERGE_DEEP, MERGE_APPEND, MERGE_REPLACE, EnvSnapshot, record_env_reads,
+    stop_recording_env_reads, SharedConfiguration, compile_file,
+    compile_main, ChangeSet, diff, ConfigurationSet, ExpandingMapping,
+    ExpandingSequence, ConfigurationWatcher)
+from pyfarm.core import config as config_module
 
 
 class TestConfigEnvironment(TestCase):
@@ -127,6 +141,163 @@ class TestConfigEnvironment(TestCase):
             read_env_strict_number(key, number_type=float)
 
 
+class TestEnvReadRecorder(TestCase):
+    def tearDown(self):
+        stop_recording_env_reads()
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(stop_recording_env_reads())
+        self.assertIs(config_module.read_env, config_module._read_env)
+
+    def test_record(self):
+        key = "a" + uuid.uuid4().hex
+        missing = "b" + uuid.uuid4().hex
+        os.environ[key] = "42"
+        self.addCleanup(os.environ.pop, key)
+        recorder = record_env_reads(report_at_exit=False)
+        self.assertIs(record_env_reads(), recorder)
+
+        self.assertEqual(config_module.read_env_int(key), 42)
+        self.assertTrue(config_module.read_env_bool(missing, True))
+        self.assertTrue(config_module.read_env_bool(missing, True))
+        with self.assertRaises(EnvironmentError):
+            config_module.read_env(missing)
+
+        self.assertEqual(recorder.variables[key]["reads"], 1)
+        self.assertEqual(recorder.variables[key]["defaults"], 0)
+        self.assertEqual(recorder.variables[missing]["reads"], 3)
+        self.assertEqual(recorder.variables[missing]["defaults"], 3)
+        self.assertEqual(
+            recorder.variables[missing]["modules"], {__name__: 3})
+        self.assertGreaterEqual(recorder.variables[key]["time"], 0)
+
+        report = recorder.report().splitlines()
+        self.assertEqual(len(report), 2)
+        self.assertTrue(report[0].startswith("$%s: 3 read(s)" % missing))
+
+        self.assertIs(stop_recording_env_reads(), recorder)
+        self.assertIs(config_module.read_env, config_module._read_env)
+        config_module.read_env(missing, None)
+        self.assertEqual(recorder.variables[missing]["reads"], 3)
+
+
+class TestEnvSnapshot(TestCase):
+    def setUp(self):
+        self.environment = os.environ.copy()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environment)
+
+    def test_types(self):
+        os.environ.update(
+            PYFARM_TEST_STR="foo", PYFARM_TEST_BOOL="yes",
+            PYFARM_TEST_INT="42", PYFARM_TEST_FLOAT="3.5",
+            PYFARM_TEST_LIST="[1, 2]")
+        env = EnvSnapshot()
+        env.declare("PYFARM_TEST_STR")
+        env.declare("PYFARM_TEST_BOOL", bool)
+        env.declare("PYFARM_TEST_INT", int)
+        env.declare("PYFARM_TEST_FLOAT", float)
+        env.declare("PYFARM_TEST_LIST", list)
+        env.declare("PYFARM_TEST_DEFAULT", int, default=1)
+        env.refresh()
+        self.assertEqual(env["PYFARM_TEST_STR"], "foo")
+        self.assertIs(env["PYFARM_TEST_BOOL"], True)
+        self.assertEqual(env["PYFARM_TEST_INT"], 42)
+        self.assertEqual(env["PYFARM_TEST_FLOAT"], 3.5)
+        self.assertEqual(env["PYFARM_TEST_LIST"], [1, 2])
+        self.assertEqual(env["PYFARM_TEST_DEFAULT"], 1)
+        self.assertIsNone(env.get("PYFARM_TEST_UNDECLARED"))
+
+    def test_values_served_until_refresh(self):
+        os.environ["PYFARM_TEST_INT"] = "1"
+        env = EnvSnapshot()
+        env.declare("PYFARM_TEST_INT", int)
+        env.refresh()
+        os.environ["PYFARM_TEST_INT"] = "2"
+        self.assertEqual(env["PYFARM_TEST_INT"], 1)
+        env.refresh()
+        self.assertEqual(env["PYFARM_TEST_INT"], 2)
+
+    def test_missing(self):
+        os.environ.pop("PYFARM_TEST_MISSING", None)
+        env = EnvSnapshot()
+        env.declare("PYFARM_TEST_MISSING", int)
+        with self.assertRaises(EnvironmentError):
+            env.refresh()
+
+    def test_parse_errors(self):
+        env = EnvSnapshot()
+        env.declare("PYFARM_TEST_VALUE", int)
+
+        for value in ("foo", "3.5"):
+            os.environ["PYFARM_TEST_VALUE"] = value
+            with self.assertRaises(TypeError):
+                env.refresh()
+
+        env.declare("PYFARM_TEST_VALUE", bool)
+        with self.assertRaises(TypeError):
+            env.refresh()
+
+
+class TestMerge(TestCase):
+    def test_replace(self):
+        base = {"a": {"b": 1}, "c": 1}
+        self.assertEqual(
+            merge(base, {"a": {"d": 1}}), {"a": {"d": 1}, "c": 1})
+        self.assertEqual(base, {"a": {"b": 1}, "c": 1})
+
+    def test_deep(self):
+        base = {"a": {"b": {"c": 1, "d": 1}}, "e": {"f": 1}}
+        merged = merge(base, {"a": {"b": {"c": 2}}}, {"a": MERGE_DEEP})
+        self.assertEqual(
+            merged, {"a": {"b": {"c": 2, "d": 1}}, "e": {"f": 1}})
+        self.assertIs(merged["e"], base["e"])
+        self.assertEqual(base["a"]["b"]["c"], 1)
+
+    def test_nested_policies(self):
+        base = {"a": {"b": [1], "c": {"d": 1}}}
+        merged = merge(
+            base, {"a": {"b": [2], "c": {"e": 1}}},
+            {"a": MERGE_DEEP, "a.b": MERGE_APPEND, "a.c": MERGE_REPLACE})
+        self.assertEqual(merged, {"a": {"b": [1, 2], "c": {"e": 1}}})
+        self.assertEqual(base["a"]["b"], [1])
+
+    def test_mismatched_types_replace(self):
+        self.assertEqual(
+            merge({"a": [1]}, {"a": {"b": 1}}, default=MERGE_APPEND),
+            {"a": {"b": 1}})
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            merge({"a": 1}, {"a": 2}, {"a": "foo"})
+
+
+class TestChangeSet(TestCase):
+    def test_diff(self):
+        shared = {"a": 1}
+        changes = diff(
+            {"a": shared, "b": 1, "c": 1, "d": [1]},
+            {"a": shared, "b": 2, "d": [1], "e": 1})
+        self.assertEqual(changes.added, frozenset(["e"]))
+        self.assertEqual(changes.removed, frozenset(["c"]))
+        self.assertEqual(changes.changed, frozenset(["b"]))
+        self.assertEqual(changes.keys, frozenset(["b", "c", "e"]))
+
+    def test_bool(self):
+        self.assertFalse(diff({"a": 1}, {"a": 1}))
+        self.assertTrue(diff({"a": 1}, {"a": 2}))
+
+    def test_affects(self):
+        changes = ChangeSet(
+            frozenset(["env.HOME"]), frozenset(), frozenset(["a"]))
+        self.assertTrue(changes.affects(["a"]))
+        self.assertTrue(changes.affects(["env"]))
+        self.assertTrue(changes.affects(["env.HOME"]))
+        self.assertFalse(changes.affects(["b", "en"]))
+
+
 class TestConfiguration(BaseTestCase):
     def test_parent_class(self):
         self.assertIn(dict, Configuration.__bases__)
@@ -259,6 +430,38 @@ class TestConfiguration(BaseTestCase):
         config = Configuration("agent", "1.2.3")
         self.assertEqual(config.files(), [])
 
+    def test_files_listing_cached(self):
+        local_root = tempfile.mkdtemp()
+        self.add_cleanup_path(local_root)
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        root = join(local_root, config.child_dir)
+        self.assertEqual(config.files(), [])
+        self.assertIsNone(config.listing[root])
+
+        # The negative result is cached for the life of the instance
+        os.makedirs(join(root, "1"))
+        with open(join(root, "1", "agent.yml"), "w"):
+            pass
+        self.assertEqual(config.files(), [])
+
+        listing = {}
+        config = Configuration("agent", "1.2.3", listing=listing)
+        config.system_root = local_root
+        expected = [join(root, "1", "agent.yml")]
+        self.assertEqual(config.files(), expected)
+        self.assertEqual(
+            listing[root], (frozenset(["1"]), frozenset()))
+        self.assertEqual(
+            listing[join(root, "1")], (frozenset(), frozenset(["agent.yml"])))
+
+        # A second instance sharing the listing won't touch the file system
+        before = dict(listing)
+        config = Configuration("agent", "1.2.3", listing=listing)
+        config.system_root = local_root
+        self.assertEqual(config.files(), expected)
+        self.assertEqual(listing, before)
+
     def test_load_basic(self):
         local_root = tempfile.mkdtemp()
         config = Configuration("agent", "1.2.3")
@@ -338,10 +541,598 @@ class TestConfiguration(BaseTestCase):
         config.load(environment=environment)
         self.assertEqual(environment, {"key0": 0, "key1": 1, "key": 1})
 
+    def test_load_snapshot(self):
+        local_root = tempfile.mkdtemp()
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        config.tempdir = local_root
+        self.add_cleanup_path(local_root)
+        path = join(config.system_root, config.child_dir, "agent.yml")
+        os.makedirs(dirname(path))
+
+        with open(path, "w") as stream:
+            stream.write("value: 1")
+
+        config.load(snapshot=True)
+        self.assertEqual(config["value"], 1)
+        snapshot = config.snapshot_path(config.files())
+        self.assertTrue(os.path.isfile(snapshot))
+
+        # Same size, inode and mtime so the snapshot should be reused
+        stat = os.stat(path)
+        with open(path, "r+") as stream:
+            stream.write("value: 2")
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+        if hasattr(stat, "st_mtime_ns"):
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        config.tempdir = local_root
+        config.load(snapshot=True)
+        self.assertEqual(config["value"], 1)
+
+        # Changing the size of the file invalidates the snapshot
+        with open(path, "w") as stream:
+            stream.write("value: 42")
+
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        config.tempdir = local_root
+        config.load(snapshot=True)
+        self.assertEqual(config["value"], 42)
+
+    def _traced_configuration(self):
+        local_root = tempfile.mkdtemp()
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        config.tempdir = local_root
+        self.add_cleanup_path(local_root)
+        split = config.split_version()
+        paths = [
+            join(config.system_root, config.child_dir, split[0], "agent.yml"),
+            join(config.system_root, config.child_dir, "agent.yml")]
+
+        os.makedirs(dirname(paths[0]))
+        for i, path in enumerate(paths):
+            with open(path, "w") as stream:
+                stream.write("value%d: %d\nvalue: $value%d" % (i, i, i))
+
+        return config, paths
+
+    def test_trace(self):
+        config, paths = self._traced_configuration()
+        self.assertIsNone(config.trace)
+        config.frozen = {}
+        config.load(environment={})
+        trace = config.trace
+        self.assertIsNotNone(trace.duration)
+        self.assertGreater(trace.listings, 0)
+        self.assertEqual(trace.paths, paths)
+        for stage in ("discovery", "parse", "merge", "expansion"):
+            self.assertIn(stage, trace.stages)
+        self.assertNotIn("snapshot", trace.stages)
+
+        for path in paths:
+            file_trace = trace.files[path]
+            self.assertEqual(file_trace.stats, 1)
+            self.assertEqual(file_trace.bytes, os.path.getsize(path))
+            self.assertFalse(file_trace.cached)
+
+        # Unchanged files are not read again
+        config.reload(environment={})
+        self.assertIsNot(config.trace, trace)
+        for path in paths:
+            self.assertTrue(config.trace.files[path].cached)
+            self.assertEqual(config.trace.files[path].bytes, 0)
+
+        self.assertEqual(
+            [entry["path"] for entry in config.trace.as_dict()["files"]],
+            paths)
+        self.assertIn(paths[0], str(config.trace))
+
+    def test_trace_logged(self):
+        config, paths = self._traced_configuration()
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger("pf.core.config")
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.INFO)
+
+        config.log_trace = True
+        config.load(environment={})
+        traced = [
+            record for record in records
+            if hasattr(record, "configuration_trace")]
+        self.assertEqual(len(traced), 1)
+        self.assertEqual(
+            traced[0].configuration_trace, config.trace.as_dict())
+
+    def test_trace_setting_not_logged(self):
+        config, paths = self._traced_configuration()
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger("pf.core.config")
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.INFO)
+
+        config.load(environment={})
+        self.assertFalse(config.log_trace)
+        self.assertEqual(
+            [record for record in records
+             if "PYFARM_CONFIG_TRACE" in record.getMessage()], [])
+
+    def test_load_snapshot_does_not_modify_documents(self):
+        local_root = tempfile.mkdtemp()
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        config.tempdir = local_root
+        self.add_cleanup_path(local_root)
+        path = join(config.system_root, config.child_dir, "agent.yml")
+        os.makedirs(dirname(path))
+
+        with open(path, "w") as stream:
+            stream.write("env:\n    a: 1\nvalue: 1")
+
+        for _ in range(2):
+            environment = {}
+            config = Configuration("agent", "1.2.3")
+            config.system_root = local_root
+            config.tempdir = local_root
+            config.load(environment=environment, snapshot=True)
+            self.assertEqual(environment, {"a": 1})
+            self.assertNotIn("env", config)
+
+    def test_compile_file(self):
+        local_root = tempfile.mkdtemp()
+        self.add_cleanup_path(local_root)
+        path = join(local_root, "agent.yml")
+
+        with open(path, "w") as stream:
+            stream.write("a: [1, 2]\nb: {c: true}")
+
+        compiled = compile_file(path)
+        self.assertEqual(compiled, path + Configuration.COMPILED_EXTENSION)
+        config = Configuration("agent", "1.2.3")
+        self.assertEqual(
+            config._parse_file(path), {"a": [1, 2], "b": {"c": True}})
+
+        # The compiled file is used while the source is unchanged
+        with open(compiled, "rb") as stream:
+            data = stream.read()
+        offset = len(config_module.COMPILED_MAGIC)
+        with open(compiled, "wb") as stream:
+            stream.write(data[:offset + config_module.COMPILED_SOURCE.size])
+            stream.write(marshal.dumps({"a": 3}))
+        config = Configuration("agent", "1.2.3")
+        self.assertEqual(config._parse_file(path), {"a": 3})
+
+        # An edit which keeps the modification time, as happens on file
+        # systems with a coarse resolution or with `cp -p`, is noticed.
+        stat = os.stat(path)
+        with open(path, "w") as stream:
+            stream.write("a: 2")
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+        config = Configuration("agent", "1.2.3")
+        self.assertEqual(config._parse_file(path), {"a": 2})
+
+        # So is a source with an older modification time
+        compile_file(path)
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime - 10))
+        with open(compiled, "rb") as stream:
+            data = stream.read()
+        with open(compiled, "wb") as stream:
+            stream.write(data[:offset + config_module.COMPILED_SOURCE.size])
+            stream.write(marshal.dumps({"a": 3}))
+        config = Configuration("agent", "1.2.3")
+        self.assertEqual(config._parse_file(path), {"a": 2})
+
+    def test_compile_file_invalid_sidecar(self):
+        local_root = tempfile.mkdtemp()
+        self.add_cleanup_path(local_root)
+        path = join(local_root, "agent.yml")
+
+        with open(path, "w") as stream:
+            stream.write("a: 1")
+
+        with open(path + Configuration.COMPILED_EXTENSION, "wb") as stream:
+            stream.write(b"not compiled")
+
+        config = Configuration("agent", "1.2.3")
+        self.assertEqual(config._parse_file(path), {"a": 1})
+
+    def test_compile(self):
+        local_root = tempfile.mkdtemp()
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        self.add_cleanup_path(local_root)
+        path = join(config.system_root, config.child_dir, "agent.yml")
+        os.makedirs(dirname(path))
+
+        with open(path, "w") as stream:
+            stream.write("value: 1")
+
+        self.assertIn(path + Configuration.COMPILED_EXTENSION, config.compile())
+        self.assertEqual(compile_main([]), 1)
+        self.assertEqual(compile_main([path]), 0)
+        self.assertEqual(compile_main([join(local_root, "missing.yml")]), 1)
+
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        config.load()
+        self.assertEqual(config["value"], 1)
+
+    def test_subscribe(self):
+        local_root = tempfile.mkdtemp()
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        self.add_cleanup_path(local_root)
+        path = join(config.system_root, config.child_dir, "agent.yml")
+        os.makedirs(dirname(path))
+
+        with open(path, "w") as stream:
+            stream.write("env: {A: 1}\na: 1\nb: $a\nc: 1")
+
+        config.load(environment={})
+        self.assertEqual(config.env, {"A": 1})
+        every, a, env, other = [], [], [], []
+        config.subscribe(lambda config, changes: every.append(changes))
+        config.subscribe(lambda config, changes: a.append(changes), "a")
+        config.subscribe(lambda config, changes: env.append(changes), ["env"])
+        callback = config.subscribe(
+            lambda config, changes: other.append(changes), ["c"])
+
+        def fail(config, changes):
+            raise RuntimeError("subscriber failed")
+
+        config.subscribe(fail)
+
+        # Nothing changed so nothing is sent
+        config.reload(environment={})
+        self.assertEqual(every, [])
+
+        with open(path, "w") as stream:
+            stream.write("env: {A: 2, B: 1}\na: 2\nb: $a\nc: 1\nd: 1")
+
+        config.unsubscribe(callback)
+        config.reload(environment={})
+        self.assertEqual(len(every), 1)
+        self.assertEqual(every[0].added, frozenset(["d", "env.B"]))
+        self.assertEqual(every[0].changed, frozenset(["a", "b", "env.A"]))
+        self.assertEqual(every[0].removed, frozenset())
+        self.assertEqual(a, every)
+        self.assertEqual(env, every)
+        self.assertEqual(other, [])
+
+        # Only the 'env' subscriber is interested in environment changes
+        with open(path, "w") as stream:
+            stream.write("env: {A: 3}\na: 2\nb: $a\nc: 1\nd: 1")
+
+        config.reload(environment={})
+        self.assertEqual(len(every), 2)
+        self.assertEqual(len(a), 1)
+        self.assertEqual(len(env), 2)
+        self.assertEqual(env[-1].removed, frozenset(["env.B"]))
+
+    @skipIf(not hasattr(sys, "setswitchinterval"),
+            "sys.setswitchinterval() is not available")
+    def test_subscribe_concurrent_loads(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(a=1)
+        keys = set(config)
+
+        def replay(config, changes):
+            keys.update(changes.added)
+            keys.difference_update(changes.removed)
+
+        config.subscribe(replay)
+
+        def load(key):
+            for _ in range(200):
+                config._publish([("memory", {key: 1})], clear=True)
+
+        # Replaying the change sets only ends up with the current keys
+        # if no two loads captured the same state.
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [
+                threading.Thread(target=load, args=(key, ))
+                for key in ("a", "b", "c")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+
+        self.assertEqual(keys, set(config))
+
+    def test_reload_discards_nested_changes(self):
+        local_root = tempfile.mkdtemp()
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        self.add_cleanup_path(local_root)
+        path = join(config.system_root, config.child_dir, "agent.yml")
+        os.makedirs(dirname(path))
+
+        with open(path, "w") as stream:
+            stream.write("items: [1, 2]\nnested: {a: 1}")
+
+        config.load()
+        config["items"].append(99)
+        config["nested"]["b"] = 2
+
+        # The file is not parsed again but the changes are still gone
+        config.reload()
+        self.assertEqual(config["items"], [1, 2])
+        self.assertEqual(config["nested"], {"a": 1})
+        self.assertTrue(config.trace.files[path].cached)
+
+    def test_reload_parses_changed_files(self):
+        local_root = tempfile.mkdtemp()
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        self.add_cleanup_path(local_root)
+        split = config.split_version()
+        paths = [
+            join(config.system_root, config.child_dir, "agent.yml"),
+            join(config.system_root, config.child_dir, split[2], "agent.yml")]
+
+        for i, path in enumerate(paths):
+            try:
+                os.makedirs(dirname(path))
+            except OSError:
+                pass
+
+            with open(path, "w") as stream:
+                stream.write("value%d: %d" % (i, i))
+
+        config.load()
+        config["manual"] = True
+        self.assertEqual(config, {"value0": 0, "value1": 1, "manual": True})
+        parsed = config._parsed[paths[0]]
+
+        with open(paths[1], "w") as stream:
+            stream.write("value1: 42")
+
+        config.reload()
+        self.assertEqual(config, {"value0": 0, "value1": 42})
+        self.assertIs(config._parsed[paths[0]], parsed)
+
+    def _test_watch(self, fragment=False, **kwargs):
+        local_root = tempfile.mkdtemp()
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        self.add_cleanup_path(local_root)
+        path = join(config.system_root, config.child_dir, "agent.yml")
+        os.makedirs(join(dirname(path), "agent.d"))
+
+        with open(path, "w") as stream:
+            stream.write("value: 1")
+
+        # Write a new fragment instead of modifying the file
+        if fragment:
+            path = join(dirname(path), "agent.d", "10-host.yml")
+
+        config.load()
+        reloaded = threading.Event()
+
+        def callback(instance):
+            if instance.get("value") == 12:
+                reloaded.set()
+
+        watcher = config.watch(callback=callback, **kwargs)
+        self.addCleanup(watcher.stop)
+
+        with open(path, "w") as stream:
+            stream.write("value: 12")
+
+        self.assertTrue(reloaded.wait(5))
+        self.assertEqual(config["value"], 12)
+        return watcher
+
+    @skipIf(not InotifyWatcher.available(), "inotify not available")
+    def test_watch_inotify(self):
+        watcher = self._test_watch()
+        self.assertIsInstance(watcher, InotifyWatcher)
+        watcher.stop()
+        self.assertFalse(watcher.is_alive())
+
+    def test_watch_polling(self):
+        watcher = self._test_watch(poll=True, interval=.05)
+        watcher.stop()
+        self.assertFalse(watcher.is_alive())
+
+    @skipIf(not InotifyWatcher.available(), "inotify not available")
+    def test_watch_inotify_fragment(self):
+        self._test_watch(fragment=True).stop()
+
+    def test_watch_polling_fragment(self):
+        self._test_watch(fragment=True, poll=True, interval=.05).stop()
+
+    def test_watcher_default_wait(self):
+        local_root = tempfile.mkdtemp()
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        self.add_cleanup_path(local_root)
+        path = join(config.system_root, config.child_dir, "agent.yml")
+        os.makedirs(dirname(path))
+
+        with open(path, "w") as stream:
+            stream.write("value: 1")
+
+        config.load()
+        watcher = ConfigurationWatcher(config, interval=.01)
+        self.assertFalse(watcher.wait())
+
+        with open(path, "w") as stream:
+            stream.write("value: 12")
+
+        self.assertTrue(watcher.wait())
+        self.assertTrue(watcher.reload())
+        self.assertEqual(config["value"], 12)
+        self.assertFalse(watcher.wait())
+
+    def test_fragments(self):
+        local_root = tempfile.mkdtemp()
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        self.add_cleanup_path(local_root)
+        split = config.split_version()
+        directory = join(config.system_root, config.child_dir)
+        fragments = join(directory, "agent.d")
+        versioned_fragments = join(directory, split[0], "agent.d")
+        os.makedirs(fragments)
+        os.makedirs(versioned_fragments)
+        files = {
+            join(directory, "agent.yml"): "a: 1\nb: 1\nc: 1",
+            join(fragments, "20-host.yml"): "c: 3",
+            join(fragments, "10-pool.yml"): "b: 2\nc: 2",
+            join(fragments, ".10-pool.yml"): "b: hidden",
+            join(fragments, "README"): "b: ignored",
+            join(versioned_fragments, "agent.yml"): "a: 0\nd: 0"}
+
+        for path, data in files.items():
+            with open(path, "w") as stream:
+                stream.write(data)
+
+        self.assertEqual(config.files(), [
+            join(versioned_fragments, "agent.yml"),
+            join(directory, "agent.yml"),
+            join(fragments, "10-pool.yml"),
+            join(fragments, "20-host.yml")])
+        self.assertEqual(config.fragments(join(directory, split[1])), [])
+
+        config.load(environment={})
+        self.assertEqual(config, {"a": 1, "b": 2, "c": 3, "d": 0})
+
+        # Only the fragment which changed is parsed again
+        with open(join(fragments, "20-host.yml"), "w") as stream:
+            stream.write("c: 42")
+
+        config.reload(environment={})
+        self.assertEqual(config["c"], 42)
+        self.assertEqual(
+            [path for path in config.trace.paths
+             if not config.trace.files[path].cached],
+            [join(fragments, "20-host.yml")])
+
+    def test_load_merge_policies(self):
+        local_root = tempfile.mkdtemp()
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        config.merge_policies.update(
+            {"jobtypes": MERGE_DEEP, "jobtypes.paths": MERGE_APPEND})
+        self.add_cleanup_path(local_root)
+        split = config.split_version()
+        paths = [
+            join(config.system_root, config.child_dir, split[2], "agent.yml"),
+            join(config.system_root, config.child_dir, "agent.yml")]
+        contents = [
+            "jobtypes:\n  a: {b: 1, c: 1}\n  paths: [x]\nother: {a: 1}",
+            "jobtypes:\n  a: {c: 2}\n  paths: [y]\nother: {b: 1}"]
+
+        for path, data in zip(paths, contents):
+            try:
+                os.makedirs(dirname(path))
+            except OSError:
+                pass
+
+            with open(path, "w") as stream:
+                stream.write(data)
+
+        config.load()
+        self.assertEqual(
+            config["jobtypes"], {"a": {"b": 1, "c": 2}, "paths": ["x", "y"]})
+        self.assertEqual(config["other"], {"b": 1})
+        self.assertEqual(
+            config._parsed[paths[0]][1]["jobtypes"]["paths"], ["x"])
+
+    def test_schema(self):
+        config = Configuration("agent", "1.2.3")
+        config.register("port", int, default=50000)
+        config.register("ssl", bool)
+        config.register("hosts", list, default=[])
+        config.register("ratio", float, default=1.0)
+        config.register("name", converter=str.upper)
+        config.update(
+            port="$base_port", base_port="8080", ssl="yes",
+            ratio=0.5, hosts="a, b", name="agent")
+        config.apply_schema()
+        self.assertEqual(config["port"], 8080)
+        self.assertIs(config["ssl"], True)
+        self.assertEqual(config["hosts"], ["a", "b"])
+        self.assertEqual(config["ratio"], 0.5)
+        self.assertEqual(config["name"], "AGENT")
+
+    def test_schema_expands_strings_once(self):
+        config = Configuration("agent", "1.2.3")
+        config.register("literal", str)
+        config.register("path", str)
+        config.update(literal="$$HOME", path="$root/a", root="/tmp")
+        config.apply_schema()
+        self.assertEqual(config["literal"], "$HOME")
+        self.assertEqual(config["path"], "/tmp/a")
+
+        # Applying the schema again does not change anything
+        config.apply_schema()
+        self.assertEqual(config["literal"], "$HOME")
+        self.assertEqual(config.freeze()["literal"], "$HOME")
+
+    def test_schema_defaults(self):
+        config = Configuration("agent", "1.2.3")
+        config.register("port", int, default=50000)
+        config.apply_schema()
+        self.assertEqual(config["port"], 50000)
+
+    def test_schema_errors(self):
+        config = Configuration("agent", "1.2.3")
+        config.register("port", int)
+        config.register("ssl", bool)
+        config.register("required", int)
+        config.update(port="foo", ssl="maybe")
+
+        with self.assertRaises(TypeError) as context:
+            config.apply_schema()
+
+        message = str(context.exception)
+        self.assertIn("'port'", message)
+        self.assertIn("'ssl'", message)
+        self.assertIn("'required' is required", message)
+
+    def test_load_applies_schema(self):
+        local_root = tempfile.mkdtemp()
+        self.add_cleanup_path(local_root)
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        config.register("port", int)
+        path = join(config.system_root, config.child_dir, "agent.yml")
+        os.makedirs(dirname(path))
+
+        with open(path, "w") as stream:
+            stream.write("port: '42'")
+
+        config.load()
+        self.assertEqual(config["port"], 42)
+
+        with open(path, "w") as stream:
+            stream.write("port: foo")
+
+        with self.assertRaises(TypeError):
+            config.reload()
+
     def test_auto_version(self):
         distro = get_distribution("pyfarm.core")
         config = Configuration("pyfarm.core")
-        self.assertEqual(config.distribution, distro)
+        self.assertEqual(config.distribution.version, distro.version)
         self.assertEqual(config.version, distro.version)
         self.assertEqual(config.name, "core")
 
@@ -349,6 +1140,32 @@ class TestConfiguration(BaseTestCase):
         with self.assertRaises(ValueError):
             Configuration("foobar")
 
+    def test_lazy(self):
+        config = Configuration("pyfarm.core", lazy=True)
+        for attribute in Configuration.LAZY_ATTRIBUTES:
+            self.assertNotIn(attribute, config.__dict__)
+
+        self.assertEqual(
+            config.version, get_distribution("pyfarm.core").version)
+        self.assertIn("distribution", config.__dict__)
+        self.assertNotIn("tempdir", config.__dict__)
+        self.assertEqual(
+            config.tempdir,
+            join(config.DEFAULT_TEMP_DIRECTORY_ROOT, config.name))
+        self.assertTrue(os.path.isdir(config.tempdir))
+
+    def test_lazy_auto_version_fail(self):
+        config = Configuration("foobar", lazy=True)
+        self.assertEqual(config.name, "foobar")
+        with self.assertRaises(ValueError):
+            config.version
+
+    def test_lazy_attribute_assignment(self):
+        config = Configuration("agent", "1.2.3", lazy=True)
+        config.tempdir = self.tempdir
+        self.assertEqual(config.tempdir, self.tempdir)
+        self.assertIsNone(config.distribution)
+
     def test_tempdir(self):
         config = Configuration("pyfarm.core")
         self.assertEqual(
@@ -397,3 +1214,518 @@ class TestConfigurationExpansion(BaseTestCase):
         self.assertEqual(config["path"], "foo/bar/%s" % envvalue1)
         self.assertEqual(config["home"], expanduser("~/foo"))
         self.assertEqual(config["envvar2_expand"], "envvar2")
+
+    def test_expansion_cached(self):
+        config = Configuration("pyfarm.core")
+        config.update(foo="foo", foobar="$foo/bar")
+        self.assertEqual(config["foobar"], "foo/bar")
+        self.assertEqual(config._expansion_cache(), {"$foo/bar": "foo/bar"})
+        self.assertEqual(config.get("foobar"), "foo/bar")
+
+    def test_expansion_cache_invalidated_by_configuration(self):
+        config = Configuration("pyfarm.core")
+        config.update(foo="foo", foobar="$foo/bar")
+        self.assertEqual(config["foobar"], "foo/bar")
+        config["foo"] = "a"
+        self.assertEqual(config["foobar"], "a/bar")
+        config.pop("foo")
+        self.assertEqual(config["foobar"], "$foo/bar")
+        config.setdefault("foo", "b")
+        self.assertEqual(config["foobar"], "b/bar")
+
+    def test_expansion_cache_invalidated_by_env(self):
+        config = Configuration("pyfarm.core")
+        config.update(env={"foo": "foo"}, foobar="$foo/bar")
+        self.assertEqual(config["foobar"], "foo/bar")
+        dict.__getitem__(config, "env")["foo"] = "a"
+        self.assertEqual(config["foobar"], "a/bar")
+
+    def test_expansion_cache_invalidated_by_environ(self):
+        envvar = "a" + uuid.uuid4().hex
+        os.environ[envvar] = "foo"
+        config = Configuration("pyfarm.core")
+        config.update(foobar="$%s/bar" % envvar)
+        self.assertEqual(config["foobar"], "foo/bar")
+        os.environ[envvar] = "a"
+        self.assertEqual(config["foobar"], "a/bar")
+
+    def test_expansion_cache_checks_only_dependencies(self):
+        envvar = "a" + uuid.uuid4().hex
+        os.environ[envvar] = "foo"
+        self.addCleanup(os.environ.pop, envvar, None)
+        config = Configuration("pyfarm.core")
+        config.EXPAND_CONTAINERS = True
+        config.update(
+            a="a", plain="$a/x", uses="$%s/x" % envvar,
+            nested=["${%s}2" % envvar])
+        self.assertEqual(config["plain"], "a/x")
+        self.assertEqual(config["uses"], "foo/x")
+        results = config._expansion_results
+
+        # Changing an unrelated variable keeps the cache
+        os.environ["b" + envvar] = "1"
+        self.addCleanup(os.environ.pop, "b" + envvar, None)
+        self.assertEqual(config["plain"], "a/x")
+        self.assertIs(config._expansion_results, results)
+
+        # A value which was not cached yet still sees the new value
+        # of a variable resolved for another value.
+        os.environ[envvar] = "bar"
+        self.assertEqual(config["nested"][0], "bar2")
+        self.assertEqual(config["uses"], "bar/x")
+
+    def test_expansion_cache_missing_variable(self):
+        envvar = "a" + uuid.uuid4().hex
+        config = Configuration("pyfarm.core")
+        config.update(value="$%s/x" % envvar)
+        self.assertEqual(config["value"], "$%s/x" % envvar)
+        os.environ[envvar] = "foo"
+        self.addCleanup(os.environ.pop, envvar, None)
+        self.assertEqual(config["value"], "foo/x")
+
+    def test_invalidate(self):
+        config = Configuration("pyfarm.core")
+        config.update(a="a", b="$a")
+        self.assertEqual(config["b"], "a")
+        results = config._expansion_results
+        config.invalidate()
+        self.assertEqual(config["b"], "a")
+        self.assertIsNot(config._expansion_results, results)
+
+    def test_deep_expansion(self):
+        config = Configuration("pyfarm.core")
+        config["a0"] = "a"
+        for i in range(1, 50):
+            config["a%d" % i] = "$a%d/a" % (i - 1)
+        self.assertEqual(config["a49"], "/".join(["a"] * 50))
+
+    def test_expansion_braces_and_escapes(self):
+        config = Configuration("pyfarm.core")
+        config.update(
+            foo="foo", braced="${foo}bar", escaped="$$foo", number=1,
+            with_number="$number/$missing")
+        self.assertEqual(config["braced"], "foobar")
+        self.assertEqual(config["escaped"], "$foo")
+        self.assertEqual(config["with_number"], "1/$missing")
+
+    def test_expansion_cycle(self):
+        config = Configuration("pyfarm.core")
+        config.update(a="$b", b="${c}/x", c="$a", d="$d")
+
+        with self.assertRaises(ValueError) as context:
+            config["a"]
+        self.assertIn("$b -> $c -> $a -> $b", str(context.exception))
+
+        with self.assertRaises(ValueError) as context:
+            config.get("d")
+        self.assertIn("$d -> $d", str(context.exception))
+
+    def test_nested_not_expanded(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(root="/tmp", jobtypes={"name": "$root"}, paths=["a"])
+        jobtypes = config["jobtypes"]
+        self.assertIs(jobtypes, dict.__getitem__(config, "jobtypes"))
+        self.assertIsInstance(config["paths"], list)
+        self.assertEqual(config["paths"] + ["b"], ["a", "b"])
+        self.assertEqual(jobtypes["name"], "$root")
+
+        # The containers themselves are returned, as they always were,
+        # so changes are visible until the next reload().
+        config["jobtypes"]["other"] = 1
+        config["paths"].append("c")
+        self.assertEqual(config["jobtypes"], {"name": "$root", "other": 1})
+        self.assertEqual(config["paths"], ["a", "c"])
+        self.assertEqual(json.loads(dumps(config["jobtypes"])), jobtypes)
+
+        # Snapshots are still expanded
+        self.assertEqual(config.freeze()["jobtypes"]["name"], "/tmp")
+
+    def test_nested_json(self):
+        config = Configuration("agent", "1.2.3")
+        config.EXPAND_CONTAINERS = True
+        config.update(root="/tmp", jobtypes={"paths": ["$root/a"]})
+        self.assertEqual(
+            json.loads(dumps(config["jobtypes"])), {"paths": ["/tmp/a"]})
+        self.assertEqual(
+            json.loads(dumps(config["jobtypes"]["paths"])), ["/tmp/a"])
+        self.assertEqual(
+            json.loads(dumps({"jobtypes": config["jobtypes"]})),
+            {"jobtypes": {"paths": ["/tmp/a"]}})
+
+    def test_nested_views_are_read_only(self):
+        config = Configuration("agent", "1.2.3")
+        config.EXPAND_CONTAINERS = True
+        config.update(jobtypes={"name": "a"}, paths=["a"])
+
+        with self.assertRaises(TypeError):
+            config["jobtypes"]["name"] = "b"
+
+        with self.assertRaises(AttributeError):
+            config["paths"].append("b")
+
+        # Copies can be modified without changing the configuration
+        jobtypes = config["jobtypes"].expanded()
+        jobtypes["name"] = "b"
+        self.assertEqual(config["jobtypes"]["name"], "a")
+        self.assertEqual(config["paths"].expanded() + ["b"], ["a", "b"])
+
+    def test_nested(self):
+        config = Configuration("agent", "1.2.3")
+        config.EXPAND_CONTAINERS = True
+        config.update(
+            root="/tmp", number=1,
+            jobtypes={"paths": ["$root/a", ("$root/b", 2)], "name": "$root"})
+        jobtypes = config["jobtypes"]
+        self.assertIsInstance(jobtypes, ExpandingMapping)
+        self.assertIs(config.get("jobtypes"), jobtypes)
+        self.assertEqual(jobtypes["name"], "/tmp")
+        self.assertIsInstance(jobtypes["paths"], ExpandingSequence)
+        self.assertEqual(jobtypes["paths"][0], "/tmp/a")
+        self.assertEqual(jobtypes["paths"][1:], [("/tmp/b", 2)])
+        self.assertEqual(
+            jobtypes, {"paths": ["/tmp/a", ("/tmp/b", 2)], "name": "/tmp"})
+        self.assertEqual(
+            jobtypes.expanded(),
+            {"paths": ["/tmp/a", ("/tmp/b", 2)], "name": "/tmp"})
+        self.assertIsInstance(jobtypes.expanded()["paths"][1], tuple)
+
+        # The raw values are never modified
+        self.assertEqual(
+            dict.__getitem__(config, "jobtypes")["paths"][0], "$root/a")
+
+        # Views always reflect the current values
+        config["root"] = "/jobs"
+        self.assertEqual(jobtypes["paths"][0], "/jobs/a")
+
+    def test_nested_is_lazy(self):
+        config = Configuration("agent", "1.2.3")
+        config.EXPAND_CONTAINERS = True
+        config.update(a="a", nested={"b": "$a", "c": "$missing_${a}"})
+        view = config["nested"]
+        self.assertEqual(config._expansion_results, {})
+        self.assertEqual(view["b"], "a")
+        self.assertEqual(config._expansion_results, {"$a": "a"})
+
+    def test_nested_child(self):
+        config = Configuration("agent", "1.2.3")
+        config.EXPAND_CONTAINERS = True
+        config.update(root="/tmp", paths=["$root/a"])
+        job = config.child(root="/jobs/1")
+        self.assertEqual(job["paths"], ["/jobs/1/a"])
+        self.assertEqual(config["paths"], ["/tmp/a"])
+
+
+class TestFrozenConfiguration(BaseTestCase):
+    def test_freeze(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(root="/tmp", path="$root/foo", number=1)
+        self.assertIsNone(config.frozen)
+        frozen = config.freeze()
+        self.assertIsInstance(frozen, ImmutableDict)
+        self.assertIs(config.frozen, frozen)
+        self.assertEqual(
+            frozen, {"root": "/tmp", "path": "/tmp/foo", "number": 1})
+
+        with self.assertRaises(RuntimeError):
+            frozen["root"] = "/"
+
+        # Changes to the configuration are not visible until it's
+        # frozen again.
+        config["root"] = "/"
+        self.assertEqual(frozen["path"], "/tmp/foo")
+        self.assertEqual(config.freeze()["path"], "//foo")
+
+    def test_freeze_nested(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(root="/tmp", paths=["$root/a"])
+        frozen = config.freeze()
+        self.assertIsInstance(frozen["paths"], list)
+        config["root"] = "/"
+        self.assertEqual(frozen["paths"], ["/tmp/a"])
+
+    def test_reload_publishes(self):
+        local_root = tempfile.mkdtemp()
+        self.add_cleanup_path(local_root)
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        path = join(config.system_root, config.child_dir, "agent.yml")
+        os.makedirs(dirname(path))
+
+        with open(path, "w") as stream:
+            stream.write("value: 1")
+
+        config.load()
+        first = config.freeze()
+
+        with open(path, "w") as stream:
+            stream.write("value: 42")
+
+        config.reload()
+        self.assertIsNot(config.frozen, first)
+        self.assertEqual(first["value"], 1)
+        self.assertEqual(config.frozen["value"], 42)
+
+    def test_reload_circular_reference(self):
+        local_root = tempfile.mkdtemp()
+        self.add_cleanup_path(local_root)
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        path = join(config.system_root, config.child_dir, "agent.yml")
+        os.makedirs(dirname(path))
+
+        with open(path, "w") as stream:
+            stream.write("a: x")
+
+        config.load()
+        frozen = config.freeze()
+
+        with open(path, "w") as stream:
+            stream.write("a: $b\nb: $a")
+
+        # Nothing is published if the new data can't be frozen
+        with self.assertRaises(ValueError):
+            config.reload()
+
+        self.assertIs(config.frozen, frozen)
+        self.assertEqual(dict(config), {"a": "x"})
+
+    @skipIf(not hasattr(sys, "setswitchinterval"),
+            "sys.setswitchinterval() is not available")
+    def test_reload_is_atomic(self):
+        local_root = tempfile.mkdtemp()
+        self.add_cleanup_path(local_root)
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        config.user_root = None
+
+        # Four layers, each with their own keys, so a reload which
+        # clears the data first would leave keys missing for a while.
+        for layer, version in enumerate(("", "1", "1.2", "1.2.3")):
+            path = join(
+                config.system_root, config.child_dir, version, "agent.yml")
+            if not os.path.isdir(dirname(path)):
+                os.makedirs(dirname(path))
+            with open(path, "w") as stream:
+                stream.write("\n".join(
+                    "key%s_%s: %s" % (i, layer, layer) for i in range(3000)))
+
+        config.load(environment={})
+        keys = list(config)
+        frozen = config.freeze()
+        stop = threading.Event()
+        errors = []
+
+        def read():
+            while not stop.is_set():
+                try:
+                    for key in keys:
+                        config[key]
+                except KeyError as e:
+                    errors.append(e)
+
+        # Switch threads as often as possible so the readers
+        # run while the data is being replaced.
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+
+        try:
+            for _ in range(30):
+                config.reload(environment={})
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+            sys.setswitchinterval(interval)
+
+        self.assertEqual(errors, [])
+        self.assertIsNot(config.frozen, frozen)
+        self.assertEqual(config.frozen, frozen)
+
+
+class TestConfigurationOverlay(BaseTestCase):
+    def test_child(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(root="/tmp", path="$root/job", other=1)
+        job = config.child({"root": "/jobs/1"}, extra="$path/extra")
+        self.assertIs(job.parent, config)
+        self.assertEqual(job["path"], "/jobs/1/job")
+        self.assertEqual(job.get("extra"), "/jobs/1/job/extra")
+        self.assertEqual(job["other"], 1)
+        self.assertIsNone(job.get("missing"))
+        self.assertEqual(
+            sorted(job), ["extra", "other", "path", "root"])
+        self.assertEqual(len(job), 4)
+        self.assertEqual(config["path"], "/tmp/job")
+        self.assertNotIn("extra", config)
+
+    def test_child_of_child(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(a="a", b="b", ab="$a$b")
+        first = config.child(a="1")
+        second = first.child(b="2")
+        self.assertEqual(first["ab"], "1b")
+        self.assertEqual(second["ab"], "12")
+        self.assertEqual(second.raw("ab"), "$a$b")
+
+    def test_child_sees_parent_changes(self):
+        config = Configuration("agent", "1.2.3")
+        config.update(a="a", b="b", ab="$a$b")
+        child = config.child(a="1")
+        self.assertEqual(child["ab"], "1b")
+        config["b"] = "2"
+        self.assertEqual(child["ab"], "12")
+
+
+class TestConfigurationSet(BaseTestCase):
+    def setUp(self):
+        super(TestConfigurationSet, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.add_cleanup_path(self.root)
+        self.configurations = ConfigurationSet(
+            [("agent", "1.2.3"), ("master", "1.2.3"), ("jobtype", "1.0")],
+            cwd=self.root)
+
+        for config in self.configurations.values():
+            config.system_root = self.root
+            config.user_root = None
+            config.tempdir = self.root
+
+        self.paths = {
+            "agent": join(self.root, "pyfarm", "agent", "agent.yml"),
+            "master": join(
+                self.root, "pyfarm", "master", "1.2.3", "master.yml")}
+
+        for name, path in self.paths.items():
+            os.makedirs(dirname(path))
+            with open(path, "w") as stream:
+                stream.write("name: %s\nenv: {%s: 1}" % (name, name))
+
+    def test_mapping(self):
+        self.assertEqual(
+            list(self.configurations), ["agent", "master", "jobtype"])
+        self.assertEqual(len(self.configurations), 3)
+        for config in self.configurations.values():
+            self.assertIs(config.listing, self.configurations.listing)
+
+        with self.assertRaises(ValueError):
+            self.configurations.add("agent", "1.2.3")
+
+    def test_load(self):
+        environment = {}
+        self.configurations.load(environment=environment)
+        self.assertEqual(environment, {"agent": 1, "master": 1})
+        self.assertEqual(self.configurations["agent"], {"name": "agent"})
+        self.assertEqual(self.configurations["master"], {"name": "master"})
+        self.assertEqual(self.configurations["jobtype"], {})
+        self.assertEqual(
+            self.configurations["master"].loaded, (self.paths["master"], ))
+
+    def test_walk_skips_missing_roots(self):
+        self.configurations.walk()
+        listing = self.configurations.listing
+        jobtype = self.configurations["jobtype"]
+
+        for root in jobtype.roots():
+            self.assertIsNone(listing[root])
+
+        self.configurations.load()
+
+        # Nothing below the missing root was ever listed
+        for root in jobtype.roots():
+            for key in listing:
+                self.assertFalse(key.startswith(root + os.sep))
+
+    def test_load_trace(self):
+        self.configurations.load(environment={})
+        for name, path in self.paths.items():
+            trace = self.configurations[name].trace
+            self.assertEqual(list(trace.files), [path])
+            self.assertEqual(trace.files[path].stats, 1)
+            self.assertIn("parse", trace.stages)
+
+    def test_reload(self):
+        self.configurations.load(environment={}, snapshot=True)
+        jobtype = join(self.root, "pyfarm", "jobtype", "jobtype.yml")
+        os.makedirs(dirname(jobtype))
+        with open(jobtype, "w") as stream:
+            stream.write("name: jobtype")
+
+        self.configurations["agent"]["manual"] = True
+        self.configurations.reload(environment={}, snapshot=True)
+        self.assertEqual(self.configurations["agent"], {"name": "agent"})
+        self.assertEqual(self.configurations["jobtype"], {"name": "jobtype"})
+
+
+class TestSharedConfiguration(BaseTestCase):
+    def setUp(self):
+        super(TestSharedConfiguration, self).setUp()
+        self.config = Configuration("agent", "1.2.3")
+        self.config.update(
+            root="/tmp", path="$root/foo", number=1, nested={"a": [1, 2]})
+
+    def test_create(self):
+        shared = self.config.share()
+        self.addCleanup(shared.close)
+        self.assertEqual(len(shared), 4)
+        self.assertEqual(sorted(shared), ["nested", "number", "path", "root"])
+        self.assertEqual(shared["path"], "/tmp/foo")
+        self.assertEqual(shared["number"], 1)
+        self.assertEqual(shared["nested"], {"a": [1, 2]})
+        self.assertIsNone(shared.get("missing"))
+        self.assertNotIn(1, shared)
+        self.assertEqual(
+            dict(shared), dict((key, self.config[key]) for key in self.config))
+
+    def test_values_decoded_once(self):
+        shared = self.config.share()
+        self.addCleanup(shared.close)
+        self.assertIsInstance(shared.view, memoryview)
+        nested = shared["nested"]
+        self.assertIs(shared["nested"], nested)
+        self.assertEqual(shared._values, {"nested": nested})
+        self.assertNotIn("missing", shared)
+        self.assertEqual(shared._values, {"nested": nested})
+
+    def test_empty(self):
+        shared = SharedConfiguration.create({})
+        self.addCleanup(shared.close)
+        self.assertEqual(len(shared), 0)
+        self.assertNotIn("a", shared)
+
+    def test_create_from_mapping(self):
+        data = {"a": {"b": "$root"}, "c": ["$root"]}
+        shared = SharedConfiguration.create(data)
+        self.addCleanup(shared.close)
+        self.assertEqual(dict(shared), data)
+
+    def test_attach(self):
+        path = join(self.tempdir, "agent.shared")
+        shared = self.config.share(path)
+        self.addCleanup(shared.close)
+        attached = SharedConfiguration.attach(path)
+        self.addCleanup(attached.close)
+        self.assertEqual(dict(attached), dict(shared))
+
+    def test_invalid_buffer(self):
+        with self.assertRaises(ValueError):
+            SharedConfiguration(b"\0" * SharedConfiguration.HEADER.size)
+
+    def test_non_string_key(self):
+        self.config[1] = 1
+        with self.assertRaises(TypeError):
+            self.config.share()
+
+    @skipIf(not hasattr(os, "fork"), "fork() is not available")
+    def test_fork(self):
+        shared = self.config.share()
+        self.addCleanup(shared.close)
+        pid = os.fork()
+
+        if pid == 0:  # pragma: no cover
+            os._exit(0 if shared["path"] == "/tmp/foo" else 1)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
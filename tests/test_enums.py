@@ -15,6 +15,8 @@
 # limitations under the License.
 
 import sys
+import copy
+import pickle
 import warnings
 
 from pyfarm.core.enums import PY26
@@ -30,8 +32,8 @@ from pyfarm.core.enums import (
     PY2, PY3, PY27, PY_MAJOR, PY_MINOR, PY_VERSION,
     _OperatingSystem, _UseAgentAddress, DBUseAgentAddress,
     DBAgentState, DBOperatingSystem, DBWorkState, Enum,
-    Values, cast_enum, LINUX, MAC, WINDOWS, BSD, BOOLEAN_TRUE, BOOLEAN_FALSE,
-    INTEGER_TYPES)
+    Values, cast_enum, registered_enums, LINUX, MAC, WINDOWS, BSD,
+    BOOLEAN_TRUE, BOOLEAN_FALSE, INTEGER_TYPES)
 
 
 class TestEnums(TestCase):
@@ -225,6 +227,35 @@ class TestEnums(TestCase):
         with self.assertRaises(TypeError):
             cast_enum(e, None)
 
+    def test_cast_enum_cached(self):
+        Values.check_uniqueness = False
+        e = Enum("e", A=Values(-4243, "A"))
+        s = cast_enum(e, str)
+        self.assertIs(cast_enum(e, str), s)
+        self.assertIsNot(cast_enum(e, int), s)
+        self.assertIs(cast_enum(_AgentState, str), AgentState)
+        self.assertIs(cast_enum(_AgentState, int), DBAgentState)
+
+        # The cache is keyed by identity, not equality
+        other = Enum("e", A=Values(-4243, "A"))
+        self.assertEqual(other, e)
+        self.assertIsNot(cast_enum(other, str), s)
+
+        registered = dict(
+            (id(enum), casts) for enum, casts in registered_enums())
+        self.assertEqual(registered[id(e)], {str: s, int: cast_enum(e, int)})
+        self.assertEqual(
+            registered[id(_WorkState)], {str: WorkState, int: DBWorkState})
+
+    def test_cast_enum_contains(self):
+        for value in ("online", 202, _AgentState.ONLINE):
+            self.assertIn(value, AgentState)
+            self.assertIn(value, DBAgentState)
+
+        for value in ("missing", 999, _WorkState.DONE, None, []):
+            self.assertNotIn(value, AgentState)
+            self.assertNotIn(value, DBAgentState)
+
 
 class TestPythonVersion(TestCase):
     @skipUnless(sys.version_info[0:2] == (2, 6), "Not Python 2.6")
@@ -354,6 +385,42 @@ class TestEnumValueClass(TestCase):
         with self.assertRaises(NotImplementedError):
             self.assertLessEqual("", Values(1, "A"))
 
+    def test_interned(self):
+        self.assertIs(Values(1, "A"), Values(int=1, str="A"))
+        self.assertIsNot(Values(1, "A"), Values(1, "B"))
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertIs(
+                pickle.loads(pickle.dumps(_WorkState.DONE, protocol)),
+                _WorkState.DONE)
+
+        value = Values(9001, "x")
+        Values.check_uniqueness = True
+        self.assertIs(pickle.loads(pickle.dumps(value, 0)), value)
+        self.assertIs(copy.copy(value), value)
+        with self.assertRaises(ValueError):
+            Values(9001, "x")
+
+    def test_make_replace(self):
+        value = Values(9002, "x")
+        self.assertIs(Values._make((9002, "x")), value)
+        replaced = value._replace(str="y")
+        self.assertIs(replaced, Values._make((9002, "y")))
+        self.assertEqual(replaced, "y")
+        self.assertEqual(replaced, 9002)
+        self.assertNotEqual(replaced, value)
+
+    def test_not_equal_operator(self):
+        self.assertFalse(Values(1, "A") != Values(1, "A"))
+        self.assertFalse(Values(1, "A") != "A")
+        self.assertFalse(Values(1, "A") != 1)
+        self.assertTrue(Values(1, "A") != "B")
+        self.assertTrue(Values(1, "A") != [])
+
+    def test_dictionary_key(self):
+        data = {Values(1, "A"): True}
+        self.assertTrue(data[Values(1, "A")])
+        self.assertTrue(data["A"])
+
     def test_contains(self):
         self.assertIn(1, Values(1, "A"))
         self.assertIn("A", Values(1, "A"))
@@ -0,0 +1,77 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import subprocess
+
+from pyfarm.core.enums import PY26
+
+if PY26:
+    from unittest2 import TestCase, skipIf
+else:
+    from unittest import TestCase, skipIf
+
+# Modules which are slow to import, or have side effects, and should
+# only be imported once they're used.
+DEFERRED_MODULES = (
+    "pkg_resources", "importlib.metadata", "yaml", "pprint", "colorama",
+    "logging.config", "tempfile", "ctypes")
+MARKER = "-- pyfarm.core imports --"
+
+
+@skipIf(sys.version_info[0:2] < (3, 7), "-X importtime requires Python 3.7+")
+class TestImportTime(TestCase):
+    def importtime(self, *modules):
+        """
+        Imports ``modules`` in a new interpreter with ``-X importtime`` and
+        returns a dictionary of the cumulative import time, in
+        microseconds, for each module imported as a result.
+        """
+        # The namespace package is imported before the marker so
+        # only the modules imported by pyfarm.core are included.
+        script = (
+            "import sys, pyfarm; "
+            "sys.stderr.write(%r + '\\n'); sys.stderr.flush(); "
+            "import %s" % (MARKER, ", ".join(modules)))
+        process = subprocess.Popen(
+            [sys.executable, "-X", "importtime", "-c", script],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        _, stderr = process.communicate()
+        lines = stderr.decode("utf-8").splitlines()
+        self.assertEqual(process.returncode, 0, "\n".join(lines))
+
+        imported = {}
+        for line in lines[lines.index(MARKER) + 1:]:
+            if line.startswith("import time:"):
+                _, cumulative, name = line.split("|")
+                imported[name.strip()] = int(cumulative)
+
+        return imported
+
+    def test_deferred_modules(self):
+        imported = self.importtime(
+            "pyfarm.core.config", "pyfarm.core.logger", "pyfarm.core.utility")
+
+        for module in DEFERRED_MODULES:
+            self.assertNotIn(
+                module, imported,
+                "%s was imported, pyfarm.core.config took %sus" % (
+                    module, imported.get("pyfarm.core.config")))
+
+    def test_enums(self):
+        imported = self.importtime("pyfarm.core.enums")
+        self.assertIn("pyfarm.core.enums", imported)
+        self.assertNotIn("logging", imported)
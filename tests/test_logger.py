@@ -15,8 +15,11 @@
 # limitations under the License.
 
 import os
+import sys
 import json
 import tempfile
+import subprocess
+from textwrap import dedent
 
 from pyfarm.core.enums import PY26, PY3
 
@@ -97,3 +100,65 @@ class TestLogger(unittest.TestCase):
 
 
 
+
+    def run_python(self, script, **environment):
+        env = os.environ.copy()
+        env.update(environment)
+        process = subprocess.Popen(
+            [sys.executable, "-c", dedent(script)], env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr)
+        return stdout.decode("utf-8")
+
+    def test_setup_deferred_until_first_record(self):
+        output = self.run_python("""
+            from pyfarm.core.logger import getLogger, config
+            logger = getLogger("deferred")
+            assert not config.CONFIGURED
+            logger.debug("first record")
+            assert config.CONFIGURED
+            assert not logger.filters
+            logger.debug("second record")
+            """)
+        self.assertIn("first record", output)
+        self.assertIn("second record", output)
+
+    def test_deferred_setup_respects_level(self):
+        output = self.run_python("""
+            from pyfarm.core.logger import getLogger
+            logger = getLogger("deferred")
+            logger.info("first record")
+            logger.warning("second record")
+            logger.info("third record")
+            """, PYFARM_ROOT_LOGLEVEL="WARNING")
+        self.assertNotIn("first record", output)
+        self.assertIn("second record", output)
+        self.assertNotIn("third record", output)
+
+    def test_application_configured_first(self):
+        output = self.run_python("""
+            import sys
+            import logging
+            from logging.config import dictConfig
+            from pyfarm.core.config import read_env
+            from pyfarm.core.logger import config
+
+            dictConfig({
+                "version": 1,
+                "disable_existing_loggers": False,
+                "formatters": {"app": {"format": "app: %(message)s"}},
+                "handlers": {
+                    "stdout": {
+                        "class": "logging.StreamHandler",
+                        "stream": "ext://sys.stdout",
+                        "formatter": "app"}},
+                "root": {"level": "INFO", "handlers": ["stdout"]}})
+            handlers = list(logging.getLogger().handlers)
+            read_env("PYFARM_UNSET_VARIABLE", "default")
+            assert config.CONFIGURED
+            assert logging.getLogger().handlers == handlers
+            logging.getLogger("myapp").info("application record")
+            """)
+        self.assertIn("app: application record", output)
+        self.assertIn("app: read_env('PYFARM_UNSET_VARIABLE')", output)
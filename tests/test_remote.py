@@ -0,0 +1,190 @@
+# No shebang line, this module is meant to be imported
+#
+# Copyright 2013 Oliver Palmer
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import tempfile
+from hashlib import sha1
+from os.path import join, dirname
+from threading import Thread, Event
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from pyfarm.core.config import Configuration
+from pyfarm.core.enums import NOTSET
+from pyfarm.core.remote import RemoteSource
+from pyfarm.core.testutil import TestCase
+
+
+class MasterHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get("If-None-Match"))
+
+        if server.status != 200:
+            self.send_response(server.status)
+            self.end_headers()
+            return
+
+        body = json.dumps(server.document).encode("utf-8")
+        etag = '"%s"' % sha1(body).hexdigest()
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRemoteSource(TestCase):
+    def setUp(self):
+        super(TestRemoteSource, self).setUp()
+        self.server = HTTPServer(("127.0.0.1", 0), MasterHandler)
+        self.server.document = {"a": 1, "env": {"REMOTE": "1"}}
+        self.server.status = 200
+        self.server.requests = []
+        self.thread = Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": .05})
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = "http://127.0.0.1:%s/config" % self.server.server_port
+
+        local_root = tempfile.mkdtemp()
+        self.add_cleanup_path(local_root)
+        self.config = self.configuration(local_root)
+        path = join(local_root, self.config.child_dir, "agent.yml")
+        os.makedirs(dirname(path))
+        with open(path, "w") as stream:
+            stream.write("a: 0\nb: 0")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(TestRemoteSource, self).tearDown()
+
+    def configuration(self, local_root):
+        config = Configuration("agent", "1.2.3")
+        config.system_root = local_root
+        config.user_root = None
+        config.tempdir = local_root
+        config.add_remote(self.url, interval=60)
+        return config
+
+    def test_load(self):
+        environment = {}
+        self.config.load(environment=environment)
+        self.assertEqual(self.config, {"a": 1, "b": 0})
+        self.assertEqual(environment, {"REMOTE": "1"})
+        self.assertEqual(self.config.loaded[-1], self.url)
+        self.assertEqual(self.server.requests, [None])
+        self.assertIn("remote", self.config.trace.stages)
+
+    def test_not_modified(self):
+        self.config.load(environment={})
+        source = self.config.remotes[0]
+        self.assertIsNotNone(source.etag)
+
+        self.config.reload(environment={})
+        self.assertEqual(self.server.requests, [None, source.etag])
+        trace = self.config.trace.files[self.url]
+        self.assertTrue(trace.cached)
+        self.assertEqual(trace.bytes, 0)
+        self.assertEqual(trace.parse_time, 0)
+        self.assertEqual(self.config["a"], 1)
+
+    def test_refresh(self):
+        self.config.load(environment={})
+        source = self.config.remotes[0]
+        self.assertFalse(source.due())
+        self.assertFalse(self.config.refresh(environment={}))
+        self.assertEqual(len(self.server.requests), 1)
+
+        # Unchanged, a single conditional request
+        self.assertFalse(self.config.refresh(environment={}, force=True))
+        self.assertEqual(len(self.server.requests), 2)
+
+        # Changed, the document is not requested a second time
+        self.server.document = {"a": 2}
+        changes = []
+        self.config.subscribe(lambda config, change: changes.append(change))
+        self.assertTrue(self.config.refresh(environment={}, force=True))
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.config["a"], 2)
+        self.assertEqual(changes[0].changed, frozenset(["a"]))
+
+    def test_cache_fallback(self):
+        self.config.load(environment={})
+        self.server.status = 503
+
+        # A new process can't reach the server so the cached
+        # document is used.
+        config = self.configuration(self.config.system_root)
+        config.load(environment={})
+        self.assertEqual(config["a"], 1)
+        self.assertEqual(self.server.requests[-1], self.config.remotes[0].etag)
+
+    def test_cache_not_modified(self):
+        self.config.load(environment={})
+        config = self.configuration(self.config.system_root)
+        config.load(environment={})
+        self.assertEqual(config["a"], 1)
+        self.assertTrue(config.trace.files[self.url].cached)
+
+    def test_unreachable(self):
+        self.server.status = 500
+        self.config.load(environment={})
+        self.assertEqual(self.config, {"a": 0, "b": 0})
+        self.assertIs(self.config.remotes[0].data, NOTSET)
+        self.assertNotIn(self.url, self.config.loaded)
+
+    def test_delay(self):
+        source = RemoteSource(self.url, interval=100, jitter=0.2)
+        delays = [source.delay() for _ in range(100)]
+        self.assertTrue(all(80 <= delay <= 120 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+        self.assertTrue(source.due())
+        source.next_refresh = 10
+        self.assertFalse(source.due(now=5))
+
+    def test_watch_remotes(self):
+        self.config.load(environment={})
+        self.config.remotes[0].next_refresh = 0
+        self.server.document = {"a": 3}
+        reloaded = Event()
+        watcher = self.config.watch_remotes(
+            environment={}, callback=lambda config: reloaded.set())
+        try:
+            self.assertTrue(reloaded.wait(5))
+            self.assertEqual(self.config["a"], 3)
+        finally:
+            watcher.stop()
+
+    def test_watch_remotes_requires_sources(self):
+        with self.assertRaises(ValueError):
+            Configuration("agent", "1.2.3").watch_remotes()